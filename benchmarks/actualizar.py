@@ -0,0 +1,349 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Benchmark de Actualizador.actualizar con versiones de firmas sinteticas.
+
+Genera una version inicial y una version nueva de tamaño configurable, las
+sirve desde un servidor HTTP local y las aplica sobre una base de datos
+PostgreSQL descartable. La version inicial se instala primero; lo que se mide
+es la aplicacion de la version nueva, que comparte con la instalada la
+fraccion de clases indicada por --solapamiento.
+
+Por cada corrida se informa el tiempo total, la cantidad de consultas, el
+pico de memoria residente y las filas escritas. Los resultados se guardan en
+formato JSON para comparar versiones del actualizador.
+
+Uso
+---------------
+    $ python benchmarks/actualizar.py --clases 1000 --redes 100000 \\
+          --puertos 10000 --solapamiento 0.9 --salida resultados.json
+
+Si no se indica --host se crea un cluster temporal con initdb (debe estar en
+el PATH y no puede ejecutarse como root). Con --host se usa un servidor
+existente y se crea en el una base de datos que se borra al terminar.
+'''
+from __future__ import print_function
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    from http.server import HTTPServer, SimpleHTTPRequestHandler
+except ImportError:
+    from BaseHTTPServer import HTTPServer
+    from SimpleHTTPServer import SimpleHTTPRequestHandler
+
+try:
+    from queue import Empty
+except ImportError:
+    from Queue import Empty
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import psycopg2
+from netcop.actualizador import config, models
+from netcop.actualizador.actualizador import Actualizador
+
+TABLAS = [models.ClaseTrafico, models.CIDR, models.Puerto, models.ClaseCIDR,
+          models.ClasePuerto]
+
+
+def generar_clase(azar, id_clase, redes, puertos, variante):
+    '''
+    Genera una clase de trafico con la cantidad de subredes y puertos
+    indicada, sin repetidos. La `variante` cambia el contenido sin cambiar
+    el tamaño.
+    '''
+    subredes = list()
+    vistas = set()
+    while len(subredes) < redes:
+        prefijo = azar.randint(8, 32)
+        direccion = azar.getrandbits(32) >> (32 - prefijo) << (32 - prefijo)
+        subred = "%d.%d.%d.%d/%d" % (direccion >> 24, direccion >> 16 & 0xff,
+                                     direccion >> 8 & 0xff, direccion & 0xff,
+                                     prefijo)
+        if subred not in vistas:
+            vistas.add(subred)
+            subredes.append(subred)
+    lista_puertos = list()
+    vistos = set()
+    # hay 65535 puertos por protocolo
+    while len(lista_puertos) < min(puertos, 2 * 65535):
+        puerto = "%d/%s" % (azar.randint(1, 65535),
+                            azar.choice(('tcp', 'udp')))
+        if puerto not in vistos:
+            vistos.add(puerto)
+            lista_puertos.append(puerto)
+    mitad_redes = len(subredes) // 2
+    mitad_puertos = len(lista_puertos) // 2
+    return {
+        'id': id_clase,
+        'nombre': 'bench%d' % id_clase,
+        'descripcion': 'clase de prueba %d.%d' % (id_clase, variante),
+        'activa': True,
+        'subredes_outside': subredes[:mitad_redes],
+        'subredes_inside': subredes[mitad_redes:],
+        'puertos_outside': lista_puertos[:mitad_puertos],
+        'puertos_inside': lista_puertos[mitad_puertos:],
+    }
+
+
+def generar_version(ruta, clases, redes, puertos, solapamiento, variante,
+                    semilla):
+    '''
+    Escribe en `ruta` una version con `clases` clases y en total `redes`
+    subredes y `puertos` puertos.
+
+    Las clases cuyo indice es menor a `solapamiento * clases` se generan
+    igual en todas las variantes; el resto cambia con `variante`.
+    '''
+    iguales = int(clases * solapamiento)
+    with open(ruta, 'w') as f:
+        f.write('{"version": "%d", "clases": [' % variante)
+        for i in range(clases):
+            # reparto las subredes y puertos lo mas parejo posible
+            cantidad_redes = redes // clases + (i < redes % clases)
+            cantidad_puertos = puertos // clases + (i < puertos % clases)
+            version = 0 if i < iguales else variante
+            azar = random.Random("%s-%d-%d" % (semilla, i, version))
+            clase = generar_clase(azar, i + 1, cantidad_redes,
+                                  cantidad_puertos, version)
+            if i:
+                f.write(',')
+            json.dump(clase, f)
+        f.write(']}')
+
+
+class Servidor(object):
+    '''
+    Servidor HTTP local que publica una version y su descarga.
+    '''
+
+    def __init__(self, directorio):
+        class Manejador(SimpleHTTPRequestHandler):
+            def translate_path(self, path):
+                return os.path.join(directorio,
+                                    path.split('?')[0].lstrip('/'))
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = HTTPServer(('127.0.0.1', 0), Manejador)
+        self.url = 'http://127.0.0.1:%d' % self.httpd.server_address[1]
+        self.hilo = threading.Thread(target=self.httpd.serve_forever)
+        self.hilo.daemon = True
+        self.hilo.start()
+
+    def cerrar(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class Cluster(object):
+    '''
+    Cluster PostgreSQL descartable creado con initdb en un directorio
+    temporal.
+    '''
+
+    def __init__(self):
+        self.directorio = tempfile.mkdtemp(prefix='netcop-pg-')
+        s = socket.socket()
+        s.bind(('127.0.0.1', 0))
+        self.puerto = s.getsockname()[1]
+        s.close()
+        datos = os.path.join(self.directorio, 'datos')
+        subprocess.check_call(['initdb', '-A', 'trust', '-U', 'postgres',
+                               '-D', datos], stdout=subprocess.PIPE)
+        subprocess.check_call([
+            'pg_ctl', '-w', '-D', datos, '-l',
+            os.path.join(self.directorio, 'log'),
+            '-o', "-F -p %d -k %s -c listen_addresses=''" %
+                  (self.puerto, self.directorio),
+            'start'], stdout=subprocess.PIPE)
+        self.parametros = {'host': self.directorio, 'port': self.puerto,
+                           'user': 'postgres'}
+
+    def cerrar(self):
+        subprocess.call(['pg_ctl', '-w', '-m', 'immediate', '-D',
+                         os.path.join(self.directorio, 'datos'), 'stop'],
+                        stdout=subprocess.PIPE)
+        shutil.rmtree(self.directorio, ignore_errors=True)
+
+
+def ejecutar_sql(parametros, sentencia, base='postgres'):
+    '''
+    Ejecuta una sentencia fuera de una transaccion.
+    '''
+    conexion = psycopg2.connect(dbname=base, **parametros)
+    conexion.autocommit = True
+    try:
+        cursor = conexion.cursor()
+        cursor.execute(sentencia)
+        if cursor.description:
+            return cursor.fetchall()
+    finally:
+        conexion.close()
+
+
+def filas_escritas(parametros, base):
+    '''
+    Devuelve la cantidad de filas insertadas, modificadas y borradas en las
+    tablas de la base desde que se creo.
+    '''
+    # las estadisticas se publican de forma asincronica
+    time.sleep(1)
+    return int(ejecutar_sql(parametros, '''
+        SELECT coalesce(sum(n_tup_ins + n_tup_upd + n_tup_del), 0)
+        FROM pg_stat_user_tables''', base)[0][0])
+
+
+def aplicar(directorio, url, parametros, base, carga, cola):
+    '''
+    Instala la version publicada y envia las mediciones por `cola`. Se
+    ejecuta en un proceso aparte para medir el pico de memoria de cada
+    corrida por separado. Si la aplicacion falla se envia el error.
+    '''
+    try:
+        config.NETCOP.update({
+            'local_version': os.path.join(directorio, 'version_local'),
+            'cache': os.path.join(directorio, 'cache'),
+            'url_version': url + '/version',
+            'url_download': url + '/descarga',
+            'carga': carga,
+            'reporte': os.path.join(directorio, 'reporte.json'),
+        })
+        models.db.init(base, **parametros)
+
+        inicio = time.time()
+        actualizador = Actualizador()
+        if actualizador.hay_actualizacion():
+            actualizador.actualizar()
+        duracion = time.time() - inicio
+        models.db.close()
+        memoria = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        reporte = actualizador.reporte.como_diccionario()
+        cola.put({'segundos': duracion, 'consultas': reporte['consultas'],
+                  'memoria_kb': memoria, 'fases': reporte['fases']})
+    except Exception as inst:
+        cola.put({'error': '%s: %s' % (type(inst).__name__, inst)})
+        raise
+
+
+def medir(args, parametros, directorio, servidor, variante):
+    '''
+    Publica la variante de la version y la aplica en un proceso aparte.
+    '''
+    # descarta los validadores HTTP de la corrida anterior
+    validadores = os.path.join(directorio, 'version_local.http')
+    if os.path.exists(validadores):
+        os.remove(validadores)
+    generar_version(os.path.join(directorio, 'descarga'), args.clases,
+                    args.redes, args.puertos, args.solapamiento, variante,
+                    args.semilla)
+    with open(os.path.join(directorio, 'version'), 'w') as f:
+        json.dump({'version': str(variante)}, f)
+    cola = multiprocessing.Queue()
+    proceso = multiprocessing.Process(
+        target=aplicar,
+        args=(directorio, servidor.url, parametros, args.base, args.carga,
+              cola))
+    proceso.start()
+    resultado = None
+    # si el proceso muere sin enviar nada no se espera para siempre
+    while resultado is None and (proceso.is_alive() or not cola.empty()):
+        try:
+            resultado = cola.get(timeout=1)
+        except Empty:
+            pass
+    proceso.join()
+    if proceso.exitcode or resultado is None or 'error' in resultado:
+        error = (resultado or {}).get('error',
+                                      'codigo %s' % proceso.exitcode)
+        raise RuntimeError("Fallo la aplicacion de la version %d: %s" %
+                           (variante, error))
+    resultado['bytes'] = os.path.getsize(os.path.join(directorio, 'descarga'))
+    return resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--clases', type=int, default=100)
+    parser.add_argument('--redes', type=int, default=1000)
+    parser.add_argument('--puertos', type=int, default=1000)
+    parser.add_argument('--solapamiento', type=float, default=0.9,
+                        help='fraccion de clases sin cambios (0 a 1)')
+    parser.add_argument('--repeticiones', type=int, default=1)
+    parser.add_argument('--carga', choices=('orm', 'copy', 'sombra'),
+                        default='orm')
+    parser.add_argument('--semilla', default='netcop')
+    parser.add_argument('--host', help='servidor PostgreSQL existente')
+    parser.add_argument('--port', type=int, default=5432)
+    parser.add_argument('--user', default='postgres')
+    parser.add_argument('--password', default='')
+    parser.add_argument('--salida', help='archivo JSON de resultados')
+    args = parser.parse_args()
+
+    directorio = tempfile.mkdtemp(prefix='netcop-bench-')
+    servidor = Servidor(directorio)
+    cluster = None
+    if args.host:
+        parametros = {'host': args.host, 'port': args.port,
+                      'user': args.user, 'password': args.password}
+    else:
+        cluster = Cluster()
+        parametros = cluster.parametros
+    args.base = 'netcop_bench_%d' % os.getpid()
+    resultados = list()
+    try:
+        for repeticion in range(args.repeticiones):
+            ejecutar_sql(parametros, 'CREATE DATABASE %s' % args.base)
+            try:
+                models.db.init(args.base, **parametros)
+                models.db.create_tables(TABLAS)
+                models.db.close()
+                shutil.rmtree(os.path.join(directorio, 'cache'), True)
+                if os.path.exists(os.path.join(directorio, 'version_local')):
+                    os.remove(os.path.join(directorio, 'version_local'))
+                # instala la version inicial y mide la siguiente
+                inicial = medir(args, parametros, directorio, servidor, 1)
+                antes = filas_escritas(parametros, args.base)
+                resultado = medir(args, parametros, directorio, servidor, 2)
+                resultado['filas'] = (filas_escritas(parametros, args.base) -
+                                      antes)
+                resultado['instalacion'] = inicial
+                resultados.append(resultado)
+                print("%d: %.2fs %d consultas %d filas %d KB" % (
+                    repeticion + 1, resultado['segundos'],
+                    resultado['consultas'], resultado['filas'],
+                    resultado['memoria_kb']))
+            finally:
+                ejecutar_sql(parametros, 'DROP DATABASE %s' % args.base)
+    finally:
+        servidor.cerrar()
+        if cluster is not None:
+            cluster.cerrar()
+        shutil.rmtree(directorio, ignore_errors=True)
+
+    if args.salida:
+        parametros_corrida = dict((k, getattr(args, k))
+                                  for k in ('clases', 'redes', 'puertos',
+                                            'solapamiento', 'carga',
+                                            'semilla'))
+        with open(args.salida, 'w') as f:
+            json.dump({'parametros': parametros_corrida,
+                       'fecha': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                       'resultados': resultados}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
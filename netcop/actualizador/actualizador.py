@@ -13,10 +13,62 @@ Las versiones se descargan en formato JSON.
 
 (c) 2016. Netcop. Universidad Nacional de la Matanza.
 '''
+import hashlib
+import json
+import os
+import re
 import sys
 import syslog
+import threading
+import time
+from multiprocessing.pool import ThreadPool
 import requests
-from . import config, models
+from . import cambios, config, lector, metricas, redes
+
+# cantidad de bytes que se leen por vez al descargar una actualizacion
+TROZO = 64 * 1024
+
+# el ORM y el driver de PostgreSQL solo se importan si hay una actualizacion
+# para aplicar; la consulta de version no los necesita
+MODELS = __name__.rsplit('.', 1)[0] + '.models'
+
+# valores de configuracion que habilitan una opcion
+SI = ('1', 'si', 'yes', 'true', 'on')
+
+
+class ErrorServidor(Exception):
+    '''
+    El servidor de actualizaciones respondio con un codigo de error.
+    '''
+    def __init__(self, codigo):
+        super(ErrorServidor, self).__init__("Respuesta del servidor: %d" %
+                                            codigo)
+        self.codigo = codigo
+
+
+class DescargaIncompleta(Exception):
+    '''
+    La descarga termino sin recibir el cuerpo completo de la respuesta.
+    '''
+    def __init__(self, recibidos, esperados):
+        super(DescargaIncompleta, self).__init__(
+            "Descarga incompleta: %d de %d bytes" % (recibidos, esperados))
+        self.recibidos = recibidos
+        self.esperados = esperados
+
+
+class DeltaInvalida(Exception):
+    '''
+    La actualizacion incremental enviada por el servidor no parte de la
+    version instalada.
+    '''
+
+
+class DestinosFallidos(Exception):
+    '''
+    La actualizacion no se pudo aplicar en alguna de las bases de datos
+    destino.
+    '''
 
 
 class Actualizador:
@@ -29,11 +81,62 @@ class Actualizador:
     '''
     version_actual = None
     version_ultima = None
+    # diccionarios {(direccion, prefijo): id_cidr} y
+    # {(numero, numero_fin, protocolo): id_puerto} validos durante una
+    # actualizacion
+    cache_cidr = None
+    cache_puerto = None
+    # diccionario {id_clase: digest} de las clases de sistema instaladas
+    digests = None
+    # sesion HTTP reutilizada por todas las consultas al servidor
+    sesion = None
+    # URL de descarga de los espejos que publicaron la version disponible
+    descargas = None
+    # hilo que espera a los espejos que no respondieron primero
+    consulta = None
+    # subredes eliminadas por agregacion en la ultima actualizacion
+    redes_agregadas = 0
+    # sentencias preparadas para aplicar las clases con el ORM
+    sentencias = None
+    # fuente de las versiones (ver el modulo fuentes), por defecto el
+    # servidor de firmas
+    fuente = None
+    # base de datos destino, None para la de config.DATABASE (ver
+    # `destinos`)
+    destino = None
+    # (leer, delta) de la ultima version obtenida de la fuente: leer() vuelve
+    # a generar sus clases y delta indica si es incremental
+    descarga = None
 
-    def __init__(self):
+    def __init__(self, destino=None):
         '''
         Obtiene la ultima version aplicada y la ultima version disponible.
         '''
+        self.destino = destino
+        self.reporte = self.nuevo_reporte()
+        self.cambios = cambios.Cambios()
+
+    def nuevo_reporte(self):
+        '''
+        Crea el reporte de mediciones de una ejecucion.
+        '''
+        return metricas.Reporte(self.consultas)
+
+    def consultas(self):
+        '''
+        Devuelve la cantidad de sentencias SQL ejecutadas, o cero si todavia
+        no se cargo el modulo models.
+        '''
+        models = sys.modules.get(MODELS)
+        return models.db.consultas if models else 0
+
+    def desconectar(self):
+        '''
+        Cierra la conexion a la base de datos si se llego a abrir.
+        '''
+        models = sys.modules.get(MODELS)
+        if models and not models.db.is_closed():
+            models.db.close()
 
     def obtener_version_actual(self):
         '''
@@ -44,14 +147,14 @@ class Actualizador:
         '''
         version = None
         try:
-            with open(config.NETCOP['local_version'], 'r') as f:
+            with open(self.archivo_version(), 'r') as f:
                 # solo leo los primeros 65 bytes porque el numero de version
                 # es un SHA256
                 version = f.read(65)
         except:
             syslog.syslog(syslog.LOG_WARNING,
                           "No se pudo leer el archivo %s" %
-                          config.NETCOP['local_version'])
+                          self.archivo_version())
         return version
 
     def guardar_version_actual(self):
@@ -62,100 +165,368 @@ class Actualizador:
         en config.LOCAL_VERSION.
         '''
         try:
-            with open(config.NETCOP['local_version'], 'w') as f:
+            with open(self.archivo_version(), 'w') as f:
                 f.write(self.version_actual)
         except:
             syslog.syslog(syslog.LOG_CRIT,
                           "No se pudo escribir en el archivo %s" %
-                          config.NETCOP['local_version'])
+                          self.archivo_version())
+
+    def archivo_version(self):
+        '''
+        Devuelve la ruta del archivo de versiones: config.LOCAL_VERSION o el
+        `local_version` del destino.
+        '''
+        if self.destino is not None:
+            return self.destino['local_version']
+        return config.NETCOP['local_version']
+
+    def destinos(self):
+        '''
+        Devuelve las bases de datos destino como diccionarios con los
+        parametros de conexion, 'nombre' y 'local_version'. Si solo se
+        configuro [database] devuelve una lista vacia y la actualizacion se
+        aplica directamente en ella.
+        '''
+        if not config.DESTINOS:
+            return []
+        principal = dict(config.DATABASE, nombre='database',
+                         local_version=config.NETCOP['local_version'])
+        return [principal] + [dict(destino, nombre=nombre)
+                              for nombre, destino
+                              in config.DESTINOS.items()]
+
+    def pendiente(self, version):
+        '''
+        Indica si hay que instalar `version`: si no es la instalada y no fue
+        revertida.
+        '''
+        if self.version_actual == version:
+            return False
+        if self.historial().descartada(version):
+            syslog.syslog(syslog.LOG_INFO,
+                          "La version %s fue revertida, se espera una nueva" %
+                          version[0:6])
+            return False
+        return True
 
     def hay_actualizacion(self):
         '''
         Devuelve verdadero si existe una nueva version de firmas para
         actualizar.
         '''
-        self.version_actual = self.obtener_version_actual()
-        self.version_disponible = self.obtener_version_disponible()
+        self.reporte = self.nuevo_reporte()
+        with self.reporte.fase('version'):
+            self.version_actual = self.obtener_version_actual()
+            self.version_disponible = self.obtener_fuente().version()
         if self.version_actual and self.version_disponible:
             syslog.syslog(
                 syslog.LOG_DEBUG,
                 "Version disponible: %s - Version aplicada: %s" %
                 (self.version_disponible[0:6], self.version_actual[0:6])
             )
-        return self.version_actual != self.version_disponible
+        if self.destinos():
+            return any(self.pendientes())
+        return self.pendiente(self.version_disponible)
 
     def aplicar_actualizacion(self, nueva):
         '''
         Guarda los cambios en la clase de trafico.
+
+        Si el digest de la clase coincide con el de la clase instalada no se
+        modifica nada y se devuelve None.
+
+        La clase se crea o modifica con una unica sentencia preparada; las
+        escrituras de sus enlaces se envian en lote junto con las de otras
+        clases si self.sentencias difiere el envio (ver el modulo
+        preparadas).
+
+        Los cambios realizados se registran en self.cambios.
         '''
+        from . import models
         assert nueva.get('id') is not None
-        clase, creada = models.ClaseTrafico.create_or_get(
+        if nueva.get('eliminada'):
+            return self.eliminar_clase(nueva)
+        digest = self.digest(nueva)
+        if self.obtener_digests().get(nueva["id"]) == digest:
+            self.cambios.sin_cambios.add(nueva["id"])
+            return None
+        clase = models.ClaseTrafico(
             id_clase=nueva["id"],
             nombre=nueva.get("nombre", ""),
             descripcion=nueva.get("descripcion", ""),
             activa=nueva.get("activa", True),
+            digest=digest,
         )
+        sentencias = self.obtener_sentencias()
+        fila = sentencias.ejecutar('netcop_guardar_clase', clase.id_clase,
+                                   clase.nombre, clase.descripcion,
+                                   clase.activa, digest).fetchone()
 
         # si se quiere modificar una clase que no sea de sistema
-        if clase.tipo != clase.SISTEMA:
+        if fila is None:
             syslog.syslog(syslog.LOG_CRIT,
                           "Intentando actualizar la clase personalizada %d" %
                           nueva["id"])
+            return models.ClaseTrafico.get(
+                models.ClaseTrafico.id_clase == nueva["id"])
+        if fila[0] == 'modificada':
+            self.cambios.modificadas.add(clase.id_clase)
         else:
-            # si la clase existe actualizo sus campos
-            if not creada:
-                clase.nombre = nueva.get("nombre", "")
-                clase.descripcion = nueva.get("descripcion", "")
-                clase.activa = nueva.get("activa", True)
-                clase.save()
-            self.actualizar_colecciones(clase, nueva)
+            self.cambios.creadas.add(clase.id_clase)
+        self.actualizar_colecciones(clase, nueva)
+        sentencias.terminar_clase()
         return clase
 
+    def obtener_sentencias(self):
+        '''
+        Devuelve las sentencias preparadas. Fuera de `aplicar` las escrituras
+        se envian al terminar cada clase.
+        '''
+        from . import preparadas
+        if self.sentencias is None:
+            self.sentencias = preparadas.Sentencias()
+        return self.sentencias
+
+    def digest(self, nueva):
+        '''
+        Calcula el SHA256 de la forma canonica de una clase de trafico: su
+        nombre, descripcion, estado y las listas ordenadas de subredes y
+        puertos.
+        '''
+        listas = ('subredes_outside', 'subredes_inside',
+                  'puertos_outside', 'puertos_inside')
+        canonica = dict((lista, sorted(nueva.get(lista, [])))
+                        for lista in listas)
+        canonica['nombre'] = nueva.get("nombre", "")
+        canonica['descripcion'] = nueva.get("descripcion", "")
+        canonica['activa'] = nueva.get("activa", True)
+        if self.agregar_redes():
+            # al cambiar la opcion las clases se vuelven a aplicar
+            canonica['agregar_redes'] = True
+        texto = json.dumps(canonica, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(texto.encode('utf-8')).hexdigest()
+
+    def obtener_digests(self):
+        '''
+        Devuelve los digests de las clases de sistema instaladas. La primera
+        vez los carga todos con una sola consulta.
+        '''
+        from . import models
+        if self.digests is None:
+            self.digests = dict(
+                models.ClaseTrafico
+                      .select(models.ClaseTrafico.id_clase,
+                              models.ClaseTrafico.digest)
+                      .where(models.ClaseTrafico.tipo ==
+                             models.ClaseTrafico.SISTEMA,
+                             models.ClaseTrafico.digest.is_null(False))
+                      .tuples()
+            )
+        return self.digests
+
+    def eliminar_clase(self, nueva):
+        '''
+        Desactiva una clase de trafico que fue eliminada del repositorio de
+        firmas. Las clases personalizadas no se modifican.
+        '''
+        cursor = self.obtener_sentencias().ejecutar('netcop_desactivar_clase',
+                                                    nueva["id"])
+        if cursor.rowcount:
+            self.cambios.desactivadas.add(nueva["id"])
+
     def actualizar_colecciones(self, clase, nueva):
         '''
         Actualiza las listas de subredes y puertos de la clase de trafico.
+
+        Los enlaces existentes de ambas listas se cargan con una sola
+        consulta.
         '''
-        (models.ClaseCIDR
-               .delete()
-               .where(models.ClaseCIDR.clase == clase)
-               .execute())
-        (models.ClasePuerto
-               .delete()
-               .where(models.ClasePuerto.clase == clase)
-               .execute())
-        self.actualizar_redes(clase, nueva)
-        self.actualizar_puertos(clase, nueva)
+        existentes = {'redes': dict(), 'puertos': dict()}
+        cursor = self.obtener_sentencias().ejecutar('netcop_enlaces',
+                                                    clase.id_clase)
+        for (tipo, id_dimension, grupo) in cursor:
+            existentes[tipo][id_dimension] = grupo
+        self.actualizar_redes(clase, nueva, existentes['redes'])
+        self.actualizar_puertos(clase, nueva, existentes['puertos'])
 
-    def actualizar_redes(self, clase, nueva):
+    def actualizar_redes(self, clase, nueva, existentes):
         '''
         Actualiza las listas de subredes de la clase de trafico.
         '''
-        redes = (('subredes_outside', models.OUTSIDE),
-                 ('subredes_inside', models.INSIDE))
-        for lista, grupo in redes:
-            for item in nueva.get(lista, []):
-                (direccion, prefijo) = item.split('/')
-                cidr = models.CIDR.get_or_create(direccion=direccion,
-                                                 prefijo=prefijo)[0]
-                models.ClaseCIDR.create_or_get(clase=clase, cidr=cidr,
-                                               grupo=grupo)
+        claves = [((direccion, prefijo), grupo)
+                  for (direccion, prefijo, grupo) in self.redes(nueva)]
+        ids = self.obtener_cidrs([clave for clave, _ in claves])
+        nuevos = dict()
+        for id_cidr, (_, grupo) in zip(ids, claves):
+            # la clave primaria es (clase, cidr), gana el primer grupo
+            nuevos.setdefault(id_cidr, grupo)
+        self.cambios.enlazar('redes', clase.id_clase,
+                             *self.reconciliar('redes', clase, existentes,
+                                               nuevos))
 
-    def actualizar_puertos(self, clase, nueva):
+    def actualizar_puertos(self, clase, nueva, existentes):
         '''
         Actualiza las listas de puertos de la clase de trafico.
         '''
+        claves = [((numero, numero_fin, protocolo), grupo)
+                  for (numero, numero_fin, protocolo, grupo)
+                  in self.puertos(nueva)]
+        ids = self.obtener_puertos([clave for clave, _ in claves])
+        nuevos = dict()
+        for id_puerto, (_, grupo) in zip(ids, claves):
+            # la clave primaria es (clase, puerto), gana el primer grupo
+            nuevos.setdefault(id_puerto, grupo)
+        self.cambios.enlazar('puertos', clase.id_clase,
+                             *self.reconciliar('puertos', clase, existentes,
+                                               nuevos))
+
+    def redes(self, nueva):
+        '''
+        Genera las subredes normalizadas de la clase de trafico como tuplas
+        (direccion, prefijo, grupo).
+
+        Si config.NETCOP['agregar_redes'] esta habilitado, las subredes de
+        cada grupo que se solapan o son adyacentes se unen en una sola.
+        '''
+        from . import models
+        grupos = (('subredes_outside', models.OUTSIDE),
+                  ('subredes_inside', models.INSIDE))
+        for lista, grupo in grupos:
+            subredes = [redes.interpretar(item)
+                        for item in nueva.get(lista, [])]
+            if self.agregar_redes():
+                agregadas = redes.agregar(subredes)
+                self.redes_agregadas += len(subredes) - len(agregadas)
+                subredes = agregadas
+            for red in subredes:
+                yield (str(red.network_address), red.prefixlen, grupo)
+
+    def agregar_redes(self):
+        '''
+        Indica si esta habilitada la agregacion de subredes.
+        '''
+        return config.NETCOP['agregar_redes'].lower() in SI
+
+    def puertos(self, nueva):
+        '''
+        Genera los puertos de la clase de trafico como tuplas
+        (numero, numero_fin, protocolo, grupo).
+
+        Los puertos se escriben "numero/protocolo" o, para un rango,
+        "inicio-fin/protocolo".
+        '''
+        from . import models
         puertos = (('puertos_outside', models.OUTSIDE),
                    ('puertos_inside', models.INSIDE))
         for lista, grupo in puertos:
             for item in nueva.get(lista, []):
                 s = item.split('/')
-                numero = s[0]
+                (numero, numero_fin) = self.rango(s[0])
                 proto = s[1] if len(s) == 2 else ""
-                protocolo = self.protocolo(proto)
-                puerto = models.Puerto.get_or_create(numero=numero,
-                                                     protocolo=protocolo)[0]
-                models.ClasePuerto.create_or_get(clase=clase, puerto=puerto,
-                                                 grupo=grupo)
+                yield (numero, numero_fin, self.protocolo(proto), grupo)
+
+    def rango(self, string):
+        '''
+        Obtiene el rango (inicio, fin) de "numero" o "inicio-fin".
+        '''
+        limites = string.split('-')
+        if len(limites) > 2:
+            raise ValueError("Rango de puertos invalido: %s" % string)
+        inicio, fin = int(limites[0]), int(limites[-1])
+        if inicio > fin:
+            raise ValueError("Rango de puertos invalido: %s" % string)
+        return (inicio, fin)
+
+    def obtener_cidrs(self, claves):
+        '''
+        Devuelve los id_cidr de una lista de claves (direccion, prefijo).
+
+        La primera vez carga todos los CIDR existentes con una sola consulta;
+        los que falten se insertan juntos.
+        '''
+        from . import models
+        if self.cache_cidr is None:
+            self.cache_cidr = dict(
+                ((direccion, prefijo), id_cidr)
+                for (id_cidr, direccion, prefijo)
+                in models.CIDR.select(models.CIDR.id_cidr,
+                                      models.CIDR.direccion,
+                                      models.CIDR.prefijo).tuples()
+            )
+        return self.resolver(self.cache_cidr, models.CIDR,
+                             (models.CIDR.direccion, models.CIDR.prefijo),
+                             claves)
+
+    def obtener_puertos(self, claves):
+        '''
+        Devuelve los id_puerto de una lista de claves
+        (numero, numero_fin, protocolo).
+
+        La primera vez carga todos los puertos existentes con una sola
+        consulta; los que falten se insertan juntos.
+        '''
+        from . import models
+        if self.cache_puerto is None:
+            self.cache_puerto = dict(
+                ((numero, numero_fin, protocolo), id_puerto)
+                for (id_puerto, numero, numero_fin, protocolo)
+                in models.Puerto.select(models.Puerto.id_puerto,
+                                        models.Puerto.numero,
+                                        models.Puerto.numero_fin,
+                                        models.Puerto.protocolo).tuples()
+            )
+        return self.resolver(self.cache_puerto, models.Puerto,
+                             (models.Puerto.numero, models.Puerto.numero_fin,
+                              models.Puerto.protocolo),
+                             claves)
+
+    def resolver(self, cache, modelo, campos, claves):
+        '''
+        Traduce claves a identificadores usando `cache`. Las claves que no
+        esten se insertan en `modelo` con un unico INSERT ... RETURNING y se
+        agregan al cache.
+        '''
+        faltan = list(set(clave for clave in claves if clave not in cache))
+        if faltan:
+            pk = modelo._meta.primary_key
+            filas = [dict((campo.name, valor)
+                          for campo, valor in zip(campos, clave))
+                     for clave in faltan]
+            query = (modelo.insert_many(filas)
+                           .returning(pk, *campos)
+                           .tuples())
+            for fila in query.execute():
+                cache[tuple(fila[1:])] = fila[0]
+        return [cache[clave] for clave in claves]
+
+    def reconciliar(self, tipo, clase, existentes, nuevos):
+        '''
+        Sincroniza los enlaces de la clase de trafico con los recibidos en la
+        actualizacion.
+
+        Compara los enlaces `existentes` con `nuevos`, ambos diccionarios
+        {id: grupo}, de `tipo` 'redes' o 'puertos'. Solo se borran los
+        enlaces que ya no estan (o cambiaron de grupo) y solo se insertan
+        los que faltan; ambas escrituras se acumulan en las sentencias
+        preparadas.
+
+        Devuelve los enlaces agregados y eliminados como diccionarios
+        {id: grupo}.
+        '''
+        sentencias = self.obtener_sentencias()
+        viejos = sorted(k for k, grupo in existentes.items()
+                        if nuevos.get(k) != grupo)
+        faltan = sorted((k, grupo) for k, grupo in nuevos.items()
+                        if existentes.get(k) != grupo)
+        if viejos:
+            sentencias.acumular('netcop_borrar_' + tipo, clase.id_clase,
+                                viejos)
+        if faltan:
+            sentencias.acumular('netcop_enlazar_' + tipo, clase.id_clase,
+                                [k for k, _ in faltan],
+                                [grupo for _, grupo in faltan])
+        return (dict(faltan), dict((k, existentes[k]) for k in viejos))
 
     def protocolo(self, string):
         '''
@@ -173,50 +544,856 @@ class Actualizador:
             return 17
         return 0
 
-    @models.db.atomic()
     def actualizar(self):
         '''
         Aplica la actualizacion de la base de firmas a la ultima version
         disponible.
 
-        Devuelve verdadero si alguna clase fue modificada
+        Primero pide al servidor solo las diferencias con la version
+        instalada; si el servidor responde con una actualizacion incremental
+        que no parte de esa version, se descarga la version completa.
+
+        Devuelve los cambios aplicados (ver el modulo cambios), que se
+        evaluan como falso si ninguna clase fue creada, modificada ni
+        desactivada.
         '''
         syslog.syslog(syslog.LOG_DEBUG, "Actualizando a la version: %s" %
                                         self.version_disponible[0:6])
+        if self.destinos():
+            return self.actualizar_destinos()
+        self.descarga = None
+        fuente = self.obtener_fuente()
+        try:
+            # descarga y aplica la actualizacion
+            try:
+                clases = self.obtener_clases(fuente, delta=True)
+                inicio = time.time()
+                self.aplicar(clases)
+            except DeltaInvalida as inst:
+                syslog.syslog(syslog.LOG_WARNING,
+                              "Actualizacion incremental descartada: %s" %
+                              inst)
+                fuente.descartar(delta=True)
+                clases = self.obtener_clases(fuente)
+                inicio = time.time()
+                self.aplicar(clases)
+            segundos = time.time() - inicio
+
+            # el indice se reemplaza antes que la version, si falla la
+            # proxima ejecucion vuelve a intentarlo
+            with self.reporte.fase('indice'):
+                self.guardar_indice(self.version_disponible)
 
-        # descarga y aplica la actualizacion
-        for clase in self.descargar_actualizacion():
-            self.aplicar_actualizacion(clase)
+            # la descarga todavia esta en el cache y la version instalada
+            # es la anterior
+            with self.reporte.fase('historial'):
+                self.registrar_historial(segundos)
 
-        # guarda ultima version en el archivo de versiones
-        self.version_actual = self.version_disponible
-        self.guardar_version_actual()
-        syslog.syslog(syslog.LOG_INFO, "La actualización fue exitosa")
+            # guarda ultima version en el archivo de versiones
+            with self.reporte.fase('guardado'):
+                self.version_actual = self.version_disponible
+                self.guardar_version_actual()
+                self.limpiar_cache()
+        except Exception as inst:
+            self.reporte.error = "%s" % inst
+            raise
+        finally:
+            self.guardar_reporte()
+        syslog.syslog(syslog.LOG_INFO, "La actualización fue exitosa: %s" %
+                      self.cambios.resumen())
+        return self.cambios
+
+    def obtener_clases(self, fuente, delta=False, cargar=False):
+        '''
+        Obtiene de la fuente las clases de la version disponible, las valida
+        y las devuelve; si `cargar` es verdadero se cargan en memoria.
+
+        Si la version no se puede leer o no es valida se descarta la
+        descarga guardada, para que la proxima ejecucion la vuelva a pedir
+        en lugar de fallar siempre igual.
+        '''
+        try:
+            with self.reporte.fase('descarga'):
+                clases = fuente.clases(delta=delta)
+                if cargar:
+                    clases = list(clases)
+            with self.reporte.fase('validacion'):
+                return self.validar(clases)
+        except Exception:
+            fuente.descartar(delta=delta)
+            raise
+
+    def validar(self, clases):
+        '''
+        Valida la version completa antes de aplicarla (ver el modulo
+        validacion) y devuelve las clases a aplicar. Lanza
+        validacion.VersionInvalida con todos los errores encontrados.
+
+        Si la version se puede volver a leer de la fuente se valida en una
+        lectura aparte y se devuelve `clases` sin consumir; si no, las
+        clases se cargan en memoria.
+        '''
+        from . import validacion
+        procesos = int(config.NETCOP['procesos'])
+        if self.descarga is None or isinstance(clases, list):
+            clases = list(clases)
+            validacion.validar(clases, procesos)
+        else:
+            validacion.validar(self.descarga[0](), procesos)
+        return clases
+
+    def pendientes(self):
+        '''
+        Devuelve un actualizador por cada destino que no tenga instalada la
+        version disponible.
+        '''
+        hijos = [Actualizador(destino) for destino in self.destinos()]
+        for hijo in hijos:
+            hijo.version_actual = hijo.obtener_version_actual()
+        return [hijo for hijo in hijos
+                if hijo.pendiente(self.version_disponible)]
+
+    def actualizar_destinos(self):
+        '''
+        Aplica la version disponible en todos los destinos que no la tengan
+        instalada.
+
+        La version se descarga y se lee una sola vez y se aplica en paralelo
+        con un hilo, una conexion y una transaccion por destino. La version
+        de cada destino se guarda recien cuando se confirma su transaccion;
+        los destinos que fallan no impiden actualizar los demas y vuelven a
+        intentarse en la proxima ejecucion.
+
+        El resultado de cada destino se guarda en el reporte. Devuelve los
+        cambios aplicados en la base de config.DATABASE; si fallo algun
+        destino lanza DestinosFallidos.
+        '''
+        pendientes = self.pendientes()
+        # la actualizacion incremental solo sirve si todos los destinos
+        # parten de la misma version
+        bases = set(hijo.version_actual for hijo in pendientes)
+        self.version_actual = bases.pop() if len(bases) == 1 else None
+        self.descarga = None
+        self.cambios = cambios.Cambios()
+        fuente = self.obtener_fuente()
+        try:
+            try:
+                clases = self.obtener_clases(fuente, delta=True, cargar=True)
+            except DeltaInvalida as inst:
+                syslog.syslog(syslog.LOG_WARNING,
+                              "Actualizacion incremental descartada: %s" %
+                              inst)
+                fuente.descartar(delta=True)
+                clases = self.obtener_clases(fuente, cargar=True)
+
+            with self.reporte.fase('destinos'):
+                pool = ThreadPool(max(len(pendientes), 1))
+                try:
+                    errores = pool.map(
+                        lambda hijo: hijo.aplicar_destino(
+                            clases, self.version_disponible, self.descarga),
+                        pendientes)
+                finally:
+                    pool.close()
+            fallidos = list()
+            for hijo, error in zip(pendientes, errores):
+                nombre = hijo.destino['nombre']
+                self.reporte.destino(nombre, hijo.reporte,
+                                     hijo.cambios.resumen())
+                if error is not None:
+                    fallidos.append(nombre)
+                elif hijo.destino['local_version'] == \
+                        config.NETCOP['local_version']:
+                    self.cambios = hijo.cambios
+
+            with self.reporte.fase('guardado'):
+                self.version_actual = self.version_disponible
+                self.limpiar_cache()
+            if fallidos:
+                raise DestinosFallidos("No se pudo actualizar: %s" %
+                                       ", ".join(fallidos))
+        except Exception as inst:
+            self.reporte.error = "%s" % inst
+            raise
+        finally:
+            self.guardar_reporte()
+        return self.cambios
+
+    def aplicar_destino(self, clases, version, descarga):
+        '''
+        Aplica en el destino las clases ya leidas de `version` y guarda su
+        indice, su historial y su version. Se ejecuta en un hilo propio, que
+        se conecta a la base del destino y cierra la conexion al terminar.
+
+        Devuelve None o la excepcion que impidio actualizar el destino.
+        '''
+        from . import models
+        self.reporte = self.nuevo_reporte()
+        self.version_disponible = version
+        self.descarga = descarga
+        nombre = self.destino['nombre']
+        models.db.usar(self.destino)
+        try:
+            inicio = time.time()
+            self.aplicar(clases)
+            segundos = time.time() - inicio
+            with self.reporte.fase('indice'):
+                self.guardar_indice(version)
+            with self.reporte.fase('historial'):
+                self.registrar_historial(segundos)
+            with self.reporte.fase('guardado'):
+                self.version_actual = version
+                self.guardar_version_actual()
+        except Exception as inst:
+            self.reporte.error = "%s" % inst
+            syslog.syslog(syslog.LOG_CRIT,
+                          "No se pudo actualizar el destino %s: %s" %
+                          (nombre, inst))
+            return inst
+        finally:
+            self.desconectar()
+            models.db.usar(None)
+        syslog.syslog(syslog.LOG_INFO, "Destino %s actualizado: %s" %
+                                       (nombre, self.cambios.resumen()))
+        return None
+
+    def aplicar(self, clases):
+        '''
+        Aplica todas las clases de trafico descargadas en una unica
+        transaccion.
+
+        Si config.NETCOP['carga'] es "copy" se usa la carga masiva del modulo
+        carga en lugar de aplicar las clases de a una. Si es "sombra" se usa
+        la carga en tablas sombra del modulo sombra, que maneja sus propias
+        transacciones.
+        '''
+        from . import carga, migraciones, models, preparadas, sombra
+        self.redes_agregadas = 0
+        self.cambios = cambios.Cambios()
+        if config.NETCOP['carga'] == 'sombra':
+            sombra.CargaSombra(self).aplicar(clases)
+            self.avisar_agregacion()
+            return
+        with models.db.atomic():
+            migraciones.migrar()
+            # los caches solo son validos dentro de la transaccion
+            self.cache_cidr = None
+            self.cache_puerto = None
+            self.digests = None
+            self.cambios = cambios.Cambios()
+            if config.NETCOP['carga'] == 'copy':
+                carga.CargaMasiva(self).aplicar(clases)
+            else:
+                # las escrituras de enlaces se envian en lotes
+                self.sentencias = preparadas.Sentencias(diferir=True)
+                try:
+                    for clase in self.reporte.iterar('lectura', clases):
+                        with self.reporte.fase('aplicacion'):
+                            inicio = time.time()
+                            self.aplicar_actualizacion(clase)
+                            self.reporte.clase(clase.get('id'),
+                                               time.time() - inicio)
+                    with self.reporte.fase('aplicacion'):
+                        self.sentencias.enviar()
+                finally:
+                    self.sentencias = None
+            with self.reporte.fase('cambios'):
+                self.cambios.resolver()
+            self.reporte.iniciar('commit')
+        self.reporte.terminar('commit')
+        self.avisar_agregacion()
+
+    def avisar_agregacion(self):
+        '''
+        Registra en syslog las subredes eliminadas por agregacion.
+        '''
+        if self.agregar_redes():
+            syslog.syslog(syslog.LOG_INFO,
+                          "Subredes eliminadas por agregacion: %d" %
+                          self.redes_agregadas)
+
+    def guardar_reporte(self):
+        '''
+        Guarda el reporte de la ejecucion en el archivo definido en
+        config.NETCOP['reporte'] y lo resume en una linea de syslog.
+        '''
+        syslog.syslog(syslog.LOG_INFO, "Reporte: %s" % self.reporte.resumen())
+        try:
+            self.reporte.guardar(config.NETCOP['reporte'])
+        except:
+            syslog.syslog(syslog.LOG_WARNING,
+                          "No se pudo escribir en el archivo %s" %
+                          config.NETCOP['reporte'])
+
+    def obtener_fuente(self):
+        '''
+        Devuelve la fuente de las versiones. Si no se asigno otra se usa el
+        servidor de firmas.
+        '''
+        from . import fuentes
+        if self.fuente is None:
+            self.fuente = fuentes.FuenteHTTP(self)
+        return self.fuente
 
     def obtener_version_disponible(self):
         '''
         Obtiene el numero de la ultima version de firmas disponibles desde el
         servidor de firmas.
+
+        Si hay varios espejos configurados se consultan todos a la vez y se
+        usa la version del primero que responde sin error (ver
+        `consultar_espejos`). La descarga se hara desde los espejos que
+        publicaron esa version, del mas rapido al mas lento.
+        '''
+        espejos = self.espejos()
+        validadores = self.obtener_validadores()
+        if len(espejos) == 1:
+            elegida = self.consultar_espejo(espejos[0], validadores)
+            self.descargas = [elegida['espejo'][1]]
+        else:
+            elegida = self.consultar_espejos(espejos, validadores)
+        if elegida['validadores']:
+            validadores[elegida['espejo'][0]] = elegida['validadores']
+            self.guardar_validadores(validadores)
+        return elegida['version']
+
+    def consultar_espejos(self, espejos, validadores):
+        '''
+        Consulta todos los espejos a la vez y devuelve la primera respuesta
+        sin error, sin esperar a los espejos lentos o caidos. Si ninguno
+        responde lanza el error del primero que fallo.
+
+        Los demas espejos terminan en segundo plano (ver
+        `terminar_consulta`).
+        '''
+        pool = ThreadPool(len(espejos))
+        resultados = pool.imap_unordered(
+            lambda espejo: self.medir_espejo(espejo, validadores), espejos)
+        pool.close()
+        respuestas = list()
+        elegida = None
+        for r in resultados:
+            respuestas.append(r)
+            if r['error'] is None:
+                elegida = r
+                break
+        if elegida is None:
+            self.guardar_latencias(respuestas)
+            raise respuestas[0]['error']
+        self.descargas = [elegida['espejo'][1]]
+        self.consulta = threading.Thread(
+            target=self.terminar_consulta,
+            args=(resultados, respuestas, elegida['version']))
+        self.consulta.start()
+        return elegida
+
+    def terminar_consulta(self, resultados, respuestas, version):
+        '''
+        Espera las respuestas de los espejos que faltan, agrega a las
+        descargas los que publicaron `version`, en el orden en que
+        responden, y registra la latencia de todos los espejos.
+        '''
+        for r in resultados:
+            respuestas.append(r)
+            if r['error'] is None and r['version'] == version:
+                self.descargas.append(r['espejo'][1])
+        self.guardar_latencias(respuestas)
+
+    def espejos(self):
+        '''
+        Devuelve los espejos del servidor de firmas como tuplas
+        (url_version, url_descarga), ordenados por la latencia registrada en
+        ejecuciones anteriores.
+
+        Los espejos se configuran en config.NETCOP['espejos'] como una lista
+        de URL base separadas por comas; a cada una se le agrega "/version" y
+        "/descarga". Si no hay espejos se usan url_version y url_download.
+        '''
+        bases = [base.strip().rstrip('/')
+                 for base in config.NETCOP['espejos'].split(',')
+                 if base.strip()]
+        if not bases:
+            return [(config.NETCOP['url_version'],
+                     config.NETCOP['url_download'])]
+        latencias = self.obtener_latencias()
+        espejos = [(base + '/version', base + '/descarga') for base in bases]
+        # los espejos sin latencia registrada se prueban primero
+        return sorted(espejos, key=lambda e: latencias.get(e[0], 0))
+
+    def medir_espejo(self, espejo, validadores):
+        '''
+        Consulta la version de un espejo registrando el error en lugar de
+        lanzarlo, para poder consultar varios espejos a la vez.
+        '''
+        inicio = time.time()
+        try:
+            return self.consultar_espejo(espejo, validadores)
+        except Exception as inst:
+            return {'espejo': espejo, 'version': None, 'serie': None,
+                    'validadores': None, 'error': inst,
+                    'segundos': time.time() - inicio}
+
+    def consultar_espejo(self, espejo, validadores):
+        '''
+        Consulta la version publicada en un espejo.
+
+        La consulta es condicional: se envian el ETag y la fecha de
+        modificacion de la ultima respuesta, y si el servidor responde 304 se
+        devuelve la version que se habia recibido en ella.
+        '''
+        url = espejo[0]
+        inicio = time.time()
+        cabeceras = dict()
+        anterior = validadores.get(url)
+        if anterior:
+            if anterior.get('etag'):
+                cabeceras['If-None-Match'] = anterior['etag']
+            if anterior.get('modificado'):
+                cabeceras['If-Modified-Since'] = anterior['modificado']
+        r = self.consultar_servidor(url, headers=cabeceras,
+                                    timeout=float(config.NETCOP['timeout']))
+        respuesta = {'espejo': espejo, 'validadores': None, 'error': None}
+        if r.status_code == 304:
+            respuesta['version'] = anterior['version']
+            respuesta['serie'] = anterior.get('serie')
+        else:
+            self.reporte.bytes += len(r.content)
+            datos = r.json()
+            respuesta['version'] = datos["version"]
+            respuesta['serie'] = datos.get("serie")
+            etag = r.headers.get('ETag')
+            modificado = r.headers.get('Last-Modified')
+            if etag or modificado:
+                respuesta['validadores'] = {'etag': etag,
+                                            'modificado': modificado,
+                                            'version': respuesta['version'],
+                                            'serie': respuesta['serie']}
+        respuesta['segundos'] = time.time() - inicio
+        return respuesta
+
+    def archivo_indice(self):
+        '''
+        Devuelve la ruta del indice compilado de las clases activas, junto al
+        archivo de versiones.
+        '''
+        return self.archivo_version() + '.indice'
+
+    def guardar_indice(self, version):
+        '''
+        Compila las clases activas de la base de datos en el indice binario
+        del modulo indice y lo reemplaza atomicamente.
+        '''
+        from . import indice
+        indice.escribir(self.archivo_indice(), indice.compilar(version))
+
+    def historial(self):
+        '''
+        Devuelve el historial de versiones aplicadas, guardado junto al
+        archivo de versiones.
+        '''
+        from . import historial
+        return historial.Historial(self.archivo_version() + '.historial',
+                                   int(config.NETCOP['historial']))
+
+    def registrar_historial(self, segundos):
+        '''
+        Guarda en el historial las clases de sistema que quedaron instaladas
+        con la version disponible.
+
+        Si se aplico una actualizacion incremental, se combina con la
+        entrada de la version instalada; si esa entrada no existe no se
+        registra nada. Un error al guardar el historial no interrumpe la
+        actualizacion.
+        '''
+        from . import historial
+        registro = self.historial()
+        if registro.maximo < 1 or self.descarga is None:
+            return
+        (leer, delta) = self.descarga
+        try:
+            clases = leer()
+            if delta:
+                anterior = registro.buscar(self.version_actual or '')
+                if anterior is None:
+                    syslog.syslog(syslog.LOG_WARNING,
+                                  "La version %s no esta en el historial" %
+                                  (self.version_actual or '')[0:6])
+                    return
+                clases = historial.combinar(
+                    self.leer_clases(registro.leer(anterior)), clases)
+            entrada = registro.guardar(self.version_disponible, clases, {
+                'segundos': segundos,
+                'creadas': len(self.cambios.creadas),
+                'modificadas': len(self.cambios.modificadas),
+                'desactivadas': len(self.cambios.desactivadas),
+                'sin_cambios': len(self.cambios.sin_cambios),
+            })
+            syslog.syslog(syslog.LOG_DEBUG,
+                          "Version %s guardada en el historial (%d bytes)" %
+                          (entrada['version'][0:6], entrada['bytes']))
+        except Exception as inst:
+            syslog.syslog(syslog.LOG_WARNING,
+                          "No se pudo guardar el historial: %s" % inst)
+
+    def revertir(self, version=None):
+        '''
+        Vuelve a instalar una version del historial sin consultar al
+        servidor. Si no se indica `version` (o un prefijo de ella) se
+        instala la ultima version aplicada antes de la actual.
+
+        Las clases de sistema instaladas que no existian en esa version se
+        desactivan. La version reemplazada queda descartada: no se vuelve a
+        instalar hasta que el servidor publique otra.
+
+        Devuelve los cambios aplicados, igual que `actualizar`.
+        '''
+        registro = self.historial()
+        self.reporte = self.nuevo_reporte()
+        self.version_actual = self.obtener_version_actual()
+        if version:
+            entrada = registro.buscar(version)
+        else:
+            entrada = registro.anterior(self.version_actual)
+        if entrada is None:
+            raise ValueError("La version %s no esta en el historial" %
+                             (version or 'anterior'))
+        syslog.syslog(syslog.LOG_INFO, "Revirtiendo a la version: %s" %
+                                       entrada['version'][0:6])
+        try:
+            self.aplicar(self.clases_historial(registro, entrada))
+            with self.reporte.fase('indice'):
+                self.guardar_indice(entrada['version'])
+            with self.reporte.fase('guardado'):
+                reemplazada = self.version_actual
+                self.version_actual = entrada['version']
+                self.guardar_version_actual()
+                if reemplazada and reemplazada.strip() != entrada['version']:
+                    registro.descartar(reemplazada)
+        except Exception as inst:
+            self.reporte.error = "%s" % inst
+            raise
+        finally:
+            self.guardar_reporte()
+        syslog.syslog(syslog.LOG_INFO, "La reversion fue exitosa: %s" %
+                      self.cambios.resumen())
+        return self.cambios
+
+    def clases_historial(self, registro, entrada):
+        '''
+        Genera las clases de una entrada del historial y, al final, la
+        eliminacion de las clases de sistema instaladas que no estan en ella.
+        '''
+        from . import models
+        vistas = set()
+        for clase in self.leer_clases(registro.leer(entrada)):
+            vistas.add(clase['id'])
+            yield clase
+        instaladas = list(models.ClaseTrafico
+                                .select(models.ClaseTrafico.id_clase)
+                                .where(models.ClaseTrafico.tipo ==
+                                       models.ClaseTrafico.SISTEMA,
+                                       models.ClaseTrafico.activa == True)
+                                .tuples())
+        for (id_clase,) in instaladas:
+            if id_clase not in vistas:
+                yield {'id': id_clase, 'eliminada': True}
+
+    def archivo_latencias(self):
+        '''
+        Devuelve la ruta del archivo donde se guardan las latencias de los
+        espejos, junto al archivo de versiones.
+        '''
+        return config.NETCOP['local_version'] + '.espejos'
+
+    def obtener_latencias(self):
+        '''
+        Lee las latencias promedio de los espejos {url_version: segundos}.
+        '''
+        try:
+            with open(self.archivo_latencias(), 'r') as f:
+                return json.load(f)
+        except:
+            return dict()
+
+    def guardar_latencias(self, respuestas):
+        '''
+        Actualiza el promedio movil de la latencia de cada espejo. Los
+        espejos que fallaron se penalizan con el tiempo maximo de espera.
+        '''
+        latencias = self.obtener_latencias()
+        for r in respuestas:
+            url = r['espejo'][0]
+            segundos = r['segundos']
+            if r['error'] is not None:
+                segundos = float(config.NETCOP['timeout'])
+            anterior = latencias.get(url, segundos)
+            latencias[url] = 0.7 * anterior + 0.3 * segundos
+        try:
+            with open(self.archivo_latencias(), 'w') as f:
+                json.dump(latencias, f)
+        except:
+            syslog.syslog(syslog.LOG_WARNING,
+                          "No se pudo escribir en el archivo %s" %
+                          self.archivo_latencias())
+
+    def archivo_validadores(self):
+        '''
+        Devuelve la ruta del archivo donde se guardan los validadores HTTP,
+        junto al archivo de versiones.
+        '''
+        return config.NETCOP['local_version'] + '.http'
+
+    def obtener_validadores(self):
+        '''
+        Lee los validadores HTTP (ETag y Last-Modified) de la ultima consulta
+        de version.
+        '''
+        try:
+            with open(self.archivo_validadores(), 'r') as f:
+                return json.load(f)
+        except:
+            return dict()
+
+    def guardar_validadores(self, validadores):
+        '''
+        Guarda los validadores HTTP de la ultima consulta de version.
+        '''
+        try:
+            with open(self.archivo_validadores(), 'w') as f:
+                json.dump(validadores, f)
+        except:
+            syslog.syslog(syslog.LOG_WARNING,
+                          "No se pudo escribir en el archivo %s" %
+                          self.archivo_validadores())
+
+    def descargar_actualizacion(self, delta=False):
+        '''
+        Descarga la ultima version de firmas y devuelve un generador de todas
+        las clases de trafico.
+
+        La descarga se guarda en el directorio config.NETCOP['cache'] con el
+        numero de version como nombre, de modo que si ya fue descargada (por
+        ejemplo porque fallo su aplicacion) no se vuelve a pedir al servidor.
+
+        Si `delta` es verdadero se envia la version instalada para que el
+        servidor responda solo con las clases agregadas, modificadas y
+        eliminadas. El servidor puede ignorarlo y enviar la version completa.
+
+        La respuesta se procesa a medida que se recibe, por lo que en memoria
+        solo se mantiene la clase que se esta aplicando. Si la descarga
+        guardada no se puede leer se borra.
+        '''
+        params = None
+        if delta and self.version_actual:
+            params = {'version_actual': self.version_actual.strip()}
+        ruta = self.archivo_cache(delta=params is not None)
+        if os.path.exists(ruta):
+            syslog.syslog(syslog.LOG_DEBUG, "Usando version descargada %s" %
+                                            ruta)
+        else:
+            syslog.syslog(syslog.LOG_DEBUG, "Descargando ultima versión")
+            self.descargar_de_espejos(ruta, params)
+        delta = params is not None
+
+        def leer():
+            try:
+                for clase in self.leer_clases(self.leer_archivo(ruta),
+                                              delta=delta):
+                    yield clase
+            except ValueError:
+                # el archivo guardado no se puede leer
+                self.borrar_cache(delta=delta)
+                raise
+        self.descarga = (leer, delta)
+        return leer()
+
+    def descargar_de_espejos(self, ruta, params=None):
+        '''
+        Descarga la version disponible probando los espejos que la
+        publicaron, del mas rapido al mas lento.
+        '''
+        descargas = self.descargas or [config.NETCOP['url_download']]
+        i = 0
+        while True:
+            try:
+                return self.descargar_archivo(descargas[i], ruta, params)
+            except Exception:
+                i += 1
+                # los espejos que todavia no respondieron pueden haber
+                # publicado la version
+                if i == len(descargas) and self.consulta is not None:
+                    self.consulta.join()
+                if i >= len(descargas):
+                    raise
+
+    def archivo_cache(self, delta=False):
+        '''
+        Devuelve la ruta del archivo donde se guarda la descarga de la
+        version disponible. Las actualizaciones incrementales se guardan en
+        un archivo distinto que incluye la version de la que parten; sin
+        version instalada se descarga la version completa.
+        '''
+        nombre = self.nombre_version(self.version_disponible)
+        if delta and self.version_actual:
+            nombre += '-' + self.nombre_version(self.version_actual)
+        return os.path.join(config.NETCOP['cache'], nombre + '.json')
+
+    def nombre_version(self, version):
+        '''
+        Devuelve el numero de version apto para usar en un nombre de archivo.
+        '''
+        return re.sub(r'[^0-9A-Za-z]', '', version or '')
+
+    def descargar_archivo(self, url, ruta, params=None):
+        '''
+        Descarga el cuerpo de la respuesta en `ruta`.
+
+        Mientras la descarga no termina se escribe en un archivo ".parcial".
+        Si existe uno de una ejecucion anterior se pide solo el resto
+        mediante una cabecera Range. El archivo parcial contiene el cuerpo
+        ya descomprimido, por lo que al continuar se pide la representacion
+        sin comprimir.
+        '''
+        parcial = ruta + '.parcial'
+        if not os.path.isdir(os.path.dirname(ruta)):
+            os.makedirs(os.path.dirname(ruta))
+        cabeceras = dict()
+        inicio = os.path.getsize(parcial) if os.path.exists(parcial) else 0
+        if inicio:
+            syslog.syslog(syslog.LOG_DEBUG,
+                          "Continuando descarga desde el byte %d" % inicio)
+            cabeceras['Range'] = 'bytes=%d-' % inicio
+            cabeceras['Accept-Encoding'] = 'identity'
+        try:
+            r = self.consultar_servidor(url, stream=True, params=params,
+                                        headers=cabeceras)
+        except ErrorServidor as inst:
+            # el archivo parcial no coincide con lo que tiene el servidor
+            if inst.codigo == 416:
+                os.remove(parcial)
+            raise
+        # si el servidor no acepta rangos envia la respuesta completa
+        modo = 'ab' if inicio and r.status_code == 206 else 'wb'
+        with open(parcial, modo) as f:
+            for trozo in r.iter_content(TROZO):
+                self.reporte.bytes += len(trozo)
+                f.write(trozo)
+        self.verificar_descarga(r, parcial)
+        os.rename(parcial, ruta)
+
+    def verificar_descarga(self, r, parcial):
+        '''
+        Verifica que se haya recibido el cuerpo completo de la respuesta.
+
+        requests no controla la cabecera Content-Length, por lo que una
+        conexion cortada puede terminar la descarga sin error. Si falta parte
+        del cuerpo se lanza DescargaIncompleta y el archivo queda como
+        ".parcial", para continuarlo en la proxima ejecucion.
+        '''
+        recibidos = os.path.getsize(parcial)
+        if r.status_code == 206:
+            # el archivo debe tener el tamaño total de Content-Range
+            esperados = r.headers.get('Content-Range', '').rpartition('/')[2]
+        else:
+            esperados = r.headers.get('Content-Length', '')
+            # en una respuesta comprimida la longitud es la del cuerpo
+            # comprimido
+            if r.headers.get('Content-Encoding', 'identity') != 'identity':
+                recibidos = r.raw.tell()
+        if esperados.isdigit() and recibidos != int(esperados):
+            raise DescargaIncompleta(recibidos, int(esperados))
+
+    def leer_archivo(self, ruta):
+        '''
+        Genera el contenido de un archivo en trozos, leyendolo mapeado en
+        memoria.
+        '''
+        from . import fuentes
+        return fuentes.leer_archivo(ruta)
+
+    def borrar_cache(self, delta=False):
+        '''
+        Borra la descarga guardada de la version disponible.
+        '''
+        ruta = self.archivo_cache(delta=delta)
+        if os.path.exists(ruta):
+            os.remove(ruta)
+
+    def limpiar_cache(self):
+        '''
+        Borra las descargas guardadas de versiones que no sean la aplicada.
+        '''
+        directorio = config.NETCOP['cache']
+        if not os.path.isdir(directorio):
+            return
+        prefijo = self.nombre_version(self.version_actual)
+        for nombre in os.listdir(directorio):
+            if not nombre.startswith(prefijo):
+                try:
+                    os.remove(os.path.join(directorio, nombre))
+                except OSError:
+                    syslog.syslog(syslog.LOG_WARNING,
+                                  "No se pudo borrar el archivo %s" % nombre)
+
+    def leer_clases(self, trozos, delta=False, base=None):
+        '''
+        Genera las clases de trafico contenidas en la respuesta del servidor.
+
+        Una version completa trae todas las clases en el arreglo "clases".
+        Una actualizacion incremental indica en "base" la version de la que
+        parte y trae los arreglos "agregadas", "modificadas" y "eliminadas";
+        este ultimo solo contiene identificadores de clase, que se generan
+        como {"id": id, "eliminada": True}.
+
+        Si `delta` es verdadero se pidio una actualizacion incremental: la
+        respuesta debe indicar "base" antes de sus clases, o ser una version
+        completa. En otro caso se lanza DeltaInvalida.
+
+        La version base debe ser `base`, por defecto la instalada.
         '''
-        return self.obtener_servidor(config.NETCOP['url_version'])["version"]
+        arreglos = ('clases', 'agregadas', 'modificadas', 'eliminadas')
+        esperada = base if base is not None else self.version_actual
+        (verificada, completa) = (False, False)
+        for clave, valor in lector.iterar(trozos, arreglos):
+            if clave == 'base':
+                if esperada is None or valor != esperada.strip():
+                    raise DeltaInvalida("la version base es %s" % valor)
+                verificada = True
+            elif clave not in arreglos:
+                continue
+            elif clave == 'clases':
+                completa = True
+                yield valor
+            elif delta and not verificada:
+                raise DeltaInvalida("no se indica la version base")
+            elif clave == 'eliminadas':
+                yield {'id': valor, 'eliminada': True}
+            else:
+                yield valor
+        if delta and not verificada and not completa:
+            raise DeltaInvalida("no se indica la version base")
 
-    def descargar_actualizacion(self):
+    def obtener_sesion(self):
         '''
-        Descarga la ultima version de firmas y devuelve una lista de todas las
-        clases de trafico.
+        Devuelve la sesion HTTP de la ejecucion. La sesion mantiene las
+        conexiones abiertas entre consultas y acepta respuestas comprimidas.
         '''
-        syslog.syslog(syslog.LOG_DEBUG, "Descargando ultima versión")
-        return self.obtener_servidor(config.NETCOP['url_download'])["clases"]
+        if self.sesion is None:
+            self.sesion = requests.Session()
+            self.sesion.headers['Accept-Encoding'] = 'gzip, deflate'
+        return self.sesion
 
-    def obtener_servidor(self, url):
+    def consultar_servidor(self, url, **kwargs):
         '''
-        Obtiene informacion del servidor de actualizaciones
+        Realiza una consulta al servidor de actualizaciones y devuelve la
+        respuesta. Lanza una excepcion si el servidor no responde con 2xx o
+        304.
         '''
         try:
-            r = requests.get(url)
-            if 200 <= r.status_code < 300:
-                return r.json()
-            raise Exception("Respuesta del servidor: %d" % r.status_code)
+            r = self.obtener_sesion().get(url, **kwargs)
+            if 200 <= r.status_code < 300 or r.status_code == 304:
+                return r
+            raise ErrorServidor(r.status_code)
         except:
             sys.stderr.write("No se pudo actualizar: %s no está disponible\n" %
                              url)
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+'''
+Conjunto de cambios de una actualizacion.
+
+Registra que clases de trafico fueron creadas, modificadas, desactivadas o
+quedaron sin cambios, y que subredes y puertos se agregaron o eliminaron en
+cada una, para que el despachante reconstruya solo las reglas afectadas.
+'''
+from collections import OrderedDict
+
+
+class Cambios(object):
+    '''
+    Cambios aplicados por una actualizacion.
+
+    Durante la aplicacion los enlaces se registran por id de CIDR o de
+    puerto; `resolver` los traduce a (direccion, prefijo, grupo) y
+    (numero, numero_fin, protocolo, grupo) con una consulta por tabla.
+    '''
+
+    def __init__(self):
+        self.creadas = set()
+        self.modificadas = set()
+        self.desactivadas = set()
+        self.sin_cambios = set()
+        # {id_clase: {'agregadas': [...], 'eliminadas': [...]}}
+        self.redes = dict()
+        self.puertos = dict()
+        # enlaces pendientes de resolver: (tipo, id_clase, id, grupo, accion)
+        self.enlaces = list()
+
+    def __bool__(self):
+        return bool(self.creadas or self.modificadas or self.desactivadas)
+
+    __nonzero__ = __bool__
+
+    def enlazar(self, tipo, id_clase, agregados, eliminados):
+        '''
+        Registra los enlaces {id: grupo} agregados y eliminados de una clase.
+        `tipo` es 'redes' o 'puertos'.
+        '''
+        for (accion, enlaces) in (('agregadas', agregados),
+                                  ('eliminadas', eliminados)):
+            for id_dimension, grupo in enlaces.items():
+                self.enlace(tipo, accion, id_clase, id_dimension, grupo)
+
+    def enlace(self, tipo, accion, id_clase, id_dimension, grupo):
+        '''
+        Registra un enlace de una clase con el CIDR o puerto `id_dimension`.
+        `accion` es 'agregadas' o 'eliminadas'.
+        '''
+        self.enlaces.append((tipo, id_clase, id_dimension, grupo, accion))
+
+    def resolver(self):
+        '''
+        Traduce los enlaces registrados a subredes y puertos. Debe llamarse
+        dentro de la transaccion de la actualizacion.
+        '''
+        from . import models
+        tablas = {
+            'redes': (models.CIDR, models.CIDR.id_cidr,
+                      (models.CIDR.direccion, models.CIDR.prefijo)),
+            'puertos': (models.Puerto, models.Puerto.id_puerto,
+                        (models.Puerto.numero, models.Puerto.numero_fin,
+                         models.Puerto.protocolo)),
+        }
+        valores = dict()
+        for tipo, (modelo, clave, campos) in tablas.items():
+            ids = set(e[2] for e in self.enlaces if e[0] == tipo)
+            valores[tipo] = dict()
+            if ids:
+                valores[tipo] = dict(
+                    (fila[0], tuple(fila[1:])) for fila in
+                    modelo.select(clave, *campos).where(clave << list(ids))
+                          .tuples())
+        for (tipo, id_clase, id_dimension, grupo, accion) in self.enlaces:
+            cambios = getattr(self, tipo).setdefault(
+                id_clase, {'agregadas': [], 'eliminadas': []})
+            cambios[accion].append(valores[tipo][id_dimension] + (grupo,))
+        for cambios in list(self.redes.values()) + list(self.puertos.values()):
+            for lista in cambios.values():
+                lista.sort()
+        self.enlaces = list()
+
+    def como_diccionario(self):
+        '''
+        Devuelve los cambios como un diccionario serializable.
+        '''
+        return OrderedDict((
+            ('creadas', sorted(self.creadas)),
+            ('modificadas', sorted(self.modificadas)),
+            ('desactivadas', sorted(self.desactivadas)),
+            ('sin_cambios', sorted(self.sin_cambios)),
+            ('redes', dict((str(k), v) for k, v in self.redes.items())),
+            ('puertos', dict((str(k), v) for k, v in self.puertos.items())),
+        ))
+
+    def resumen(self):
+        '''
+        Devuelve la cantidad de clases de cada tipo de cambio en una linea.
+        '''
+        return "creadas=%d modificadas=%d desactivadas=%d sin_cambios=%d" % (
+            len(self.creadas), len(self.modificadas), len(self.desactivadas),
+            len(self.sin_cambios))
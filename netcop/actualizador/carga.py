@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+'''
+Carga masiva de actualizaciones.
+
+Para actualizaciones grandes aplicar las clases de a una con el ORM es lento.
+Este modulo vuelca todas las clases, subredes y puertos descargados en tablas
+temporales mediante `COPY FROM STDIN` y luego los mezcla con las tablas
+definitivas usando un conjunto fijo de sentencias `INSERT ... SELECT` y
+`DELETE ... USING`, sin importar la cantidad de clases.
+
+Las clases que no son de sistema nunca se modifican, igual que en
+`Actualizador.aplicar_actualizacion`.
+'''
+import syslog
+import tempfile
+from . import models
+
+# tamaño maximo en memoria de cada tabla temporal antes de pasar a disco
+MEMORIA = 8 * 1024 * 1024
+
+TABLAS = (
+    '''CREATE TEMPORARY TABLE tmp_clase (
+        id_clase integer PRIMARY KEY,
+        nombre varchar(32),
+        descripcion varchar(160),
+        activa boolean,
+        digest varchar(64),
+        eliminada boolean
+    )''',
+    '''CREATE TEMPORARY TABLE tmp_cidr (
+        orden bigserial,
+        id_clase integer,
+        direccion inet,
+        prefijo smallint,
+        grupo char(1)
+    )''',
+    '''CREATE TEMPORARY TABLE tmp_puerto (
+        orden bigserial,
+        id_clase integer,
+        numero integer,
+        numero_fin integer,
+        protocolo smallint,
+        grupo char(1)
+    )''',
+)
+
+COPIAS = (
+    ('tmp_clase',
+     'tmp_clase (id_clase, nombre, descripcion, activa, digest, eliminada)'),
+    ('tmp_cidr', 'tmp_cidr (id_clase, direccion, prefijo, grupo)'),
+    ('tmp_puerto',
+     'tmp_puerto (id_clase, numero, numero_fin, protocolo, grupo)'),
+)
+
+PERSONALIZADAS = '''
+    SELECT t.id_clase FROM tmp_clase t
+    JOIN clase_trafico c ON c.id_clase = t.id_clase
+    WHERE c.tipo <> %(sistema)s
+'''
+
+# cada sentencia se acompaña del registro de Cambios donde se guardan las
+# filas que devuelve, o None si no devuelve filas
+MEZCLA = (
+    # desactiva las clases eliminadas
+    ('desactivadas',
+     '''UPDATE clase_trafico c SET activa = false, digest = NULL
+        FROM tmp_clase t
+        WHERE t.eliminada AND c.id_clase = t.id_clase
+          AND c.tipo = %(sistema)s
+        RETURNING c.id_clase'''),
+    ('sin_cambios',
+     '''SELECT t.id_clase FROM tmp_clase t
+        JOIN clase_trafico c ON c.id_clase = t.id_clase
+        WHERE NOT t.eliminada AND c.tipo = %(sistema)s
+          AND c.digest = t.digest'''),
+    # descarta clases eliminadas, personalizadas o sin cambios
+    (None,
+     '''DELETE FROM tmp_clase t USING clase_trafico c
+        WHERE c.id_clase = t.id_clase
+          AND (c.tipo <> %(sistema)s OR c.digest = t.digest)'''),
+    (None, 'DELETE FROM tmp_clase WHERE eliminada'),
+    (None,
+     '''DELETE FROM tmp_cidr s WHERE NOT EXISTS (
+          SELECT 1 FROM tmp_clase t WHERE t.id_clase = s.id_clase)'''),
+    (None,
+     '''DELETE FROM tmp_puerto s WHERE NOT EXISTS (
+          SELECT 1 FROM tmp_clase t WHERE t.id_clase = s.id_clase)'''),
+    # clases
+    ('modificadas',
+     '''UPDATE clase_trafico c
+        SET nombre = t.nombre, descripcion = t.descripcion,
+            activa = t.activa, digest = t.digest
+        FROM tmp_clase t
+        WHERE c.id_clase = t.id_clase
+        RETURNING c.id_clase'''),
+    ('creadas',
+     '''INSERT INTO clase_trafico
+          (id_clase, nombre, descripcion, tipo, activa, digest)
+        SELECT t.id_clase, t.nombre, t.descripcion, %(sistema)s, t.activa,
+               t.digest
+        FROM tmp_clase t
+        WHERE NOT EXISTS (
+          SELECT 1 FROM clase_trafico c WHERE c.id_clase = t.id_clase)
+        RETURNING id_clase'''),
+    # dimensiones
+    (None,
+     '''INSERT INTO cidr (direccion, prefijo)
+        SELECT DISTINCT s.direccion, s.prefijo FROM tmp_cidr s
+        WHERE NOT EXISTS (
+          SELECT 1 FROM cidr c
+          WHERE c.direccion = s.direccion AND c.prefijo = s.prefijo)'''),
+    (None,
+     '''INSERT INTO puerto (numero, numero_fin, protocolo)
+        SELECT DISTINCT s.numero, s.numero_fin, s.protocolo FROM tmp_puerto s
+        WHERE NOT EXISTS (
+          SELECT 1 FROM puerto p
+          WHERE p.numero = s.numero AND p.numero_fin = s.numero_fin
+            AND p.protocolo = s.protocolo)'''),
+    # enlaces nuevos, la clave primaria es (clase, cidr) y gana el primer
+    # grupo en el que aparece
+    (None,
+     '''CREATE TEMPORARY TABLE tmp_clase_cidr ON COMMIT DROP AS
+        SELECT DISTINCT ON (s.id_clase, c.id_cidr)
+               s.id_clase, c.id_cidr, s.grupo
+        FROM tmp_cidr s
+        JOIN cidr c ON c.direccion = s.direccion AND c.prefijo = s.prefijo
+        ORDER BY s.id_clase, c.id_cidr, s.orden'''),
+    (None,
+     '''CREATE TEMPORARY TABLE tmp_clase_puerto ON COMMIT DROP AS
+        SELECT DISTINCT ON (s.id_clase, p.id_puerto)
+               s.id_clase, p.id_puerto, s.grupo
+        FROM tmp_puerto s
+        JOIN puerto p ON p.numero = s.numero AND p.numero_fin = s.numero_fin
+                     AND p.protocolo = s.protocolo
+        ORDER BY s.id_clase, p.id_puerto, s.orden'''),
+    # enlaces que ya no estan o cambiaron de grupo
+    (('redes', 'eliminadas'),
+     '''DELETE FROM clase_cidr l USING tmp_clase t
+        WHERE l.id_clase = t.id_clase AND NOT EXISTS (
+          SELECT 1 FROM tmp_clase_cidr n
+          WHERE n.id_clase = l.id_clase AND n.id_cidr = l.id_cidr
+            AND n.grupo = l.grupo)
+        RETURNING l.id_clase, l.id_cidr, l.grupo'''),
+    (('puertos', 'eliminadas'),
+     '''DELETE FROM clase_puerto l USING tmp_clase t
+        WHERE l.id_clase = t.id_clase AND NOT EXISTS (
+          SELECT 1 FROM tmp_clase_puerto n
+          WHERE n.id_clase = l.id_clase AND n.id_puerto = l.id_puerto
+            AND n.grupo = l.grupo)
+        RETURNING l.id_clase, l.id_puerto, l.grupo'''),
+    # enlaces que faltan
+    (('redes', 'agregadas'),
+     '''INSERT INTO clase_cidr (id_clase, id_cidr, grupo)
+        SELECT n.id_clase, n.id_cidr, n.grupo FROM tmp_clase_cidr n
+        WHERE NOT EXISTS (
+          SELECT 1 FROM clase_cidr l
+          WHERE l.id_clase = n.id_clase AND l.id_cidr = n.id_cidr)
+        RETURNING id_clase, id_cidr, grupo'''),
+    (('puertos', 'agregadas'),
+     '''INSERT INTO clase_puerto (id_clase, id_puerto, grupo)
+        SELECT n.id_clase, n.id_puerto, n.grupo FROM tmp_clase_puerto n
+        WHERE NOT EXISTS (
+          SELECT 1 FROM clase_puerto l
+          WHERE l.id_clase = n.id_clase AND l.id_puerto = n.id_puerto)
+        RETURNING id_clase, id_puerto, grupo'''),
+)
+
+
+def escapar(valor):
+    '''
+    Convierte un valor al formato de texto de COPY.
+    '''
+    if valor is None:
+        return u'\\N'
+    if valor is True:
+        return u't'
+    if valor is False:
+        return u'f'
+    return (u'%s' % valor).replace(u'\\', u'\\\\').replace(u'\t', u'\\t') \
+                          .replace(u'\n', u'\\n').replace(u'\r', u'\\r')
+
+
+def fila(*valores):
+    '''
+    Devuelve una fila en formato de texto de COPY codificada en UTF-8.
+    '''
+    return (u'\t'.join(escapar(v) for v in valores) + u'\n').encode('utf-8')
+
+
+class CargaMasiva(object):
+    '''
+    Aplica una actualizacion mediante tablas temporales cargadas con COPY.
+
+    Debe ejecutarse dentro de una transaccion de models.db; las tablas
+    temporales se eliminan al confirmarla.
+    '''
+    # vida de las tablas temporales de TABLAS
+    TEMPORALES = ' ON COMMIT DROP'
+
+    def __init__(self, actualizador):
+        '''
+        Recibe el actualizador, que sabe interpretar las clases descargadas.
+        '''
+        self.actualizador = actualizador
+
+    def volcar(self, clases):
+        '''
+        Escribe las clases, subredes y puertos en archivos temporales en el
+        formato de texto de COPY. Devuelve un diccionario {tabla: archivo}.
+
+        Lanza ValueError si una clase aparece mas de una vez, en lugar de
+        que falle la clave primaria de tmp_clase dentro del COPY.
+        '''
+        archivos = dict((tabla, tempfile.SpooledTemporaryFile(MEMORIA))
+                        for tabla, _ in COPIAS)
+        vistas = set()
+        for nueva in clases:
+            assert nueva.get('id') is not None
+            id_clase = nueva["id"]
+            if id_clase in vistas:
+                raise ValueError("La clase %d esta repetida en la version" %
+                                 id_clase)
+            vistas.add(id_clase)
+            if nueva.get('eliminada'):
+                archivos['tmp_clase'].write(
+                    fila(id_clase, None, None, False, None, True))
+                continue
+            archivos['tmp_clase'].write(fila(
+                id_clase,
+                nueva.get("nombre", ""),
+                nueva.get("descripcion", ""),
+                bool(nueva.get("activa", True)),
+                self.actualizador.digest(nueva),
+                False,
+            ))
+            for (direccion, prefijo, grupo) in self.actualizador.redes(nueva):
+                archivos['tmp_cidr'].write(
+                    fila(id_clase, direccion, prefijo, grupo))
+            for (numero, numero_fin, protocolo, grupo) in \
+                    self.actualizador.puertos(nueva):
+                archivos['tmp_puerto'].write(
+                    fila(id_clase, numero, numero_fin, protocolo, grupo))
+        for archivo in archivos.values():
+            archivo.seek(0)
+        return archivos
+
+    def copiar(self, cursor, archivos):
+        '''
+        Crea las tablas temporales, las carga con COPY FROM STDIN y les
+        calcula estadisticas, que autovacuum no calcula en las tablas
+        temporales, para que el planificador no estime su tamaño al mezclar.
+        '''
+        for sentencia in TABLAS:
+            self.ejecutar(cursor, sentencia + self.TEMPORALES)
+        for tabla, destino in COPIAS:
+            models.db.consultas += 1
+            cursor.copy_expert("COPY %s FROM STDIN" % destino,
+                               archivos[tabla])
+            archivos[tabla].close()
+            self.ejecutar(cursor, 'ANALYZE %s' % tabla)
+
+    def mezclar(self, cursor):
+        '''
+        Mezcla las tablas temporales con las tablas definitivas.
+        '''
+        parametros = {'sistema': models.ClaseTrafico.SISTEMA}
+        self.avisar_personalizadas(cursor, parametros)
+        for registro, sentencia in MEZCLA:
+            self.ejecutar(cursor, sentencia, parametros)
+            if registro is not None:
+                self.registrar(registro, cursor.fetchall())
+
+    def avisar_personalizadas(self, cursor, parametros):
+        '''
+        Registra en syslog las clases personalizadas que se intenta
+        actualizar; no se modifican.
+        '''
+        self.ejecutar(cursor, PERSONALIZADAS, parametros)
+        for (id_clase,) in cursor.fetchall():
+            syslog.syslog(syslog.LOG_CRIT,
+                          "Intentando actualizar la clase personalizada %d" %
+                          id_clase)
+
+    def registrar(self, registro, filas):
+        '''
+        Guarda en los cambios del actualizador las filas devueltas por una
+        sentencia de MEZCLA.
+        '''
+        cambios = self.actualizador.cambios
+        if isinstance(registro, tuple):
+            for (id_clase, id_dimension, grupo) in filas:
+                cambios.enlace(registro[0], registro[1], id_clase,
+                               id_dimension, grupo)
+        else:
+            getattr(cambios, registro).update(fila[0] for fila in filas)
+
+    def ejecutar(self, cursor, sentencia, parametros=None):
+        '''
+        Ejecuta una sentencia contandola en las consultas de models.db.
+        '''
+        models.db.consultas += 1
+        cursor.execute(sentencia, parametros)
+
+    def aplicar(self, clases):
+        '''
+        Aplica todas las clases recibidas.
+        '''
+        reporte = self.actualizador.reporte
+        archivos = self.volcar(reporte.iterar('lectura', clases))
+        cursor = models.db.get_cursor()
+        try:
+            with reporte.fase('copia'):
+                self.copiar(cursor, archivos)
+            with reporte.fase('mezcla'):
+                self.mezclar(cursor)
+        finally:
+            cursor.close()
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+'''
+Clasificacion de flujos en lote.
+
+Responde a que clases de trafico corresponde cada flujo (ip, puerto,
+protocolo) usando las tablas del indice compilado (ver el modulo indice)
+y busquedas vectorizadas de NumPy, para clasificar millones de registros
+de capturas sin consultar la base de datos por cada uno.
+
+Requiere NumPy, que es una dependencia opcional del paquete:
+
+    pip install actualizador[clasificador]
+
+Las reglas de coincidencia son las de `indice.Indice.clasificar`: una clase
+reconoce un flujo de un grupo (INSIDE u OUTSIDE) si define subredes o
+puertos para ese grupo y todos los criterios que define coinciden. Los
+puertos sin protocolo coinciden con cualquier protocolo.
+'''
+import ipaddress
+import numbers
+from . import indice
+from .grupos import OUTSIDE
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def direcciones_ip(direcciones):
+    '''
+    Separa las direcciones por familia. Devuelve dos tuplas
+    (posiciones, claves), una para IPv4 con claves enteras y otra para IPv6
+    con claves de 16 bytes big endian.
+
+    Un arreglo de enteros de NumPy se interpreta como direcciones IPv4 sin
+    convertir cada elemento.
+    '''
+    if isinstance(direcciones, numpy.ndarray) and \
+            direcciones.dtype.kind in 'iu':
+        return ((numpy.arange(len(direcciones)),
+                 direcciones.astype(numpy.int64)),
+                (numpy.zeros(0, numpy.int64), numpy.zeros(0, 'S16')))
+    familias = {4: ([], []), 6: ([], [])}
+    for i, direccion in enumerate(direcciones):
+        if isinstance(direccion, numbers.Integral):
+            direccion = int(direccion)
+        elif not isinstance(direccion, (ipaddress.IPv4Address,
+                                        ipaddress.IPv6Address)):
+            direccion = u'%s' % direccion
+        ip = ipaddress.ip_address(direccion)
+        familias[ip.version][0].append(i)
+        familias[ip.version][1].append(int(ip) if ip.version == 4
+                                       else ip.packed)
+    return ((numpy.array(familias[4][0], numpy.int64),
+             numpy.array(familias[4][1], numpy.int64)),
+            (numpy.array(familias[6][0], numpy.int64),
+             numpy.array(familias[6][1], 'S16')))
+
+
+def expandir(posiciones, desde, hasta):
+    '''
+    Dados los rangos [desde, hasta) de cada elemento de `posiciones`,
+    devuelve dos arreglos paralelos con cada posicion repetida por cada
+    indice de su rango.
+    '''
+    cantidades = hasta - desde
+    total = int(cantidades.sum())
+    repetidas = numpy.repeat(posiciones, cantidades)
+    comienzos = numpy.repeat(desde - numpy.cumsum(cantidades) + cantidades,
+                             cantidades)
+    return (repetidas, comienzos + numpy.arange(total))
+
+
+class Tabla(object):
+    '''
+    Intervalos disjuntos de una tabla del indice cargados como arreglos de
+    NumPy.
+    '''
+
+    def __init__(self, datos, secciones, nombre, tipo):
+        def arreglo(sufijo, tipo):
+            (posicion, longitud) = secciones[nombre + sufijo]
+            cantidad = longitud // numpy.dtype(tipo).itemsize
+            return numpy.frombuffer(datos, tipo, cantidad, posicion)
+        self.limites = arreglo('.lim', tipo).astype(
+            'S16' if tipo == 'S16' else numpy.int64)
+        self.inicios = arreglo('.ini', '<u4')
+        self.clases = arreglo('.cls', '<u4')
+
+    def buscar(self, flujos, claves):
+        '''
+        Devuelve los pares (flujo, id_clase) de los intervalos que contienen
+        a cada clave.
+        '''
+        intervalos = numpy.searchsorted(self.limites, claves, 'right') - 1
+        validos = intervalos >= 0
+        flujos, intervalos = flujos[validos], intervalos[validos]
+        (flujos, posiciones) = expandir(
+            flujos, self.inicios[intervalos].astype(numpy.int64),
+            self.inicios[intervalos + 1].astype(numpy.int64))
+        return (flujos, self.clases[posiciones].astype(numpy.int64))
+
+
+class Clasificador(object):
+    '''
+    Clasifica flujos en lote a partir de un indice compilado.
+    '''
+
+    def __init__(self, lector):
+        '''
+        Recibe un `indice.Indice` abierto. Las clases de cada intervalo se
+        leen sin copiar del archivo mapeado en memoria; solo se copian los
+        limites, para compararlos en el orden de bytes nativo.
+        '''
+        if numpy is None:
+            raise ImportError("El clasificador requiere NumPy")
+        self.lector = lector
+        self.clases = numpy.array(lector.clases, numpy.int64)
+        (posicion, _) = lector.secciones['criterios']
+        self.criterios = numpy.frombuffer(lector.datos, numpy.uint8,
+                                          len(self.clases), posicion)
+        self.tablas = dict()
+        for seccion in lector.secciones:
+            if seccion.endswith('.lim'):
+                nombre = seccion[:-4]
+                tipo = {'r4': '>u4', 'r6': 'S16'}.get(nombre[:2], '>u2')
+                self.tablas[nombre] = Tabla(lector.datos, lector.secciones,
+                                            nombre, tipo)
+
+    @classmethod
+    def desde_archivo(cls, ruta):
+        '''
+        Crea un clasificador a partir del indice guardado en `ruta`.
+        '''
+        return cls(indice.Indice(ruta))
+
+    @classmethod
+    def desde_base(cls):
+        '''
+        Crea un clasificador a partir de las clases activas de la base de
+        datos.
+        '''
+        return cls(indice.Indice(datos=indice.empaquetar(
+            indice.compilar(None))))
+
+    def pares_red(self, direcciones, grupo):
+        '''
+        Devuelve los pares (flujo, id_clase) de las subredes del grupo que
+        contienen a cada direccion.
+        '''
+        pares = list()
+        for version, (flujos, claves) in zip((4, 6),
+                                              direcciones_ip(direcciones)):
+            tabla = self.tablas.get('r%d%s' % (version, grupo))
+            if tabla is not None and len(flujos):
+                pares.append(tabla.buscar(flujos, claves))
+        return pares
+
+    def pares_puerto(self, puertos, protocolos, grupo):
+        '''
+        Devuelve los pares (flujo, id_clase) de los puertos del grupo que
+        incluyen a cada puerto y protocolo.
+        '''
+        pares = list()
+        flujos = numpy.arange(len(puertos))
+        for protocolo in numpy.unique(protocolos):
+            tabla = self.tablas.get('p%d%s' % (protocolo, grupo))
+            mascara = protocolos == protocolo
+            if tabla is not None and protocolo:
+                pares.append(tabla.buscar(flujos[mascara], puertos[mascara]))
+        tabla = self.tablas.get('p0%s' % grupo)
+        if tabla is not None:
+            pares.append(tabla.buscar(flujos, puertos))
+        return pares
+
+    def codificar(self, pares):
+        '''
+        Codifica los pares (flujo, id_clase) como enteros unicos y ordenados
+        flujo * cantidad de clases + posicion de la clase.
+        '''
+        if not pares:
+            return numpy.zeros(0, numpy.int64)
+        flujos = numpy.concatenate([f for f, _ in pares])
+        clases = numpy.concatenate([c for _, c in pares])
+        posiciones = numpy.searchsorted(self.clases, clases)
+        return numpy.unique(flujos * len(self.clases) + posiciones)
+
+    def clasificar_lote(self, direcciones, puertos, protocolos,
+                        grupo=OUTSIDE):
+        '''
+        Clasifica un lote de flujos. `direcciones` es una secuencia de
+        direcciones IP (o un arreglo de enteros IPv4), `puertos` y
+        `protocolos` secuencias de enteros de la misma longitud.
+
+        Devuelve dos arreglos (inicios, clases): las clases del flujo k son
+        clases[inicios[k]:inicios[k + 1]], ordenadas.
+        '''
+        puertos = numpy.asarray(puertos, numpy.int64)
+        protocolos = numpy.asarray(protocolos, numpy.int64)
+        cantidad = len(puertos)
+        total = len(self.clases)
+        if not total:
+            return (numpy.zeros(cantidad + 1, numpy.int64),
+                    numpy.zeros(0, numpy.int64))
+        redes = self.codificar(self.pares_red(direcciones, grupo))
+        servicios = self.codificar(self.pares_puerto(puertos, protocolos,
+                                                     grupo))
+        # coincide la red y, si la clase define puertos, tambien el puerto
+        bit_red = indice.CRITERIOS[('r', grupo)]
+        bit_puerto = indice.CRITERIOS[('p', grupo)]
+        sin_puertos = (self.criterios[redes % total] & bit_puerto) == 0
+        sin_redes = (self.criterios[servicios % total] & bit_red) == 0
+        pares = numpy.union1d(
+            numpy.union1d(redes[sin_puertos], servicios[sin_redes]),
+            numpy.intersect1d(redes, servicios, assume_unique=True))
+        inicios = numpy.searchsorted(pares // total,
+                                     numpy.arange(cantidad + 1))
+        return (inicios, self.clases[pares % total])
+
+    def clasificar(self, ip, numero, protocolo, grupo=OUTSIDE):
+        '''
+        Devuelve la lista de id de las clases de un flujo.
+        '''
+        (_, clases) = self.clasificar_lote([ip], [numero], [protocolo], grupo)
+        return clases.tolist()
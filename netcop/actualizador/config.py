@@ -11,16 +11,37 @@ El formato del archivo esperado es
     inside=eth1
     url_version=http://netcop.com/version
     url_download=http://netcop.com/download
+    espejos=http://a.netcop.com, http://b.netcop.com
+    timeout=30
     local_version=/var/local/netcop/version
+    cache=/var/cache/netcop
+    carga=orm
+    agregar_redes=no
+    historial=5
+    procesos=0
+    reporte=/var/log/netcop/actualizador.json
+    intervalo=60
+    variacion=15
+    espera_maxima=3600
     
     [database]
     host=
     database=netcop
     user=netcop
     password=netcop
+
+    [database:netcop2]
+    database=netcop2
+    local_version=/var/local/netcop/version-netcop2
 ```
+
+Cada seccion `[database:<nombre>]` agrega una base de datos destino que se
+actualiza junto con la de `[database]`. Las claves que no defina se toman de
+`[database]`; `local_version` por defecto es el de `[netcop]` seguido de
+".<nombre>".
 '''
 import configparser
+from collections import OrderedDict
 
 NETCOP_CONFIG = '/etc/netcop/netcop.config'
 
@@ -34,8 +55,25 @@ class Default:
     }
     NETCOP = {
         'local_version': '/tmp/actualizador',
+        'cache': '/tmp/actualizador-cache',
+        # orm, copy (carga masiva) o sombra (tablas sombra)
+        'carga': 'orm',
+        # unir subredes solapadas o adyacentes de una misma clase y grupo
+        'agregar_redes': 'no',
+        # cantidad de versiones aplicadas que se guardan para revertir
+        'historial': '5',
+        # procesos que validan las versiones grandes, 0 para uno por CPU
+        'procesos': '0',
+        'reporte': '/tmp/actualizador-reporte.json',
+        # segundos entre consultas en modo demonio
+        'intervalo': '60',
+        'variacion': '15',
+        'espera_maxima': '3600',
         'url_version': 'http://netcop.ftp.sh/version',
         'url_download': 'http://netcop.ftp.sh/descarga',
+        # URL base de espejos separadas por comas, reemplazan a las anteriores
+        'espejos': '',
+        'timeout': '30',
         'outside': 'eth0',
         'inside': 'eth1',
     }
@@ -43,17 +81,31 @@ class Default:
 config = configparser.ConfigParser()
 config.read(NETCOP_CONFIG)
 
+# bases de datos destino adicionales {nombre: configuracion}
+DESTINOS = OrderedDict()
+
 # guarda el resto de las configuraciones del modulo
 for section in config.sections():
     conf = dict()
     for item in config.items(section):
         conf[item[0].lower()] = item[1]
-    globals()[section.upper()] = conf
+    if section.lower().startswith('database:'):
+        DESTINOS[section.split(':', 1)[1].strip()] = conf
+    else:
+        globals()[section.upper()] = conf
 
 # establece opciones por default
 sections = [a for a in dir(Default) if not a.startswith('__')]
 for section in sections:
-    if globals().get(section) is None:
-        globals()[section] = getattr(Default, section)
+    conf = dict(getattr(Default, section))
+    conf.update(globals().get(section) or dict())
+    globals()[section] = conf
+
+# los destinos adicionales heredan la configuracion de [database]
+for nombre in DESTINOS:
+    conf = dict(DATABASE)
+    conf['local_version'] = NETCOP['local_version'] + '.' + nombre
+    conf.update(DESTINOS[nombre])
+    DESTINOS[nombre] = conf
 
 del config, sections
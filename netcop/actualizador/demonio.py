@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+'''
+Modo demonio del actualizador.
+
+En lugar de ejecutar un proceso por cada consulta de version, el demonio
+mantiene vivos el proceso, la sesion HTTP y la conexion a la base de datos y
+consulta periodicamente si hay una nueva version.
+
+El intervalo entre consultas incluye una variacion aleatoria para que los
+equipos no consulten todos al mismo tiempo. Mientras el servidor no responda
+el intervalo se duplica en cada intento hasta un maximo.
+'''
+import random
+import signal
+import syslog
+import threading
+
+
+class Demonio(object):
+    '''
+    Ejecuta periodicamente una funcion hasta recibir SIGTERM o SIGINT.
+    '''
+
+    def __init__(self, ciclo, intervalo, variacion=0, espera_maxima=None):
+        '''
+        `ciclo` es la funcion a ejecutar; `intervalo` y `variacion` se
+        expresan en segundos. `espera_maxima` limita el intervalo mientras
+        `ciclo` falle.
+        '''
+        self.ciclo = ciclo
+        self.intervalo = intervalo
+        self.variacion = variacion
+        self.espera_maxima = espera_maxima or intervalo
+        self.activo = False
+        self.evento = threading.Event()
+
+    def espera(self, fallos):
+        '''
+        Devuelve los segundos a esperar hasta el proximo ciclo segun la
+        cantidad de fallos consecutivos.
+        '''
+        espera = self.intervalo
+        if fallos:
+            espera = min(self.intervalo * 2 ** fallos, self.espera_maxima)
+        return espera + random.uniform(0, self.variacion)
+
+    def detener(self, *args):
+        '''
+        Termina el demonio al finalizar el ciclo en curso.
+        '''
+        syslog.syslog(syslog.LOG_INFO, "Deteniendo actualizador")
+        self.activo = False
+        self.evento.set()
+
+    def ejecutar(self):
+        '''
+        Ejecuta `ciclo` hasta que se detenga el demonio.
+        '''
+        signal.signal(signal.SIGTERM, self.detener)
+        signal.signal(signal.SIGINT, self.detener)
+        self.activo = True
+        fallos = 0
+        while self.activo:
+            try:
+                self.ciclo()
+                fallos = 0
+            except Exception as inst:
+                fallos += 1
+                syslog.syslog(syslog.LOG_ERR,
+                              "Error en el ciclo de actualizacion: %s" % inst)
+            if self.activo:
+                espera = self.espera(fallos)
+                syslog.syslog(syslog.LOG_DEBUG,
+                              "Proxima consulta en %d segundos" % espera)
+                self.evento.wait(espera)
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+'''
+Fuentes de versiones de firmas.
+
+El actualizador obtiene la version disponible y sus clases de una fuente:
+
+  * FuenteHTTP: el servidor de firmas y sus espejos (por defecto).
+  * FuenteLocal: un archivo o un directorio local, para aplicar versiones
+    sin acceso al servidor (por ejemplo `actualizar --desde /media/firmas`).
+
+Una fuente local es un documento JSON con el mismo formato que publica el
+servidor ({"version": ..., "clases": [...]}), o un directorio con varios de
+ellos (*.json o *.json.gz) que se combinan como una sola version. Los
+archivos se leen mapeados en memoria y las partes de la version completa se
+mezclan a medida que se leen: cada parte debe tener sus clases ordenadas por
+id, y si una clase aparece en varias partes gana la del ultimo archivo en
+orden alfabetico.
+
+Un directorio tambien puede tener actualizaciones incrementales ({"base":
+..., "agregadas": [...], ...}), en uno o mas archivos. Se cargan en memoria
+y se aplican sobre la version completa del directorio, o sobre la instalada
+si no la hay: todas deben partir de esa version, y si una clase aparece en
+varias gana la del ultimo archivo en orden alfabetico.
+
+La version de un directorio se lee del archivo "version" ({"version": ...}),
+igual al que publica el servidor, o si no existe de la clave "version" del
+ultimo archivo incremental o, si no hay, del primer archivo.
+'''
+import gzip
+import heapq
+import json
+import mmap
+import os
+from . import lector
+
+# tamaño de los trozos en que se leen los archivos
+TROZO = 64 * 1024
+
+ARREGLOS = ('clases', 'agregadas', 'modificadas', 'eliminadas')
+
+EXTENSIONES = ('.json', '.json.gz')
+
+
+def leer_archivo(ruta):
+    '''
+    Genera el contenido de un archivo en trozos. Los archivos comprimidos
+    con gzip se descomprimen; el resto se mapea en memoria.
+    '''
+    if ruta.endswith('.gz'):
+        with gzip.open(ruta, 'rb') as f:
+            while True:
+                trozo = f.read(TROZO)
+                if not trozo:
+                    break
+                yield trozo
+        return
+    with open(ruta, 'rb') as f:
+        # no se puede mapear un archivo vacio
+        if not os.fstat(f.fileno()).st_size:
+            return
+        mapa = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for inicio in range(0, len(mapa), TROZO):
+                yield mapa[inicio:inicio + TROZO]
+        finally:
+            mapa.close()
+
+
+def fusionar(partes):
+    '''
+    Mezcla las clases de varias partes, cada una ordenada por id, en un
+    unico recorrido ordenado. Si una clase aparece en varias partes gana la
+    de la ultima parte.
+
+    `partes` es una lista de tuplas (nombre, clases).
+    '''
+    def numerar(orden, nombre, clases):
+        anterior = None
+        for clase in clases:
+            if anterior is not None and clase['id'] <= anterior:
+                raise ValueError("Las clases de %s no estan ordenadas por id"
+                                 % nombre)
+            anterior = clase['id']
+            yield (clase['id'], orden, clase)
+    actual = None
+    for (id_clase, _, clase) in heapq.merge(
+            *[numerar(orden, nombre, clases)
+              for orden, (nombre, clases) in enumerate(partes)]):
+        if actual is not None and actual['id'] != id_clase:
+            yield actual
+        actual = clase
+    if actual is not None:
+        yield actual
+
+
+def superponer(clases, cambios):
+    '''
+    Genera las clases de `clases` reemplazando las que aparecen en `cambios`,
+    un diccionario {id: clase}; las demas clases de `cambios` se agregan al
+    final ordenadas por id.
+
+    A diferencia de historial.combinar se conservan las clases eliminadas,
+    para que se desactiven al aplicar la version.
+    '''
+    cambios = dict(cambios)
+    for clase in clases:
+        yield cambios.pop(clase['id'], clase)
+    for id_clase in sorted(cambios):
+        yield cambios[id_clase]
+
+
+def es_incremental(ruta):
+    '''
+    Indica si un archivo contiene una actualizacion incremental, leyendo
+    solo hasta la primera clase.
+    '''
+    for clave, _ in lector.iterar(leer_archivo(ruta), ARREGLOS):
+        if clave == 'base':
+            return True
+        if clave in ARREGLOS:
+            return False
+    return False
+
+
+def leer_version(ruta):
+    '''
+    Devuelve la version indicada en un archivo, o None.
+    '''
+    for clave, valor in lector.iterar(leer_archivo(ruta), ARREGLOS):
+        if clave == 'version':
+            return valor
+    return None
+
+
+class FuenteHTTP(object):
+    '''
+    Servidor de firmas y sus espejos. La consulta y la descarga las resuelve
+    el actualizador.
+    '''
+
+    def __init__(self, actualizador):
+        self.actualizador = actualizador
+
+    def version(self):
+        '''
+        Devuelve la version disponible.
+        '''
+        return self.actualizador.obtener_version_disponible()
+
+    def clases(self, delta=False):
+        '''
+        Descarga la version disponible y devuelve un generador de sus
+        clases. Si `delta` es verdadero se pide una actualizacion
+        incremental.
+        '''
+        return self.actualizador.descargar_actualizacion(delta=delta)
+
+    def descartar(self, delta=False):
+        '''
+        Descarta la descarga guardada de la version disponible.
+        '''
+        self.actualizador.borrar_cache(delta=delta)
+
+
+class FuenteLocal(object):
+    '''
+    Archivo o directorio local con una version de firmas.
+    '''
+
+    def __init__(self, actualizador, ruta):
+        self.actualizador = actualizador
+        self.ruta = ruta
+
+    def archivos(self):
+        '''
+        Devuelve los archivos de la version en orden alfabetico.
+        '''
+        if not os.path.isdir(self.ruta):
+            return [self.ruta]
+        archivos = [os.path.join(self.ruta, nombre)
+                    for nombre in sorted(os.listdir(self.ruta))
+                    if nombre.endswith(EXTENSIONES)]
+        if not archivos:
+            raise ValueError("No hay versiones en %s" % self.ruta)
+        return archivos
+
+    def partes(self):
+        '''
+        Devuelve por separado los archivos de la version completa y los de
+        las actualizaciones incrementales.
+        '''
+        archivos = self.archivos()
+        incrementales = [archivo for archivo in archivos
+                         if es_incremental(archivo)]
+        return ([archivo for archivo in archivos
+                 if archivo not in incrementales], incrementales)
+
+    def version(self):
+        '''
+        Devuelve la version de los archivos.
+        '''
+        ruta = os.path.join(self.ruta, 'version')
+        if os.path.isdir(self.ruta) and os.path.exists(ruta):
+            with open(ruta, 'r') as f:
+                return json.load(f)['version']
+        (completas, incrementales) = self.partes()
+        version = leer_version(incrementales[-1] if incrementales
+                               else completas[0])
+        if version is None:
+            raise ValueError("%s no indica la version" % self.ruta)
+        return version
+
+    def incremental(self):
+        '''
+        Indica si los archivos contienen solo actualizaciones incrementales,
+        que parten de la version instalada.
+        '''
+        return not self.partes()[0]
+
+    def leer(self):
+        '''
+        Devuelve un generador de las clases de todos los archivos.
+        '''
+        (completas, incrementales) = self.partes()
+        partes = [(archivo,
+                   self.actualizador.leer_clases(leer_archivo(archivo)))
+                  for archivo in completas]
+        clases = partes[0][1] if len(partes) == 1 else fusionar(partes)
+        if not incrementales:
+            return clases
+        base = leer_version(completas[0]) if completas else None
+        cambios = dict()
+        for archivo in incrementales:
+            for clase in self.actualizador.leer_clases(
+                    leer_archivo(archivo), delta=True, base=base):
+                cambios[clase['id']] = clase
+        return superponer(clases, cambios)
+
+    def clases(self, delta=False):
+        '''
+        Devuelve un generador de las clases de la version. Los archivos
+        locales no dependen de la version instalada, por lo que `delta` se
+        ignora.
+        '''
+        self.actualizador.descarga = (self.leer, self.incremental())
+        return self.leer()
+
+    def descartar(self, delta=False):
+        '''
+        Los archivos locales no se descartan.
+        '''
@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+'''
+Grupos de las subredes y puertos de las clases de trafico.
+
+Se definen aparte del modulo models para que los lectores del indice no
+dependan del ORM ni de la configuracion.
+'''
+
+# Identificador de grupo para servicios que esten en la red local
+INSIDE = 'i'
+# Identificador de grupo para servicios que esten en Internet
+OUTSIDE = 'o'
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+'''
+Historial de las ultimas versiones aplicadas.
+
+Por cada version aplicada se guarda el conjunto completo de clases de
+sistema que quedo instalado, comprimido con gzip en el mismo formato JSON
+que publica el servidor ({"version": ..., "clases": [...]}), junto con
+estadisticas de la aplicacion. Permite volver a una version anterior sin
+acceder al servidor (ver `Actualizador.revertir`).
+
+Las versiones revertidas se marcan como descartadas para que no se vuelvan a
+instalar hasta que el servidor publique otra.
+
+El historial se guarda en un directorio con un archivo por version y el
+indice historial.json, con las entradas de la mas nueva a la mas vieja:
+
+    {"entradas": [{"version": ..., "archivo": ..., "fecha": ...,
+                   "segundos": ..., "clases": ..., "redes": ...,
+                   "puertos": ..., ...}],
+     "descartadas": [...]}
+'''
+import gzip
+import json
+import os
+import re
+import time
+from . import fuentes
+
+INDICE = 'historial.json'
+
+
+def nombre_archivo(version):
+    '''
+    Devuelve el nombre del archivo de una version.
+    '''
+    return re.sub(r'[^0-9A-Za-z]', '', version) + '.json.gz'
+
+
+def combinar(base, cambios):
+    '''
+    Genera las clases de `base` reemplazando las que aparecen en `cambios`.
+    Las clases eliminadas en `cambios` se omiten y las nuevas se agregan al
+    final.
+
+    `cambios` se carga completo en memoria, `base` se recorre de a una clase.
+    '''
+    cambios = dict((clase['id'], clase) for clase in cambios)
+    for clase in base:
+        clase = cambios.pop(clase['id'], clase)
+        if not clase.get('eliminada'):
+            yield clase
+    for id_clase in sorted(cambios):
+        if not cambios[id_clase].get('eliminada'):
+            yield cambios[id_clase]
+
+
+class Historial(object):
+    '''
+    Historial acotado de versiones aplicadas guardado en `directorio`.
+    '''
+
+    def __init__(self, directorio, maximo):
+        '''
+        `maximo` es la cantidad de versiones que se conservan.
+        '''
+        self.directorio = directorio
+        self.maximo = maximo
+
+    def ruta(self, nombre):
+        '''
+        Devuelve la ruta de un archivo del historial.
+        '''
+        return os.path.join(self.directorio, nombre)
+
+    def leer_indice(self):
+        '''
+        Devuelve el indice del historial, vacio si todavia no existe.
+        '''
+        try:
+            with open(self.ruta(INDICE), 'r') as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {'entradas': [], 'descartadas': []}
+
+    def escribir_indice(self, indice):
+        '''
+        Reemplaza el indice atomicamente.
+        '''
+        temporal = self.ruta(INDICE + '.tmp')
+        with open(temporal, 'w') as f:
+            json.dump(indice, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(temporal, self.ruta(INDICE))
+
+    def entradas(self):
+        '''
+        Devuelve las entradas del historial, de la mas nueva a la mas vieja.
+        '''
+        return self.leer_indice()['entradas']
+
+    def buscar(self, version):
+        '''
+        Devuelve la entrada cuya version empieza con `version`, o None.
+        '''
+        version = version.strip()
+        for entrada in self.entradas():
+            if version and entrada['version'].startswith(version):
+                return entrada
+        return None
+
+    def anterior(self, version):
+        '''
+        Devuelve la entrada mas nueva cuya version no sea `version`, o None.
+        '''
+        version = (version or '').strip()
+        for entrada in self.entradas():
+            if entrada['version'] != version:
+                return entrada
+        return None
+
+    def guardar(self, version, clases, estadisticas):
+        '''
+        Agrega al historial la version con las clases de `clases` y las
+        `estadisticas` dadas, y descarta las entradas que excedan el maximo.
+
+        Devuelve la entrada agregada.
+        '''
+        if not os.path.isdir(self.directorio):
+            os.makedirs(self.directorio)
+        version = version.strip()
+        archivo = nombre_archivo(version)
+        entrada = dict(estadisticas, version=version, archivo=archivo,
+                       fecha=time.strftime('%Y-%m-%dT%H:%M:%S'),
+                       clases=0, redes=0, puertos=0)
+        temporal = self.ruta(archivo + '.tmp')
+        with gzip.open(temporal, 'wb') as f:
+            f.write(b'{"version": ' + json.dumps(version).encode('utf-8') +
+                    b', "clases": [')
+            for clase in clases:
+                if entrada['clases']:
+                    f.write(b',\n')
+                f.write(json.dumps(clase, sort_keys=True,
+                                   separators=(',', ':')).encode('utf-8'))
+                entrada['clases'] += 1
+                entrada['redes'] += (len(clase.get('subredes_outside', [])) +
+                                     len(clase.get('subredes_inside', [])))
+                entrada['puertos'] += (len(clase.get('puertos_outside', [])) +
+                                       len(clase.get('puertos_inside', [])))
+            f.write(b']}')
+        os.rename(temporal, self.ruta(archivo))
+        entrada['bytes'] = os.path.getsize(self.ruta(archivo))
+
+        indice = self.leer_indice()
+        entradas = [entrada] + [e for e in indice['entradas']
+                                if e['version'] != version]
+        indice['entradas'] = entradas[:self.maximo]
+        self.escribir_indice(indice)
+        vigentes = set(e['archivo'] for e in indice['entradas'])
+        for e in entradas[self.maximo:]:
+            if e['archivo'] not in vigentes and \
+                    os.path.exists(self.ruta(e['archivo'])):
+                os.remove(self.ruta(e['archivo']))
+        return entrada
+
+    def leer(self, entrada):
+        '''
+        Genera el contenido descomprimido del archivo de una entrada en
+        trozos.
+        '''
+        return fuentes.leer_archivo(self.ruta(entrada['archivo']))
+
+    def descartar(self, version):
+        '''
+        Marca la version como descartada, para que no se vuelva a aplicar.
+        '''
+        version = version.strip()
+        indice = self.leer_indice()
+        descartadas = [v for v in indice['descartadas'] if v != version]
+        indice['descartadas'] = [version] + descartadas[:self.maximo - 1]
+        if not os.path.isdir(self.directorio):
+            os.makedirs(self.directorio)
+        self.escribir_indice(indice)
+
+    def descartada(self, version):
+        '''
+        Indica si la version fue revertida.
+        '''
+        return (version or '').strip() in self.leer_indice()['descartadas']
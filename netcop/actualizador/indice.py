@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+'''
+Indice binario de las clases de trafico activas.
+
+Despues de cada actualizacion se compilan las subredes y puertos de las
+clases activas en un archivo que los consumidores pueden abrir con `mmap` y
+consultar sin parsearlo ni acceder a la base de datos.
+
+El archivo comienza con una cabecera y un directorio de secciones:
+
+    cabecera    <4sHH   MAGIA, FORMATO, cantidad de secciones
+    directorio  <16sQQ  nombre, posicion y longitud de cada seccion
+
+Cada seccion es un arreglo contiguo alineado a 8 bytes:
+
+    version     version de firmas compilada, en UTF-8
+    clases      <u4     id de las clases activas, ordenados
+    criterios   u1      criterios definidos por cada clase (ver CRITERIOS)
+
+Las subredes de cada grupo y familia (r4o, r4i, r6o, r6i) y los puertos de
+cada grupo y protocolo (p6o, p17i, p0o, ...) se guardan como intervalos
+disjuntos, cada uno con la lista de clases que lo cubren:
+
+    <tabla>.lim  limites de los intervalos, ordenados; claves big endian de
+                 4 (IPv4), 16 (IPv6) o 2 (puertos) bytes, de modo que el
+                 orden de los bytes coincide con el orden numerico
+    <tabla>.ini  <u4, posicion en <tabla>.cls de las clases de cada
+                 intervalo; tiene un elemento mas que <tabla>.lim
+    <tabla>.cls  <u4, id de las clases de todos los intervalos
+
+El intervalo j va desde el limite j hasta el limite j + 1 (sin incluirlo) y
+lo cubren las clases cls[ini[j]:ini[j + 1]].
+'''
+import ipaddress
+import mmap
+import os
+import struct
+from bisect import bisect_right
+from collections import defaultdict
+from .grupos import INSIDE, OUTSIDE
+
+MAGIA = b'NCIX'
+FORMATO = 1
+CABECERA = struct.Struct('<4sHH')
+ENTRADA = struct.Struct('<16sQQ')
+
+# bytes de las claves de cada tipo de tabla
+ANCHOS = {'r4': 4, 'r6': 16, 'p': 2}
+
+# bit de cada criterio en la seccion criterios
+CRITERIOS = {
+    ('r', OUTSIDE): 1,
+    ('p', OUTSIDE): 2,
+    ('r', INSIDE): 4,
+    ('p', INSIDE): 8,
+}
+
+
+def clave(valor, ancho):
+    '''
+    Codifica un entero como clave big endian de `ancho` bytes.
+    '''
+    if ancho == 2:
+        return struct.pack('>H', valor)
+    if ancho == 4:
+        return struct.pack('>I', valor)
+    return struct.pack('>QQ', valor >> 64, valor & (2 ** 64 - 1))
+
+
+def segmentar(intervalos, maximo):
+    '''
+    Convierte intervalos (inicio, fin, id_clase), con fin inclusive, en
+    intervalos disjuntos. Devuelve una lista de tuplas (limite, clases)
+    ordenada, uniendo los intervalos vecinos con las mismas clases.
+    '''
+    inicios = defaultdict(list)
+    fines = defaultdict(list)
+    for (inicio, fin, id_clase) in intervalos:
+        inicios[inicio].append(id_clase)
+        if fin < maximo:
+            fines[fin + 1].append(id_clase)
+    activas = defaultdict(int)
+    segmentos = list()
+    for limite in sorted(set(inicios) | set(fines)):
+        for id_clase in fines[limite]:
+            activas[id_clase] -= 1
+            if not activas[id_clase]:
+                del activas[id_clase]
+        for id_clase in inicios[limite]:
+            activas[id_clase] += 1
+        clases = sorted(activas)
+        if not segmentos or segmentos[-1][1] != clases:
+            segmentos.append((limite, clases))
+    return segmentos
+
+
+def tablas_segmentos(nombre, segmentos, ancho):
+    '''
+    Devuelve las secciones <nombre>.lim, .ini y .cls de una tabla.
+    '''
+    limites = b''.join(clave(limite, ancho) for limite, _ in segmentos)
+    posiciones = [0]
+    clases = list()
+    for _, ids in segmentos:
+        clases.extend(ids)
+        posiciones.append(len(clases))
+    return [
+        (nombre + '.lim', limites),
+        (nombre + '.ini', struct.pack('<%dI' % len(posiciones), *posiciones)),
+        (nombre + '.cls', struct.pack('<%dI' % len(clases), *clases)),
+    ]
+
+
+def compilar(version):
+    '''
+    Lee las clases activas de la base de datos y devuelve las secciones del
+    indice como una lista de tuplas (nombre, datos).
+    '''
+    from . import models
+    criterios = dict(
+        (id_clase, 0) for (id_clase,) in
+        models.ClaseTrafico.select(models.ClaseTrafico.id_clase)
+                           .where(models.ClaseTrafico.activa == True)
+                           .tuples()
+    )
+    tablas = defaultdict(list)
+    consulta = (models.ClaseCIDR
+                      .select(models.ClaseCIDR.clase, models.CIDR.direccion,
+                              models.CIDR.prefijo, models.ClaseCIDR.grupo)
+                      .join(models.CIDR)
+                      .switch(models.ClaseCIDR)
+                      .join(models.ClaseTrafico)
+                      .where(models.ClaseTrafico.activa == True)
+                      .tuples())
+    for (id_clase, direccion, prefijo, grupo) in consulta:
+        red = ipaddress.ip_network(u'%s/%d' % (direccion, prefijo),
+                                   strict=False)
+        tablas['r%d%s' % (red.version, grupo)].append(
+            (int(red.network_address), int(red.broadcast_address), id_clase))
+        criterios[id_clase] |= CRITERIOS[('r', grupo)]
+    consulta = (models.ClasePuerto
+                      .select(models.ClasePuerto.clase, models.Puerto.numero,
+                              models.Puerto.numero_fin,
+                              models.Puerto.protocolo,
+                              models.ClasePuerto.grupo)
+                      .join(models.Puerto)
+                      .switch(models.ClasePuerto)
+                      .join(models.ClaseTrafico)
+                      .where(models.ClaseTrafico.activa == True)
+                      .tuples())
+    for (id_clase, numero, numero_fin, protocolo, grupo) in consulta:
+        tablas['p%d%s' % (protocolo, grupo)].append(
+            (numero, numero_fin, id_clase))
+        criterios[id_clase] |= CRITERIOS[('p', grupo)]
+    ids = sorted(criterios)
+    secciones = [
+        ('version', (version or u'').encode('utf-8')),
+        ('clases', struct.pack('<%dI' % len(ids), *ids)),
+        ('criterios', struct.pack('<%dB' % len(ids),
+                                  *[criterios[i] for i in ids])),
+    ]
+    for nombre in sorted(tablas):
+        ancho = ANCHOS.get(nombre[:2], ANCHOS['p'])
+        maximo = 2 ** (8 * ancho) - 1
+        secciones.extend(tablas_segmentos(
+            nombre, segmentar(tablas[nombre], maximo), ancho))
+    return secciones
+
+
+def empaquetar(secciones):
+    '''
+    Devuelve el contenido del archivo de indice con las secciones dadas.
+    '''
+    posicion = CABECERA.size + ENTRADA.size * len(secciones)
+    directorio = list()
+    cuerpo = list()
+    for nombre, datos in secciones:
+        relleno = -posicion % 8
+        cuerpo.append(b'\0' * relleno)
+        posicion += relleno
+        directorio.append(ENTRADA.pack(nombre.encode('ascii'), posicion,
+                                       len(datos)))
+        cuerpo.append(datos)
+        posicion += len(datos)
+    return (CABECERA.pack(MAGIA, FORMATO, len(secciones)) +
+            b''.join(directorio) + b''.join(cuerpo))
+
+
+def escribir(ruta, secciones):
+    '''
+    Escribe las secciones en `ruta`. El archivo se escribe aparte y se
+    renombra al terminar, de modo que los lectores siempre vean un indice
+    completo.
+    '''
+    temporal = ruta + '.tmp'
+    with open(temporal, 'wb') as f:
+        f.write(empaquetar(secciones))
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(temporal, ruta)
+
+
+class Indice(object):
+    '''
+    Lector de un indice compilado. Las consultas se resuelven con busquedas
+    binarias directamente sobre el archivo mapeado en memoria.
+    '''
+
+    def __init__(self, ruta=None, datos=None):
+        '''
+        Abre el indice guardado en `ruta` o, si no se indica, el contenido
+        en memoria `datos` devuelto por empaquetar.
+        '''
+        if ruta is not None:
+            with open(ruta, 'rb') as f:
+                datos = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.datos = datos
+        (magia, formato, cantidad) = CABECERA.unpack_from(self.datos, 0)
+        if magia != MAGIA or formato != FORMATO:
+            self.cerrar()
+            raise ValueError("Formato de indice desconocido: %s" % ruta)
+        self.secciones = dict()
+        for i in range(cantidad):
+            (nombre, posicion, longitud) = ENTRADA.unpack_from(
+                self.datos, CABECERA.size + ENTRADA.size * i)
+            nombre = nombre.rstrip(b'\0').decode('ascii')
+            self.secciones[nombre] = (posicion, longitud)
+        self.version = self.seccion('version').decode('utf-8')
+        self.clases = self.enteros('clases')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.cerrar()
+
+    def cerrar(self):
+        '''
+        Libera el archivo mapeado.
+        '''
+        if isinstance(self.datos, mmap.mmap):
+            self.datos.close()
+
+    def seccion(self, nombre):
+        '''
+        Devuelve los bytes de una seccion, vacios si no existe.
+        '''
+        (posicion, longitud) = self.secciones.get(nombre, (0, 0))
+        return self.datos[posicion:posicion + longitud]
+
+    def enteros(self, nombre):
+        '''
+        Devuelve una seccion de enteros sin signo de 4 bytes como tupla.
+        '''
+        datos = self.seccion(nombre)
+        return struct.unpack('<%dI' % (len(datos) // 4), datos)
+
+    def buscar(self, tabla, valor, ancho):
+        '''
+        Devuelve el conjunto de clases cuyo intervalo en `tabla` contiene a
+        `valor`.
+        '''
+        if tabla + '.lim' not in self.secciones:
+            return set()
+        (posicion, longitud) = self.secciones[tabla + '.lim']
+        objetivo = clave(valor, ancho)
+        (inferior, superior) = (0, longitud // ancho)
+        # busca el ultimo limite menor o igual a valor
+        while inferior < superior:
+            medio = (inferior + superior) // 2
+            inicio = posicion + medio * ancho
+            if self.datos[inicio:inicio + ancho] <= objetivo:
+                inferior = medio + 1
+            else:
+                superior = medio
+        if not inferior:
+            return set()
+        (posicion, _) = self.secciones[tabla + '.ini']
+        (desde, hasta) = struct.unpack_from('<2I', self.datos,
+                                            posicion + (inferior - 1) * 4)
+        (posicion, _) = self.secciones[tabla + '.cls']
+        return set(struct.unpack_from('<%dI' % (hasta - desde), self.datos,
+                                      posicion + desde * 4))
+
+    def criterios(self, id_clase):
+        '''
+        Devuelve los criterios definidos por una clase.
+        '''
+        i = bisect_right(self.clases, id_clase) - 1
+        if i < 0 or self.clases[i] != id_clase:
+            return 0
+        (posicion, _) = self.secciones['criterios']
+        return struct.unpack_from('B', self.datos, posicion + i)[0]
+
+    def clases_red(self, ip, grupo):
+        '''
+        Devuelve las clases con una subred del grupo que contiene a `ip`.
+        '''
+        ip = ipaddress.ip_address(u'%s' % ip)
+        ancho = ANCHOS['r%d' % ip.version]
+        return self.buscar('r%d%s' % (ip.version, grupo), int(ip), ancho)
+
+    def clases_puerto(self, numero, protocolo, grupo):
+        '''
+        Devuelve las clases con un puerto del grupo que incluye a `numero`.
+        Los puertos sin protocolo (0) coinciden con cualquier protocolo.
+        '''
+        clases = self.buscar('p%d%s' % (protocolo, grupo), numero,
+                             ANCHOS['p'])
+        if protocolo:
+            clases |= self.buscar('p0%s' % grupo, numero, ANCHOS['p'])
+        return clases
+
+    def clasificar(self, ip, numero, protocolo, grupo=OUTSIDE):
+        '''
+        Devuelve los id de las clases que reconocen un servicio en `ip` y
+        `numero`/`protocolo` ubicado en el grupo indicado (INSIDE u
+        OUTSIDE).
+
+        Una clase reconoce el servicio si define subredes o puertos para
+        el grupo y todos los criterios que define coinciden.
+        '''
+        redes = self.clases_red(ip, grupo)
+        puertos = self.clases_puerto(numero, protocolo, grupo)
+        bit_red = CRITERIOS[('r', grupo)]
+        bit_puerto = CRITERIOS[('p', grupo)]
+        clases = set()
+        for id_clase in redes | puertos:
+            criterios = self.criterios(id_clase)
+            if (id_clase in redes or not criterios & bit_red) and \
+                    (id_clase in puertos or not criterios & bit_puerto):
+                clases.add(id_clase)
+        return sorted(clases)
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+'''
+Lectura incremental de documentos JSON.
+
+Permite recorrer los elementos de los arreglos de un objeto JSON a medida que
+se reciben los datos del servidor, sin tener el documento completo en memoria.
+Solo se mantiene decodificado el elemento que se esta procesando.
+'''
+import codecs
+import json
+
+ESPACIOS = u' \t\n\r'
+
+
+class LectorJSON(object):
+    '''
+    Consume un documento JSON desde un iterable de trozos de bytes (o texto)
+    y permite decodificarlo valor por valor.
+    '''
+
+    def __init__(self, trozos):
+        self.trozos = iter(trozos)
+        self.decodificador = codecs.getincrementaldecoder('utf-8')()
+        self.json = json.JSONDecoder()
+        self.buffer = u''
+        self.pos = 0
+
+    def leer(self):
+        '''
+        Agrega el siguiente trozo al buffer descartando lo ya consumido.
+
+        Devuelve falso si no hay mas datos para leer.
+        '''
+        self.buffer = self.buffer[self.pos:]
+        self.pos = 0
+        for trozo in self.trozos:
+            if isinstance(trozo, bytes):
+                trozo = self.decodificador.decode(trozo)
+            if trozo:
+                self.buffer += trozo
+                return True
+        resto = self.decodificador.decode(b'', True)
+        self.buffer += resto
+        return bool(resto)
+
+    def caracter(self):
+        '''
+        Devuelve el siguiente caracter que no sea un espacio, sin consumirlo.
+        '''
+        while True:
+            while (self.pos < len(self.buffer) and
+                   self.buffer[self.pos] in ESPACIOS):
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.leer():
+                raise ValueError("Fin inesperado del documento JSON")
+
+    def esperar(self, caracter):
+        '''
+        Consume el caracter indicado o lanza ValueError si el documento
+        continua con otro.
+        '''
+        encontrado = self.caracter()
+        if encontrado != caracter:
+            raise ValueError("Se esperaba '%s' y se encontro '%s'" %
+                             (caracter, encontrado))
+        self.pos += 1
+
+    def consumir(self, caracter):
+        '''
+        Consume el caracter indicado si es el siguiente en el documento.
+        Devuelve verdadero si lo consumio.
+        '''
+        if self.caracter() == caracter:
+            self.pos += 1
+            return True
+        return False
+
+    def valor(self):
+        '''
+        Decodifica el siguiente valor JSON completo.
+        '''
+        self.caracter()
+        while True:
+            try:
+                valor, fin = self.json.raw_decode(self.buffer, self.pos)
+            except ValueError:
+                # el valor puede estar cortado entre dos trozos
+                if self.leer():
+                    continue
+                raise
+            # un numero al final del buffer puede continuar en el proximo
+            # trozo
+            if (fin == len(self.buffer) and
+                    not isinstance(valor, (dict, list)) and self.leer()):
+                continue
+            self.pos = fin
+            return valor
+
+
+def iterar(trozos, arreglos=(u'clases',)):
+    '''
+    Recorre un objeto JSON a medida que se leen sus trozos.
+
+    Genera una tupla (clave, elemento) por cada elemento de los arreglos
+    cuya clave este en `arreglos`, y una tupla (clave, valor) por cada una
+    de las demas claves del objeto.
+    '''
+    lector = LectorJSON(trozos)
+    lector.esperar(u'{')
+    if lector.consumir(u'}'):
+        return
+    while True:
+        clave = lector.valor()
+        lector.esperar(u':')
+        if clave in arreglos and lector.consumir(u'['):
+            if not lector.consumir(u']'):
+                while True:
+                    yield clave, lector.valor()
+                    if not lector.consumir(u','):
+                        break
+                lector.esperar(u']')
+        else:
+            yield clave, lector.valor()
+        if not lector.consumir(u','):
+            break
+    lector.esperar(u'}')
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+'''
+Mediciones de una ejecucion del actualizador.
+
+Registra el tiempo y la cantidad de sentencias SQL de cada fase de la
+actualizacion (consulta de version, descarga, lectura, aplicacion, commit y
+guardado de la version), los bytes recibidos y el tiempo de aplicacion de
+cada clase. Si hay varias bases de datos destino se agrega el reporte de
+cada una. El reporte se guarda en formato JSON y se resume en una linea de
+syslog.
+'''
+import heapq
+import json
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# cantidad de clases mas lentas que se guardan en el reporte
+LENTAS = 10
+
+
+class Reporte(object):
+    '''
+    Reporte de una ejecucion del actualizador.
+    '''
+
+    def __init__(self, consultas=None):
+        '''
+        `consultas` es una funcion que devuelve la cantidad de sentencias
+        SQL ejecutadas hasta el momento.
+        '''
+        self.consultas = consultas or (lambda: 0)
+        self.inicio = time.time()
+        self.consultas_inicio = self.consultas()
+        self.fases = OrderedDict()
+        self.iniciadas = dict()
+        self.bytes = 0
+        self.clases = 0
+        self.segundos_clases = 0.0
+        self.lentas = list()
+        self.error = None
+        # {nombre: reporte} de cada base de datos destino
+        self.destinos = OrderedDict()
+
+    def iniciar(self, nombre):
+        '''
+        Marca el comienzo de una fase.
+        '''
+        self.iniciadas[nombre] = (time.time(), self.consultas())
+
+    def terminar(self, nombre):
+        '''
+        Marca el final de una fase. Si la fase se ejecuta varias veces se
+        acumulan sus mediciones.
+        '''
+        inicio, consultas = self.iniciadas.pop(nombre)
+        fase = self.fases.setdefault(nombre, {'segundos': 0.0,
+                                              'consultas': 0})
+        fase['segundos'] += time.time() - inicio
+        fase['consultas'] += self.consultas() - consultas
+
+    @contextmanager
+    def fase(self, nombre):
+        '''
+        Mide el bloque como una fase.
+        '''
+        self.iniciar(nombre)
+        try:
+            yield
+        finally:
+            self.terminar(nombre)
+
+    def iterar(self, nombre, iterable):
+        '''
+        Recorre `iterable` midiendo como una fase el tiempo que tarda en
+        obtenerse cada elemento.
+        '''
+        iterador = iter(iterable)
+        while True:
+            self.iniciar(nombre)
+            try:
+                elemento = next(iterador)
+            except StopIteration:
+                return
+            finally:
+                self.terminar(nombre)
+            yield elemento
+
+    def clase(self, id_clase, segundos):
+        '''
+        Registra el tiempo de aplicacion de una clase.
+        '''
+        self.clases += 1
+        self.segundos_clases += segundos
+        if len(self.lentas) < LENTAS:
+            heapq.heappush(self.lentas, (segundos, id_clase))
+        else:
+            heapq.heappushpop(self.lentas, (segundos, id_clase))
+
+    def destino(self, nombre, reporte, cambios=None):
+        '''
+        Agrega el reporte de la aplicacion en una base de datos destino y el
+        resumen de sus cambios.
+        '''
+        datos = reporte.como_diccionario()
+        datos['estado'] = 'error' if reporte.error else 'ok'
+        datos['cambios'] = cambios
+        self.destinos[nombre] = datos
+
+    def como_diccionario(self):
+        '''
+        Devuelve el reporte como un diccionario serializable.
+        '''
+        return OrderedDict((
+            ('inicio', time.strftime('%Y-%m-%dT%H:%M:%S',
+                                     time.localtime(self.inicio))),
+            ('segundos', time.time() - self.inicio),
+            ('consultas', self.consultas() - self.consultas_inicio),
+            ('bytes', self.bytes),
+            ('fases', self.fases),
+            ('clases', OrderedDict((
+                ('cantidad', self.clases),
+                ('segundos', self.segundos_clases),
+                ('lentas', [{'id': id_clase, 'segundos': segundos}
+                            for (segundos, id_clase)
+                            in sorted(self.lentas, reverse=True)]),
+            ))),
+            ('destinos', self.destinos),
+            ('error', self.error),
+        ))
+
+    def resumen(self):
+        '''
+        Devuelve el reporte resumido en una linea.
+        '''
+        datos = self.como_diccionario()
+        partes = ["total=%.2fs" % datos['segundos']]
+        partes.extend("%s=%.2fs" % (nombre, fase['segundos'])
+                      for nombre, fase in self.fases.items())
+        partes.append("consultas=%d" % datos['consultas'])
+        partes.append("bytes=%d" % self.bytes)
+        partes.append("clases=%d" % self.clases)
+        if self.destinos:
+            partes.append("destinos=%s" % ",".join(
+                "%s:%s" % (nombre, datos['estado'])
+                for nombre, datos in self.destinos.items()))
+        if self.error:
+            partes.append("error=%s" % self.error)
+        return " ".join(partes)
+
+    def guardar(self, ruta):
+        '''
+        Guarda el reporte en formato JSON.
+        '''
+        with open(ruta, 'w') as f:
+            json.dump(self.como_diccionario(), f, indent=2)
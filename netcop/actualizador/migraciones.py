@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+'''
+Migraciones del esquema de la base de datos.
+
+Cada migracion es una funcion que verifica si ya fue aplicada y, si no lo
+fue, modifica el esquema. Se ejecutan en orden antes de aplicar una
+actualizacion, dentro de la misma transaccion.
+'''
+import syslog
+from peewee import IntegerField
+from playhouse.migrate import PostgresqlMigrator, migrate
+from . import models, redes
+
+# subredes normalizadas; id_unico es la subred que se conserva o NULL si la
+# subred no se puede interpretar
+NORMALIZACION = '''
+    CREATE TEMPORARY TABLE tmp_normalizacion (
+        id_cidr integer PRIMARY KEY,
+        id_unico integer,
+        direccion varchar(64),
+        prefijo smallint
+    ) ON COMMIT DROP
+'''
+
+# sentencias que unifican las subredes duplicadas segun tmp_normalizacion
+UNIFICACION = (
+    # los enlaces de los duplicados pasan a la subred que se conserva
+    '''INSERT INTO clase_cidr (id_clase, id_cidr, grupo)
+       SELECT DISTINCT ON (l.id_clase, n.id_unico)
+              l.id_clase, n.id_unico, l.grupo
+       FROM clase_cidr l
+       JOIN tmp_normalizacion n ON n.id_cidr = l.id_cidr
+       WHERE n.id_cidr <> n.id_unico AND NOT EXISTS (
+         SELECT 1 FROM clase_cidr x
+         WHERE x.id_clase = l.id_clase AND x.id_cidr = n.id_unico)
+       ORDER BY l.id_clase, n.id_unico, l.id_cidr''',
+    '''DELETE FROM clase_cidr l USING tmp_normalizacion n
+       WHERE l.id_cidr = n.id_cidr
+         AND n.id_unico IS DISTINCT FROM n.id_cidr''',
+    '''DELETE FROM cidr c USING tmp_normalizacion n
+       WHERE c.id_cidr = n.id_cidr
+         AND n.id_unico IS DISTINCT FROM n.id_cidr''',
+    # una direccion IPv6 normalizada puede no entrar en varchar(32)
+    'ALTER TABLE cidr ALTER COLUMN direccion TYPE varchar(64)',
+    '''UPDATE cidr c SET direccion = n.direccion, prefijo = n.prefijo
+       FROM tmp_normalizacion n WHERE c.id_cidr = n.id_cidr''',
+    '''ALTER TABLE cidr ALTER COLUMN direccion TYPE inet
+       USING direccion::inet''',
+)
+
+# indice para buscar las subredes que contienen una direccion
+INDICE_CONTENCION = '''
+    CREATE INDEX cidr_red ON cidr
+    USING gist ((set_masklen(direccion, prefijo)) inet_ops)
+'''
+
+
+def columnas(tabla):
+    '''
+    Devuelve los nombres de las columnas de una tabla.
+    '''
+    return set(columna.name for columna in models.db.get_columns(tabla))
+
+
+def agregar_digest(migrador):
+    '''
+    Agrega la columna digest a las clases de trafico.
+    '''
+    if 'digest' not in columnas(models.ClaseTrafico._meta.db_table):
+        migrate(migrador.add_column(models.ClaseTrafico._meta.db_table,
+                                    'digest', models.ClaseTrafico.digest))
+
+
+def tipo_columna(tabla, nombre):
+    '''
+    Devuelve el tipo de dato de una columna.
+    '''
+    for columna in models.db.get_columns(tabla):
+        if columna.name == nombre:
+            return columna.data_type
+
+
+def indices(tabla):
+    '''
+    Devuelve los nombres de los indices de una tabla.
+    '''
+    return set(indice.name for indice in models.db.get_indexes(tabla))
+
+
+def normalizar_cidr(migrador):
+    '''
+    Convierte la direccion de las subredes al tipo inet.
+
+    Las direcciones existentes se normalizan y las subredes repetidas (por
+    ejemplo 010.000.0.0/8 y 10.0.0.0/8) se unifican en la de menor id,
+    conservando los enlaces con las clases de trafico. Las subredes que no
+    se pueden interpretar se eliminan junto con sus enlaces.
+    '''
+    tabla = models.CIDR._meta.db_table
+    if tipo_columna(tabla, 'direccion') == 'inet':
+        return
+    unicos = dict()
+    filas = list()
+    consulta = models.db.execute_sql(
+        'SELECT id_cidr, direccion, prefijo FROM cidr ORDER BY id_cidr')
+    for (id_cidr, direccion, prefijo) in consulta.fetchall():
+        try:
+            red = redes.normalizar(direccion.strip(), prefijo)
+        except ValueError:
+            syslog.syslog(syslog.LOG_WARNING,
+                          "Eliminando subred invalida %s/%s" %
+                          (direccion, prefijo))
+            filas.append((id_cidr, None, None, None))
+            continue
+        clave = (str(red.network_address), red.prefixlen)
+        id_unico = unicos.setdefault(clave, id_cidr)
+        filas.append((id_cidr, id_unico) + clave)
+    models.db.execute_sql(NORMALIZACION)
+    cursor = models.db.get_cursor()
+    try:
+        models.db.consultas += 1
+        cursor.executemany(
+            'INSERT INTO tmp_normalizacion VALUES (%s, %s, %s, %s)', filas)
+    finally:
+        cursor.close()
+    for sentencia in UNIFICACION:
+        models.db.execute_sql(sentencia)
+    duplicadas = sum(1 for fila in filas
+                     if fila[1] is not None and fila[0] != fila[1])
+    if duplicadas:
+        syslog.syslog(syslog.LOG_INFO,
+                      "Subredes duplicadas eliminadas: %d" % duplicadas)
+
+
+def indexar_cidr(migrador):
+    '''
+    Crea el indice unico de las subredes y el indice de contencion.
+    '''
+    tabla = models.CIDR._meta.db_table
+    existentes = indices(tabla)
+    if 'cidr_direccion_prefijo' not in existentes:
+        migrate(migrador.add_index(tabla, ('direccion', 'prefijo'), True))
+    if 'cidr_red' not in existentes:
+        models.db.execute_sql(INDICE_CONTENCION)
+
+
+def agregar_rangos(migrador):
+    '''
+    Agrega el fin del rango a los puertos. Los puertos existentes son
+    rangos de un solo puerto.
+    '''
+    tabla = models.Puerto._meta.db_table
+    if 'numero_fin' not in columnas(tabla):
+        migrate(migrador.add_column(tabla, 'numero_fin',
+                                    IntegerField(null=True)))
+        models.db.execute_sql('UPDATE puerto SET numero_fin = numero')
+        migrate(migrador.add_not_null(tabla, 'numero_fin'))
+
+
+MIGRACIONES = (
+    agregar_digest,
+    normalizar_cidr,
+    indexar_cidr,
+    agregar_rangos,
+)
+
+
+def migrar():
+    '''
+    Aplica todas las migraciones pendientes.
+    '''
+    migrador = PostgresqlMigrator(models.db)
+    for migracion in MIGRACIONES:
+        migracion(migrador)
@@ -6,19 +6,78 @@ Utiliza el paquete *peewee* para el mapeo objeto-relacional. Permite realizar
 las consultas a la base de datos en lenguaje python de forma sencilla sin
 necesidad de escribir codigo SQL.
 '''
+import threading
 import peewee as models
 from . import config
+# identificadores de grupo de los enlaces de las clases
+from .grupos import INSIDE, OUTSIDE
 
-# Identificador de grupo para servicios que esten en la red local
-INSIDE = 'i'
-# Identificador de grupo para servicios que esten en Internet
-OUTSIDE = 'o'
 
-# Declaro parametros de conexion de la base de datos
-db = models.PostgresqlDatabase(config.DATABASE['database'],
-                               host=config.DATABASE['host'],
-                               user=config.DATABASE['user'],
-                               password=config.DATABASE['password'])
+class BaseDatos(models.PostgresqlDatabase):
+    '''
+    Base de datos PostgreSQL que cuenta las sentencias ejecutadas, para
+    poder medir cada fase de una actualizacion.
+
+    Se declara diferida: los parametros de conexion se leen de
+    config.DATABASE recien al abrir la primera conexion.
+
+    Como peewee mantiene una conexion por hilo, cada hilo puede conectarse
+    a otra base de datos con `usar`; la cuenta de sentencias tambien es
+    propia de cada hilo.
+    '''
+
+    def __init__(self, *args, **kwargs):
+        self.hilo = threading.local()
+        super(BaseDatos, self).__init__(*args, **kwargs)
+
+    @property
+    def consultas(self):
+        return getattr(self.hilo, 'consultas', 0)
+
+    @consultas.setter
+    def consultas(self, valor):
+        self.hilo.consultas = valor
+
+    def usar(self, parametros):
+        '''
+        Hace que las proximas conexiones del hilo actual se abran con
+        `parametros` (database, host, user, password y opcionalmente port)
+        en lugar de los de config.DATABASE. Con None se vuelve a estos.
+        '''
+        self.hilo.parametros = parametros
+
+    def _connect(self, database, **kwargs):
+        parametros = getattr(self.hilo, 'parametros', None)
+        if parametros is not None:
+            database = parametros['database']
+            kwargs = dict((clave, parametros[clave])
+                          for clave in ('host', 'port', 'user', 'password')
+                          if parametros.get(clave))
+        return super(BaseDatos, self)._connect(database, **kwargs)
+
+    def connect(self):
+        if self.deferred:
+            self.init(config.DATABASE['database'],
+                      host=config.DATABASE['host'],
+                      user=config.DATABASE['user'],
+                      password=config.DATABASE['password'])
+        super(BaseDatos, self).connect()
+
+    def execute_sql(self, sql, params=None, require_commit=True):
+        self.consultas += 1
+        return super(BaseDatos, self).execute_sql(sql, params,
+                                                  require_commit)
+
+
+# La conexion se abre al ejecutar la primera consulta
+db = BaseDatos(None)
+
+
+class InetField(models.Field):
+    '''
+    Direccion IP guardada con el tipo inet de PostgreSQL.
+    '''
+    db_field = 'inet'
 
 
 class ClaseTrafico(models.Model):
@@ -33,6 +92,8 @@ class ClaseTrafico(models.Model):
     descripcion = models.CharField(max_length=160)
     tipo = models.SmallIntegerField(default=0)
     activa = models.BooleanField(default=True)
+    # SHA256 del contenido de la clase aplicada por el actualizador
+    digest = models.CharField(max_length=64, null=True)
 
     def __str__(self):
         return u"%d: %s" % (self.id_clase, self.nombre)
@@ -54,17 +115,33 @@ class CIDR(models.Model):
 
     Si todos los bits de la mascara de subred están en uno representan a una
     red de host y el prefijo es 32.
+
+    La direccion se guarda normalizada (ver el modulo redes) y cada subred
+    aparece una sola vez.
     '''
     id_cidr = models.PrimaryKeyField()
-    direccion = models.CharField(max_length=32)
+    direccion = InetField()
     prefijo = models.SmallIntegerField(default=0)
 
     def __str__(self):
         return u"%d: %s/%d" % (self.id_cidr, self.direccion, self.prefijo)
 
+    @classmethod
+    def contienen(cls, ip):
+        '''
+        Devuelve una consulta con las subredes que contienen a la direccion
+        `ip`. Usa el indice GiST creado por las migraciones.
+        '''
+        red = models.fn.set_masklen(cls.direccion, cls.prefijo)
+        return cls.select().where(
+            models.Clause(red, models.SQL('>>='), models.fn.inet(ip)))
+
     class Meta:
         database = db
         db_table = u'cidr'
+        indexes = (
+            (('direccion', 'prefijo'), True),
+        )
 
 
 class Puerto(models.Model):
@@ -74,9 +151,13 @@ class Puerto(models.Model):
 
     Los puertos se componen de un numero de 2 bytes sin signo (rango entre 0 y
     65535) y un protocolo que puede ser 6 (TCP) o 17 (UDP).
+
+    Un rango de puertos se guarda en una sola fila, desde `numero` hasta
+    `numero_fin` inclusive. Para un puerto individual ambos son iguales.
     '''
     id_puerto = models.PrimaryKeyField()
     numero = models.IntegerField()
+    numero_fin = models.IntegerField()
     protocolo = models.SmallIntegerField(default=0)
 
     def __str__(self):
@@ -85,7 +166,16 @@ class Puerto(models.Model):
             proto = "tcp"
         elif self.protocolo == 17:
             proto = "udp"
-        return u"%d: %s/%s" % (self.id_puerto, self.numero, proto)
+        numero = str(self.numero)
+        if self.numero_fin != self.numero:
+            numero = "%d-%d" % (self.numero, self.numero_fin)
+        return u"%d: %s/%s" % (self.id_puerto, numero, proto)
+
+    def save(self, *args, **kwargs):
+        # sin numero_fin se guarda un puerto individual
+        if self.numero_fin is None:
+            self.numero_fin = self.numero
+        return super(Puerto, self).save(*args, **kwargs)
 
     class Meta:
         database = db
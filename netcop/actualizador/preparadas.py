@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+'''
+Sentencias preparadas para aplicar clases de a una.
+
+Al aplicar una actualizacion con el ORM cada clase modificada ejecuta las
+mismas sentencias con distintos parametros. Este modulo las prepara una vez
+por conexion (`PREPARE`), para que el servidor no vuelva a analizarlas y
+planificarlas en cada clase, y acumula las escrituras de los enlaces de
+varias clases para enviarlas juntas con `psycopg2.extras.execute_batch`, que
+junta muchas ejecuciones en un solo viaje al servidor.
+
+Las sentencias preparadas no son transaccionales: sobreviven al ROLLBACK de
+la transaccion en que se prepararon y duran lo que dura la conexion.
+'''
+import weakref
+from psycopg2.extras import execute_batch
+from . import models
+
+# cantidad de ejecuciones que execute_batch envia en cada viaje al servidor
+PAGINA = 100
+
+# cada sentencia se define como (tipos de los parametros, SQL)
+SENTENCIAS = {
+    # crea o modifica una clase de sistema. Devuelve 'creada', 'modificada'
+    # o ninguna fila si la clase es personalizada
+    'netcop_guardar_clase': (
+        ('integer', 'varchar', 'varchar', 'boolean', 'varchar'),
+        '''WITH existente AS (
+               SELECT tipo FROM clase_trafico WHERE id_clase = $1),
+           modificada AS (
+               UPDATE clase_trafico
+               SET nombre = $2, descripcion = $3, activa = $4, digest = $5
+               WHERE id_clase = $1 AND tipo = %(sistema)d
+               RETURNING id_clase),
+           creada AS (
+               INSERT INTO clase_trafico
+                   (id_clase, nombre, descripcion, tipo, activa, digest)
+               SELECT $1, $2, $3, %(sistema)d, $4, $5
+               WHERE NOT EXISTS (SELECT 1 FROM existente)
+               RETURNING id_clase)
+           SELECT 'creada' FROM creada
+           UNION ALL SELECT 'modificada' FROM modificada'''),
+    'netcop_desactivar_clase': (
+        ('integer',),
+        '''UPDATE clase_trafico SET activa = false, digest = NULL
+           WHERE id_clase = $1 AND tipo = %(sistema)d'''),
+    # enlaces existentes de una clase como filas (tipo, id, grupo)
+    'netcop_enlaces': (
+        ('integer',),
+        '''SELECT 'redes', id_cidr, grupo FROM clase_cidr
+           WHERE id_clase = $1
+           UNION ALL
+           SELECT 'puertos', id_puerto, grupo FROM clase_puerto
+           WHERE id_clase = $1'''),
+    'netcop_borrar_redes': (
+        ('integer', 'integer[]'),
+        '''DELETE FROM clase_cidr
+           WHERE id_clase = $1 AND id_cidr = ANY($2)'''),
+    'netcop_borrar_puertos': (
+        ('integer', 'integer[]'),
+        '''DELETE FROM clase_puerto
+           WHERE id_clase = $1 AND id_puerto = ANY($2)'''),
+    'netcop_enlazar_redes': (
+        ('integer', 'integer[]', 'char(1)[]'),
+        '''INSERT INTO clase_cidr (id_clase, id_cidr, grupo)
+           SELECT $1, unnest($2), unnest($3)'''),
+    'netcop_enlazar_puertos': (
+        ('integer', 'integer[]', 'char(1)[]'),
+        '''INSERT INTO clase_puerto (id_clase, id_puerto, grupo)
+           SELECT $1, unnest($2), unnest($3)'''),
+}
+
+# orden en que se envian las escrituras acumuladas: los enlaces que cambian
+# de grupo se borran antes de volver a insertarse
+ESCRITURAS = ('netcop_borrar_redes', 'netcop_borrar_puertos',
+              'netcop_enlazar_redes', 'netcop_enlazar_puertos')
+
+# sentencias preparadas en cada conexion abierta
+PREPARADAS = weakref.WeakKeyDictionary()
+
+
+class Sentencias(object):
+    '''
+    Ejecuta las sentencias preparadas en la conexion actual de models.db.
+
+    Las escrituras de enlaces se acumulan hasta llamar a `enviar`. Si
+    `diferir` es falso se envian al terminar cada clase.
+    '''
+
+    def __init__(self, diferir=False):
+        self.diferir = diferir
+        self.pendientes = dict((nombre, []) for nombre in ESCRITURAS)
+
+    def cursor(self, nombre):
+        '''
+        Devuelve un cursor de la conexion actual con la sentencia `nombre`
+        preparada.
+        '''
+        conexion = models.db.get_conn()
+        cursor = conexion.cursor()
+        preparadas = PREPARADAS.setdefault(conexion, set())
+        if nombre not in preparadas:
+            (tipos, sql) = SENTENCIAS[nombre]
+            cursor.execute('PREPARE %s (%s) AS %s' % (
+                nombre, ', '.join(tipos),
+                sql % {'sistema': models.ClaseTrafico.SISTEMA}))
+            models.db.consultas += 1
+            preparadas.add(nombre)
+        return cursor
+
+    def ejecucion(self, nombre):
+        '''
+        Devuelve el SQL que ejecuta la sentencia preparada `nombre`.
+        '''
+        return 'EXECUTE %s (%s)' % (
+            nombre, ', '.join(['%s'] * len(SENTENCIAS[nombre][0])))
+
+    def ejecutar(self, nombre, *parametros):
+        '''
+        Ejecuta la sentencia preparada `nombre` y devuelve el cursor.
+        '''
+        cursor = self.cursor(nombre)
+        cursor.execute(self.ejecucion(nombre), parametros)
+        models.db.consultas += 1
+        return cursor
+
+    def acumular(self, nombre, *parametros):
+        '''
+        Agrega una ejecucion de la escritura `nombre` a las pendientes.
+        '''
+        self.pendientes[nombre].append(parametros)
+
+    def terminar_clase(self):
+        '''
+        Marca el final de una clase. Envia las escrituras pendientes si no
+        se difieren o si ya se acumularon suficientes.
+        '''
+        cantidad = max(len(filas) for filas in self.pendientes.values())
+        if not self.diferir or cantidad >= PAGINA:
+            self.enviar()
+
+    def enviar(self):
+        '''
+        Envia todas las escrituras pendientes, en paginas de PAGINA
+        ejecuciones por viaje al servidor.
+        '''
+        for nombre in ESCRITURAS:
+            filas = self.pendientes[nombre]
+            if filas:
+                execute_batch(self.cursor(nombre), self.ejecucion(nombre),
+                              filas, page_size=PAGINA)
+                models.db.consultas += (len(filas) + PAGINA - 1) // PAGINA
+                self.pendientes[nombre] = []
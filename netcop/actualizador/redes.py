@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+'''
+Normalizacion de subredes.
+
+Las subredes se reciben como cadenas "direccion/prefijo". Antes de guardarlas
+se normalizan para que una misma red tenga siempre la misma representacion:
+se quitan los ceros a la izquierda de cada octeto, se ponen en cero los bits
+de host y las direcciones IPv6 se escriben en su forma comprimida.
+
+Una subred con bits de host en uno (10.0.0.1/8) probablemente esta mal
+escrita, por lo que al ponerlos en cero se registra en syslog. La validacion
+de las versiones descargadas rechaza estas subredes.
+'''
+import ipaddress
+import syslog
+
+
+def normalizar(direccion, prefijo, estricta=False):
+    '''
+    Devuelve la subred como un objeto ipaddress.IPv4Network o IPv6Network.
+
+    Los octetos de una direccion IPv4 se interpretan siempre en decimal,
+    aunque tengan ceros a la izquierda (010.000.0.0 es 10.0.0.0).
+
+    Si la direccion tiene bits de host en uno lanza ValueError cuando
+    `estricta` es verdadero; si no, los pone en cero y lo registra.
+    '''
+    octetos = direccion.split('.')
+    if len(octetos) == 4 and all(octeto.isdigit() for octeto in octetos):
+        direccion = '.'.join(str(int(octeto)) for octeto in octetos)
+    red = ipaddress.ip_network(u'%s/%d' % (direccion, int(prefijo)),
+                               strict=False)
+    if ipaddress.ip_address(u'%s' % direccion) != red.network_address:
+        if estricta:
+            raise ValueError("%s/%s tiene bits de host en uno" %
+                             (direccion, prefijo))
+        syslog.syslog(syslog.LOG_WARNING,
+                      "La subred %s/%s se guarda como %s" %
+                      (direccion, prefijo, red))
+    return red
+
+
+def interpretar(item, estricta=False):
+    '''
+    Interpreta una subred "direccion/prefijo" y la devuelve normalizada.
+    '''
+    (direccion, prefijo) = item.split('/')
+    return normalizar(direccion, prefijo, estricta)
+
+
+def agregar(subredes):
+    '''
+    Devuelve el menor conjunto de subredes que cubre exactamente a las
+    recibidas, uniendo las que se solapan o son adyacentes. Las subredes
+    IPv4 e IPv6 se agregan por separado.
+    '''
+    versiones = dict()
+    for red in subredes:
+        versiones.setdefault(red.version, []).append(red)
+    return [red for version in sorted(versiones)
+            for red in ipaddress.collapse_addresses(versiones[version])]
@@ -0,0 +1,409 @@
+# -*- coding: utf-8 -*-
+'''
+Carga en tablas sombra.
+
+Con la carga masiva del modulo carga los enlaces de las clases se borran e
+insertan dentro de la misma transaccion que leen los demas procesos, que
+compiten con ella por los bloqueos mientras dura toda la actualizacion.
+
+Este modulo arma el nuevo estado completo de `clase_cidr` y `clase_puerto`
+en las tablas `clase_cidr_sombra` y `clase_puerto_sombra`, sin tocar las
+tablas que se estan leyendo, lo valida y lo publica reemplazando las tablas
+por las sombras en una transaccion corta. Los lectores ven el conjunto de
+firmas anterior o el nuevo, nunca uno intermedio.
+
+La actualizacion se hace en tres transacciones:
+
+  1. carga de las clases descargadas, alta de los CIDR y puertos nuevos,
+     armado, validacion y estadisticas de las sombras (los lectores no se
+     bloquean);
+  2. actualizacion de las clases, copia de los enlaces de las clases
+     personalizadas y reemplazo de las tablas (bloqueo exclusivo de unos
+     milisegundos);
+  3. validacion de la clave foranea a clase_trafico, que no bloquea a los
+     lectores.
+
+Si otros objetos dependen de las tablas de enlaces (vistas o claves foraneas
+que las referencian), no se pueden reemplazar sin borrarlos; en ese caso la
+actualizacion se aplica en el lugar con la carga masiva del modulo carga.
+'''
+import re
+import syslog
+from . import carga, migraciones, models
+
+# tablas de enlaces: tabla, dimension, columna de la dimension, registro de
+# Cambios, tabla de carga y columnas que identifican a la dimension
+ENLACES = (
+    ('clase_cidr', 'cidr', 'id_cidr', 'redes', 'tmp_cidr',
+     ('direccion', 'prefijo')),
+    ('clase_puerto', 'puerto', 'id_puerto', 'puertos', 'tmp_puerto',
+     ('numero', 'numero_fin', 'protocolo')),
+)
+
+PREPARACION = (
+    ('sin_cambios',
+     '''SELECT t.id_clase FROM tmp_clase t
+        JOIN clase_trafico c ON c.id_clase = t.id_clase
+        WHERE NOT t.eliminada AND c.tipo = %(sistema)s
+          AND c.digest = t.digest'''),
+    # descarta clases personalizadas o sin cambios; las eliminadas se
+    # desactivan al publicar
+    (None,
+     '''DELETE FROM tmp_clase t USING clase_trafico c
+        WHERE c.id_clase = t.id_clase AND NOT t.eliminada
+          AND (c.tipo <> %(sistema)s OR c.digest = t.digest)'''),
+)
+
+# sentencias de cada tabla de enlaces, se completan con los datos de ENLACES
+SOMBRA = (
+    (None,
+     '''DELETE FROM {carga} s WHERE NOT EXISTS (
+          SELECT 1 FROM tmp_clase t
+          WHERE t.id_clase = s.id_clase AND NOT t.eliminada)'''),
+    (None,
+     '''INSERT INTO {dimension} ({columnas})
+        SELECT DISTINCT {columnas_carga} FROM {carga} s
+        WHERE NOT EXISTS (SELECT 1 FROM {dimension} d WHERE {union})'''),
+    # la clave primaria es (clase, dimension), gana el primer grupo en el
+    # que aparece
+    (None,
+     '''CREATE TEMPORARY TABLE tmp_{tabla} AS
+        SELECT DISTINCT ON (s.id_clase, d.{columna})
+               s.id_clase, d.{columna}, s.grupo
+        FROM {carga} s JOIN {dimension} d ON {union}
+        ORDER BY s.id_clase, d.{columna}, s.orden'''),
+    (None, 'DROP TABLE IF EXISTS {tabla}_sombra'),
+    (None,
+     'CREATE TABLE {tabla}_sombra (LIKE {tabla} INCLUDING DEFAULTS)'),
+    # se conservan los enlaces de las clases que no se modifican
+    (None,
+     '''INSERT INTO {tabla}_sombra SELECT l.* FROM {tabla} l
+        WHERE NOT EXISTS (
+          SELECT 1 FROM tmp_clase t
+          WHERE t.id_clase = l.id_clase AND NOT t.eliminada)'''),
+    (None,
+     '''INSERT INTO {tabla}_sombra (id_clase, {columna}, grupo)
+        SELECT id_clase, {columna}, grupo FROM tmp_{tabla}'''),
+    (('{registro}', 'eliminadas'),
+     '''SELECT l.id_clase, l.{columna}, l.grupo FROM {tabla} l
+        JOIN tmp_clase t ON t.id_clase = l.id_clase AND NOT t.eliminada
+        EXCEPT
+        SELECT id_clase, {columna}, grupo FROM tmp_{tabla}'''),
+    (('{registro}', 'agregadas'),
+     '''SELECT id_clase, {columna}, grupo FROM tmp_{tabla}
+        EXCEPT
+        SELECT l.id_clase, l.{columna}, l.grupo FROM {tabla} l
+        JOIN tmp_clase t ON t.id_clase = l.id_clase AND NOT t.eliminada'''),
+)
+
+# enlaces de la sombra cuya clase no existe ni se va a crear
+HUERFANOS = '''
+    SELECT count(*) FROM {tabla}_sombra s
+    WHERE NOT EXISTS (
+        SELECT 1 FROM clase_trafico c WHERE c.id_clase = s.id_clase)
+      AND NOT EXISTS (
+        SELECT 1 FROM tmp_clase t
+        WHERE t.id_clase = s.id_clase AND NOT t.eliminada)
+'''
+
+# enlaces de clases de sistema en la sombra y en la tabla publicada
+SISTEMA = '''
+    SELECT
+      (SELECT count(*) FROM {tabla}_sombra s
+       WHERE NOT EXISTS (
+         SELECT 1 FROM clase_trafico c
+         WHERE c.id_clase = s.id_clase AND c.tipo <> %(sistema)s)),
+      (SELECT count(*) FROM {tabla} l
+       WHERE NOT EXISTS (
+         SELECT 1 FROM clase_trafico c
+         WHERE c.id_clase = l.id_clase AND c.tipo <> %(sistema)s))
+'''
+
+CLASES = (
+    ('desactivadas',
+     '''UPDATE clase_trafico c SET activa = false, digest = NULL
+        FROM tmp_clase t
+        WHERE t.eliminada AND c.id_clase = t.id_clase
+          AND c.tipo = %(sistema)s
+        RETURNING c.id_clase'''),
+    ('modificadas',
+     '''UPDATE clase_trafico c
+        SET nombre = t.nombre, descripcion = t.descripcion,
+            activa = t.activa, digest = t.digest
+        FROM tmp_clase t
+        WHERE NOT t.eliminada AND c.id_clase = t.id_clase
+        RETURNING c.id_clase'''),
+    ('creadas',
+     '''INSERT INTO clase_trafico
+          (id_clase, nombre, descripcion, tipo, activa, digest)
+        SELECT t.id_clase, t.nombre, t.descripcion, %(sistema)s, t.activa,
+               t.digest
+        FROM tmp_clase t
+        WHERE NOT t.eliminada AND NOT EXISTS (
+          SELECT 1 FROM clase_trafico c WHERE c.id_clase = t.id_clase)
+        RETURNING id_clase'''),
+)
+
+# los enlaces de las clases personalizadas se copian con las tablas ya
+# bloqueadas, por si se modificaron mientras se armaba la sombra
+PERSONALIZADOS = (
+    '''DELETE FROM {tabla}_sombra s USING clase_trafico c
+       WHERE c.id_clase = s.id_clase AND c.tipo <> %(sistema)s''',
+    '''INSERT INTO {tabla}_sombra SELECT l.* FROM {tabla} l
+       JOIN clase_trafico c ON c.id_clase = l.id_clase
+       WHERE c.tipo <> %(sistema)s''',
+)
+
+RESTRICCIONES = '''
+    SELECT conname, pg_get_constraintdef(oid),
+           confrelid = 'clase_trafico'::regclass
+    FROM pg_constraint
+    WHERE conrelid = %s::regclass AND contype IN ('p', 'u', 'f')
+    ORDER BY conname
+'''
+
+PERMISOS = '''
+    SELECT privilege_type, grantee FROM information_schema.role_table_grants
+    WHERE table_name = %s AND grantee <> current_user
+'''
+
+INDICES = '''
+    SELECT c.relname, pg_get_indexdef(i.indexrelid)
+    FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+    WHERE i.indrelid = %s::regclass AND NOT EXISTS (
+        SELECT 1 FROM pg_constraint k WHERE k.conindid = i.indexrelid)
+    ORDER BY c.relname
+'''
+
+# objetos que dependen de una tabla sin ser parte de ella, como vistas o
+# claves foraneas de otras tablas; impiden borrarla al publicar la sombra
+DEPENDIENTES = '''
+    SELECT DISTINCT pg_describe_object(classid, objid, objsubid)
+    FROM pg_depend
+    WHERE refclassid = 'pg_class'::regclass AND refobjid = %s::regclass
+      AND deptype = 'n'
+    ORDER BY 1
+'''
+
+SUFIJO = '_sombra'
+
+
+class SombraInvalida(Exception):
+    '''
+    Las tablas sombra no pasaron la validacion y no se publicaron.
+    '''
+
+
+class CargaSombra(carga.CargaMasiva):
+    '''
+    Aplica una actualizacion armando tablas sombra y reemplazando con ellas
+    las tablas de enlaces.
+
+    Maneja sus propias transacciones, no debe ejecutarse dentro de una.
+    '''
+    # las tablas de carga se usan en mas de una transaccion
+    TEMPORALES = ''
+
+    def sentencias(self, sentencias, enlace):
+        '''
+        Completa las sentencias con los datos de una tabla de ENLACES.
+        '''
+        (tabla, dimension, columna, registro, tabla_carga, columnas) = enlace
+        datos = {
+            'tabla': tabla,
+            'dimension': dimension,
+            'columna': columna,
+            'registro': registro,
+            'carga': tabla_carga,
+            'columnas': ', '.join(columnas),
+            'columnas_carga': ', '.join('s.' + c for c in columnas),
+            'union': ' AND '.join('d.%s = s.%s' % (c, c) for c in columnas),
+        }
+        for (destino, sentencia) in sentencias:
+            if isinstance(destino, tuple):
+                destino = tuple(d.format(**datos) for d in destino)
+            yield (destino, sentencia.format(**datos))
+
+    def consultar(self, cursor, sentencia, parametros=None):
+        '''
+        Ejecuta una consulta y devuelve todas sus filas.
+        '''
+        self.ejecutar(cursor, sentencia, parametros)
+        return cursor.fetchall()
+
+    def procesar(self, cursor, sentencias, parametros):
+        '''
+        Ejecuta sentencias (registro, sentencia) registrando sus filas en
+        los cambios del actualizador.
+        '''
+        for (registro, sentencia) in sentencias:
+            self.ejecutar(cursor, sentencia, parametros)
+            if registro is not None:
+                self.registrar(registro, cursor.fetchall())
+
+    def armar(self, cursor, parametros):
+        '''
+        Arma y valida las tablas sombra a partir de las tablas de carga y
+        les calcula estadisticas, para que el planificador las tenga desde
+        que se publican.
+        '''
+        self.avisar_personalizadas(cursor, parametros)
+        self.procesar(cursor, PREPARACION, parametros)
+        for enlace in ENLACES:
+            self.procesar(cursor, self.sentencias(SOMBRA, enlace), parametros)
+        self.validar(cursor, parametros)
+        for enlace in ENLACES:
+            self.restringir(cursor, enlace[0])
+            # las estadisticas se conservan al renombrar la sombra
+            self.ejecutar(cursor, 'ANALYZE %s%s' % (enlace[0], SUFIJO))
+
+    def validar(self, cursor, parametros):
+        '''
+        Verifica que las sombras no tengan enlaces a clases inexistentes y
+        que los enlaces de las clases de sistema sean los publicados mas los
+        agregados y menos los eliminados.
+        '''
+        cambios = self.actualizador.cambios
+        for (tabla, _, _, registro, _, _) in ENLACES:
+            datos = {'tabla': tabla}
+            (huerfanos,) = self.consultar(cursor, HUERFANOS.format(**datos))[0]
+            if huerfanos:
+                raise SombraInvalida("%s_sombra tiene %d enlaces a clases "
+                                     "inexistentes" % (tabla, huerfanos))
+            (sombra, publicados) = self.consultar(
+                cursor, SISTEMA.format(**datos), parametros)[0]
+            diferencia = sum(1 if e[4] == 'agregadas' else -1
+                             for e in cambios.enlaces if e[0] == registro)
+            if sombra != publicados + diferencia:
+                raise SombraInvalida("%s_sombra tiene %d enlaces de sistema, "
+                                     "se esperaban %d" %
+                                     (tabla, sombra, publicados + diferencia))
+
+    def restringir(self, cursor, tabla):
+        '''
+        Crea en la sombra las restricciones, indices y permisos de la tabla
+        publicada, con el sufijo SUFIJO. La clave foranea a clase_trafico se
+        agrega al publicar, porque las clases nuevas todavia no existen.
+        '''
+        for (nombre, definicion, a_clases) in self.consultar(
+                cursor, RESTRICCIONES, (tabla,)):
+            if not a_clases:
+                self.ejecutar(cursor, 'ALTER TABLE %s%s ADD CONSTRAINT %s%s %s'
+                              % (tabla, SUFIJO, nombre, SUFIJO, definicion))
+        for (nombre, definicion) in self.consultar(cursor, INDICES, (tabla,)):
+            definicion = definicion.replace('INDEX %s ON' % nombre,
+                                            'INDEX %s%s ON' % (nombre, SUFIJO),
+                                            1)
+            definicion = re.sub(r' ON (\S+\.)?%s ' % tabla,
+                                ' ON %s%s ' % (tabla, SUFIJO), definicion,
+                                count=1)
+            self.ejecutar(cursor, definicion)
+        for (permiso, rol) in self.consultar(cursor, PERMISOS, (tabla,)):
+            if rol != 'PUBLIC':
+                rol = '"%s"' % rol
+            self.ejecutar(cursor, 'GRANT %s ON %s%s TO %s' %
+                          (permiso, tabla, SUFIJO, rol))
+
+    def dependientes(self, cursor):
+        '''
+        Devuelve los objetos que dependen de las tablas de enlaces y que
+        impiden reemplazarlas por las sombras.
+        '''
+        return [objeto
+                for (tabla, _, _, _, _, _) in ENLACES
+                for (objeto,) in self.consultar(cursor, DEPENDIENTES,
+                                                (tabla,))]
+
+    def publicar(self, cursor, parametros):
+        '''
+        Actualiza las clases y reemplaza las tablas de enlaces por las
+        sombras.
+        '''
+        self.procesar(cursor, CLASES, parametros)
+        tablas = [enlace[0] for enlace in ENLACES]
+        # las restricciones se leen antes de bloquear
+        restricciones = dict(
+            (tabla, self.consultar(cursor, RESTRICCIONES, (tabla,)))
+            for tabla in tablas)
+        indices = dict((tabla, self.consultar(cursor, INDICES, (tabla,)))
+                       for tabla in tablas)
+        self.ejecutar(cursor, 'LOCK TABLE %s IN ACCESS EXCLUSIVE MODE' %
+                      ', '.join(tablas))
+        for tabla in tablas:
+            for sentencia in PERSONALIZADOS:
+                self.ejecutar(cursor, sentencia.format(tabla=tabla),
+                              parametros)
+            self.ejecutar(cursor, 'DROP TABLE %s' % tabla)
+            self.ejecutar(cursor, 'ALTER TABLE %s%s RENAME TO %s' %
+                          (tabla, SUFIJO, tabla))
+            for (nombre, definicion, a_clases) in restricciones[tabla]:
+                if a_clases:
+                    self.ejecutar(cursor,
+                                  'ALTER TABLE %s ADD CONSTRAINT %s %s '
+                                  'NOT VALID' % (tabla, nombre, definicion))
+                else:
+                    self.ejecutar(cursor,
+                                  'ALTER TABLE %s RENAME CONSTRAINT %s%s '
+                                  'TO %s' % (tabla, nombre, SUFIJO, nombre))
+            for (nombre, _) in indices[tabla]:
+                self.ejecutar(cursor, 'ALTER INDEX %s%s RENAME TO %s' %
+                              (nombre, SUFIJO, nombre))
+
+    def validar_claves(self, cursor):
+        '''
+        Valida las claves foraneas agregadas como NOT VALID al publicar.
+        '''
+        for (tabla, _, _, _, _, _) in ENLACES:
+            for (nombre, _, a_clases) in self.consultar(
+                    cursor, RESTRICCIONES, (tabla,)):
+                if a_clases:
+                    self.ejecutar(cursor,
+                                  'ALTER TABLE %s VALIDATE CONSTRAINT %s' %
+                                  (tabla, nombre))
+
+    def aplicar(self, clases):
+        '''
+        Aplica todas las clases recibidas. Si otros objetos dependen de las
+        tablas de enlaces las aplica en el lugar con la carga masiva.
+        '''
+        reporte = self.actualizador.reporte
+        parametros = {'sistema': models.ClaseTrafico.SISTEMA}
+        cursor = models.db.get_cursor()
+        dependientes = self.dependientes(cursor)
+        if dependientes:
+            cursor.close()
+            syslog.syslog(syslog.LOG_WARNING,
+                          "No se pueden reemplazar las tablas de enlaces, "
+                          "dependen de ellas: %s. Se aplica la actualizacion "
+                          "en el lugar" % ', '.join(dependientes))
+            with models.db.atomic():
+                migraciones.migrar()
+                carga.CargaMasiva(self.actualizador).aplicar(clases)
+                with reporte.fase('cambios'):
+                    self.actualizador.cambios.resolver()
+            return
+        archivos = self.volcar(reporte.iterar('lectura', clases))
+        try:
+            with models.db.atomic():
+                migraciones.migrar()
+                with reporte.fase('copia'):
+                    self.copiar(cursor, archivos)
+                with reporte.fase('sombra'):
+                    self.armar(cursor, parametros)
+                    # los CIDR y puertos nuevos ya existen; se traducen los
+                    # enlaces antes de bloquear las tablas publicadas
+                    self.actualizador.cambios.resolver()
+            with reporte.fase('publicacion'):
+                with models.db.atomic():
+                    self.publicar(cursor, parametros)
+            with reporte.fase('validacion'):
+                with models.db.atomic():
+                    self.validar_claves(cursor)
+        finally:
+            with models.db.atomic():
+                for (tabla, _) in carga.COPIAS:
+                    self.ejecutar(cursor, 'DROP TABLE IF EXISTS %s' % tabla)
+                for (tabla, _, _, _, _, _) in ENLACES:
+                    self.ejecutar(cursor,
+                                  'DROP TABLE IF EXISTS tmp_%s' % tabla)
+            cursor.close()
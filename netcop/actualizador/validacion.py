@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+'''
+Validacion de versiones de firmas.
+
+Antes de abrir la transaccion de una actualizacion se recorre la version
+completa buscando clases mal formadas: subredes que no se pueden interpretar
+con ipaddress o que tienen bits de host en uno, puertos fuera del rango
+0-65535 o con un protocolo desconocido, nombres demasiado largos y clases,
+subredes o puertos repetidos. Se informan todos los errores juntos, en lugar
+de fallar con el primero despues de haber aplicado parte de la version.
+
+Las versiones grandes se validan en lotes repartidos en un pool de procesos.
+'''
+import collections
+import itertools
+import multiprocessing
+import numbers
+from . import models, redes
+
+# cantidad de clases de cada lote que se valida en un proceso
+LOTE = 500
+
+# protocolos reconocidos en los puertos; sin protocolo coincide con todos
+PROTOCOLOS = ('', 'tcp', 'udp')
+
+LISTAS = (('subredes_outside', 'subredes_inside'),
+          ('puertos_outside', 'puertos_inside'))
+
+# cantidad de errores que se incluyen en el mensaje de la excepcion
+MOSTRADOS = 10
+
+
+class VersionInvalida(Exception):
+    '''
+    La version descargada tiene clases mal formadas. `errores` es la lista
+    de todos los errores encontrados.
+    '''
+    def __init__(self, errores):
+        mensaje = "%d errores: %s" % (len(errores),
+                                      "; ".join(errores[:MOSTRADOS]))
+        if len(errores) > MOSTRADOS:
+            mensaje += "; ..."
+        super(VersionInvalida, self).__init__(mensaje)
+        self.errores = errores
+
+
+def puerto(item):
+    '''
+    Interpreta un puerto "numero[/protocolo]" o "inicio-fin[/protocolo]" y
+    lo devuelve como (inicio, fin, protocolo). Lanza ValueError si esta mal
+    formado.
+    '''
+    partes = item.split('/')
+    if len(partes) > 2:
+        raise ValueError("puerto invalido")
+    limites = partes[0].split('-')
+    if len(limites) > 2 or not all(l.strip().isdigit() for l in limites):
+        raise ValueError("puerto invalido")
+    (inicio, fin) = (int(limites[0]), int(limites[-1]))
+    if fin > 65535:
+        raise ValueError("puerto fuera de rango")
+    if inicio > fin:
+        raise ValueError("rango de puertos invertido")
+    protocolo = partes[1].lower() if len(partes) == 2 else ''
+    if protocolo not in PROTOCOLOS:
+        raise ValueError("protocolo desconocido")
+    return (inicio, fin, protocolo)
+
+
+def subred(item):
+    '''
+    Interpreta una subred "direccion/prefijo". Lanza ValueError si esta mal
+    formada o tiene bits de host en uno.
+    '''
+    return redes.interpretar(item, estricta=True)
+
+
+def validar_clase(clase):
+    '''
+    Devuelve la lista de errores de una clase.
+    '''
+    if not isinstance(clase, dict):
+        return ["clase invalida: %r" % (clase,)]
+    id_clase = clase.get('id')
+    if not isinstance(id_clase, numbers.Integral) or \
+            isinstance(id_clase, bool):
+        return ["clase con id invalido: %r" % (id_clase,)]
+    if clase.get('eliminada'):
+        return []
+    errores = list()
+    for campo in ('nombre', 'descripcion'):
+        maximo = getattr(models.ClaseTrafico, campo).max_length
+        if len(u'%s' % clase.get(campo, '')) > maximo:
+            errores.append("clase %d: %s de mas de %d caracteres" %
+                           (id_clase, campo, maximo))
+    for listas, interpretar in zip(LISTAS, (subred, puerto)):
+        for lista in listas:
+            items = clase.get(lista, [])
+            if not isinstance(items, list):
+                errores.append("clase %d: %s no es una lista" %
+                               (id_clase, lista))
+                continue
+            vistos = set()
+            for item in items:
+                try:
+                    normalizado = interpretar(item)
+                except (ValueError, TypeError, AttributeError) as inst:
+                    errores.append("clase %d: %s %r: %s" %
+                                   (id_clase, lista, item, inst))
+                    continue
+                if normalizado in vistos:
+                    errores.append("clase %d: %s %r repetido" %
+                                   (id_clase, lista, item))
+                vistos.add(normalizado)
+    return errores
+
+
+def validar_lote(clases):
+    '''
+    Valida un lote de clases. Devuelve los errores y los id de las clases,
+    para buscar clases repetidas entre lotes.
+    '''
+    errores = list()
+    ids = list()
+    for clase in clases:
+        errores.extend(validar_clase(clase))
+        # las clases sin id valido ya tienen su error
+        if isinstance(clase, dict) and \
+                isinstance(clase.get('id'), numbers.Integral):
+            ids.append(clase['id'])
+    return (errores, ids)
+
+
+def agrupar(clases, cantidad):
+    '''
+    Genera listas de hasta `cantidad` clases.
+    '''
+    clases = iter(clases)
+    while True:
+        lote = list(itertools.islice(clases, cantidad))
+        if not lote:
+            return
+        yield lote
+
+
+def validar_en_pool(lotes, procesos):
+    '''
+    Genera los resultados de validar_lote de cada lote en un pool de
+    procesos, en orden. Los lotes se leen en este proceso y solo se
+    mantienen en vuelo dos por proceso.
+    '''
+    procesos = procesos or multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(procesos)
+    try:
+        pendientes = collections.deque()
+        for lote in lotes:
+            pendientes.append(pool.apply_async(validar_lote, (lote,)))
+            if len(pendientes) >= 2 * procesos:
+                yield pendientes.popleft().get()
+        while pendientes:
+            yield pendientes.popleft().get()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def validar(clases, procesos=None):
+    '''
+    Valida todas las clases y lanza VersionInvalida con todos los errores
+    encontrados.
+
+    Si hay mas de un lote se validan en un pool de `procesos` procesos (por
+    defecto uno por CPU); las clases se leen de a un lote a medida que los
+    procesos las consumen.
+    '''
+    lotes = agrupar(clases, LOTE)
+    primeros = list(itertools.islice(lotes, 2))
+    if len(primeros) < 2:
+        resultados = [validar_lote(lote) for lote in primeros]
+    else:
+        resultados = validar_en_pool(itertools.chain(primeros, lotes),
+                                     procesos)
+    errores = list()
+    vistos = set()
+    for (encontrados, ids) in resultados:
+        errores.extend(encontrados)
+        for id_clase in ids:
+            if id_clase in vistos:
+                errores.append("clase %d repetida" % id_clase)
+            vistos.add(id_clase)
+    if errores:
+        raise VersionInvalida(errores)
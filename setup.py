@@ -14,8 +14,12 @@ setup(
     install_requires=[
         'requests>=2.10.0',
         'peewee>=2.8.0',
-        'psycopg2>=2.6.0',
+        'psycopg2>=2.7.0',
+        'ipaddress>=1.0.16; python_version < "3.3"',
     ],
+    extras_require={
+        'clasificador': ['numpy>=1.9'],
+    },
     scripts=["scripts/actualizar"],
     test_suite="tests",
     classifiers=[
@@ -4,11 +4,20 @@ Pruebas del modulo actualizador.
 
 Se prueban todos los metodos de la clase ´Actualizador´
 '''
+import json
 import netcop
+import os
+import shutil
+import tempfile
+import time
 import unittest
 from mock import patch, mock_open, Mock
 from netcop.actualizador import models, config
-from netcop.actualizador.actualizador import Actualizador
+from netcop.actualizador.actualizador import (Actualizador, DeltaInvalida,
+                                              DescargaIncompleta,
+                                              DestinosFallidos)
+from netcop.actualizador.fuentes import FuenteLocal
+from netcop.actualizador.validacion import VersionInvalida
 
 
 class ActualizadorTests(unittest.TestCase):
@@ -19,6 +28,17 @@ class ActualizadorTests(unittest.TestCase):
              models.ClasePuerto],
             safe=True)
         self.actualizador = Actualizador()
+        # los archivos del actualizador se guardan en un directorio temporal
+        directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directorio)
+        os.mkdir(os.path.join(directorio, 'cache'))
+        parche = patch.dict(config.NETCOP, {
+            'cache': os.path.join(directorio, 'cache'),
+            'local_version': os.path.join(directorio, 'version'),
+            'reporte': os.path.join(directorio, 'reporte.json'),
+        })
+        parche.start()
+        self.addCleanup(parche.stop)
 
     @patch.object(Actualizador, 'obtener_version_actual')
     @patch.object(Actualizador, 'obtener_version_disponible')
@@ -110,10 +130,12 @@ class ActualizadorTests(unittest.TestCase):
         mock_descargar = Mock()
         mock_descargar.return_value = [
             {
+                'id': 1,
                 'nombre': 'foo',
                 'descripcion': 'bar'
             },
             {
+                'id': 2,
                 'nombre': 'bar',
                 'descripcion': 'bar'
             },
@@ -130,6 +152,100 @@ class ActualizadorTests(unittest.TestCase):
         mock_aplicar.assert_called()
         assert mock_aplicar.call_count == 2
         assert self.actualizador.version_actual == 'b'
+        assert os.path.exists(self.actualizador.archivo_indice())
+
+    def test_actualizar_delta_invalida(self):
+        '''
+        Prueba que si la actualizacion incremental no parte de la version
+        instalada se descargue la version completa.
+        '''
+        # preparo datos
+        self.actualizador.version_actual = 'a'
+        self.actualizador.version_disponible = 'c'
+
+        def descargar(delta=False):
+            if delta:
+                raise DeltaInvalida('b')
+            return [{'id': 1}]
+        mock_descargar = Mock(side_effect=descargar)
+        self.actualizador.descargar_actualizacion = mock_descargar
+        mock_aplicar = Mock()
+        self.actualizador.aplicar_actualizacion = mock_aplicar
+        # llamo metodo a probar
+        self.actualizador.actualizar()
+        # verifico que todo este bien
+        assert mock_descargar.call_count == 2
+        mock_aplicar.assert_called_once_with({'id': 1})
+        assert self.actualizador.version_actual == 'c'
+
+    def test_leer_clases_delta(self):
+        '''
+        Prueba leer una actualizacion incremental.
+        '''
+        # preparo datos
+        self.actualizador.version_actual = 'a\n'
+        cuerpo = json.dumps({
+            'version': 'b',
+            'base': 'a',
+            'agregadas': [{'id': 1}],
+            'modificadas': [{'id': 2}],
+            'eliminadas': [3],
+        }).encode()
+        # llamo metodo a probar
+        clases = list(self.actualizador.leer_clases([cuerpo]))
+        # verifico que todo este bien
+        assert clases == [{'id': 1}, {'id': 2}, {'id': 3, 'eliminada': True}]
+
+        # preparo datos
+        self.actualizador.version_actual = 'z'
+        # llamo metodo a probar
+        with self.assertRaises(DeltaInvalida):
+            list(self.actualizador.leer_clases([cuerpo]))
+
+        # preparo datos
+        self.actualizador.version_actual = 'a'
+        sin_base = json.dumps({'version': 'b', 'agregadas': [{'id': 1}]})
+        base_al_final = json.dumps({'agregadas': [{'id': 1}]})[:-1] + \
+            ', "base": "z"}'
+        vacia = json.dumps({'version': 'b'})
+        completa = json.dumps({'version': 'b', 'clases': [{'id': 1}]})
+        # llamo metodo a probar
+        for documento in (sin_base, base_al_final, vacia):
+            with self.assertRaises(DeltaInvalida):
+                list(self.actualizador.leer_clases([documento.encode()],
+                                                   delta=True))
+        # el servidor puede responder con la version completa
+        clases = list(self.actualizador.leer_clases([completa.encode()],
+                                                    delta=True))
+        assert clases == [{'id': 1}]
+        # sin pedir una actualizacion incremental no se exige la base
+        clases = list(self.actualizador.leer_clases([sin_base.encode()]))
+        assert clases == [{'id': 1}]
+
+    def test_aplicar_actualizacion_eliminada(self):
+        '''
+        Prueba que una clase eliminada del repositorio se desactive.
+        '''
+        # creo transaccion para descartar cambios generados en la base
+        with models.db.atomic() as transaction:
+            # preparo datos
+            models.ClaseTrafico.create(
+                id_clase=60606060,
+                nombre='pepe',
+                descripcion='clase de prueba',
+                activa=True
+            )
+            # llamo metodo a probar
+            self.actualizador.aplicar_actualizacion({'id': 60606060,
+                                                     'eliminada': True})
+            # verifico que todo este bien
+            saved = models.ClaseTrafico.get(
+                models.ClaseTrafico.id_clase == 60606060
+            )
+            assert not saved.activa
+            assert saved.nombre == 'pepe'
+            # descarto cambios en la base de datos
+            transaction.rollback()
 
     def test_aplicar_actualizacion_nueva(self):
         '''
@@ -367,6 +483,40 @@ class ActualizadorTests(unittest.TestCase):
             # descarto cambios en la base de datos
             transaction.rollback()
 
+    def test_aplicar_actualizacion_rango_puertos(self):
+        '''
+        Prueba que un rango de puertos se guarde en una sola fila.
+        '''
+        # creo transaccion para descartar cambios generados en la base
+        with models.db.atomic() as transaction:
+            clase = {
+                'id': 60606060,
+                'nombre': 'foo',
+                'descripcion': 'bar',
+                'puertos_outside': ['6881-6999/tcp', '6881/tcp'],
+            }
+            # llamo metodo a probar
+            self.actualizador.aplicar_actualizacion(clase)
+            # verifico que todo este bien
+            saved = models.ClaseTrafico.get(
+                models.ClaseTrafico.id_clase == 60606060
+            )
+            puertos = sorted((p.puerto.numero, p.puerto.numero_fin,
+                              p.puerto.protocolo) for p in saved.puertos)
+            assert puertos == [(6881, 6881, 6), (6881, 6999, 6)]
+            # descarto cambios en la base de datos
+            transaction.rollback()
+
+    def test_rango(self):
+        '''
+        Prueba interpretar puertos individuales y rangos.
+        '''
+        assert self.actualizador.rango('80') == (80, 80)
+        assert self.actualizador.rango('6881-6999') == (6881, 6999)
+        for rango in ('6999-6881', '1-2-3', 'foo'):
+            with self.assertRaises(ValueError):
+                self.actualizador.rango(rango)
+
     def test_aplicar_actualizacion_clase_personalizada(self):
         '''
         Prueba el metodo aplicar_actualizacion con una clase que no es de
@@ -476,6 +626,53 @@ class ActualizadorTests(unittest.TestCase):
             # descarto cambios en la base de datos
             transaction.rollback()
 
+    def test_aplicar_actualizacion_conserva_enlaces(self):
+        '''
+        Prueba que solo se borren y se inserten los enlaces que cambiaron;
+        los que siguen iguales no se reescriben.
+        '''
+        # creo transaccion para descartar cambios generados en la base
+        with models.db.atomic() as transaction:
+            # preparo datos
+            clase = models.ClaseTrafico.create(id_clase=60606060,
+                                               nombre='foo',
+                                               descripcion='bar')
+            cidr = [models.CIDR.create(direccion=direccion, prefijo=32)
+                    for direccion in ('1.1.1.1', '2.2.2.2', '3.3.3.3')]
+            for item in cidr:
+                models.ClaseCIDR.create(clase=clase, cidr=item,
+                                        grupo=models.OUTSIDE)
+
+            def ubicaciones():
+                cursor = models.db.execute_sql(
+                    'SELECT id_cidr, ctid::text FROM clase_cidr '
+                    'WHERE id_clase = %s', (60606060,))
+                return dict(cursor.fetchall())
+            antes = ubicaciones()
+            # 1.1.1.1 sigue igual, 2.2.2.2 cambia de grupo, 3.3.3.3 se va
+            # y 4.4.4.4 es nueva
+            self.actualizador.aplicar([{
+                'id': 60606060,
+                'nombre': 'foo',
+                'descripcion': 'bar',
+                'subredes_outside': ['1.1.1.1/32', '4.4.4.4/32'],
+                'subredes_inside': ['2.2.2.2/32'],
+            }])
+            # verifico que todo este bien
+            despues = ubicaciones()
+            assert despues[cidr[0].id_cidr] == antes[cidr[0].id_cidr]
+            assert despues[cidr[1].id_cidr] != antes[cidr[1].id_cidr]
+            assert cidr[2].id_cidr not in despues
+            assert len(despues) == 3
+            assert self.actualizador.cambios.redes == {60606060: {
+                'agregadas': [('2.2.2.2', 32, models.INSIDE),
+                              ('4.4.4.4', 32, models.OUTSIDE)],
+                'eliminadas': [('2.2.2.2', 32, models.OUTSIDE),
+                               ('3.3.3.3', 32, models.OUTSIDE)],
+            }}
+            # descarto cambios en la base de datos
+            transaction.rollback()
+
     def test_aplicar_actualizacion_eliminar_puerto(self):
         '''
         Prueba el metodo aplicar_actualizacion con una clase existente que
@@ -528,7 +725,7 @@ class ActualizadorTests(unittest.TestCase):
             # descarto cambios en la base de datos
             transaction.rollback()
 
-    @patch('requests.get')
+    @patch('requests.Session.get')
     def test_consultar_version_disponible(self, mock_get):
         '''
         Prueba obtener la ultima version disponible desde el servidor.
@@ -536,6 +733,8 @@ class ActualizadorTests(unittest.TestCase):
         # preparo datos
         mock_response = Mock()
         mock_response.status_code = 200
+        mock_response.headers = {}
+        mock_response.content = b'{"version": "a"}'
         mock_response.json = Mock(return_value={'version': 'a'})
         mock_get.return_value = mock_response
         # llamo metodo a probar
@@ -543,7 +742,84 @@ class ActualizadorTests(unittest.TestCase):
         # verifico que todo este bien
         assert version == 'a'
 
-    @patch('requests.get')
+    @patch.object(Actualizador, 'guardar_validadores')
+    @patch.object(Actualizador, 'obtener_validadores')
+    @patch('requests.Session.get')
+    def test_consultar_version_disponible_304(self, mock_get,
+                                              mock_validadores, mock_guardar):
+        '''
+        Prueba que la consulta de version sea condicional y que una respuesta
+        304 devuelva la version guardada.
+        '''
+        # preparo datos
+        url = config.NETCOP['url_version']
+        mock_validadores.return_value = {}
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.headers = {'ETag': '"x"'}
+        mock_response.content = b'{"version": "a"}'
+        mock_response.json = Mock(return_value={'version': 'a'})
+        mock_get.return_value = mock_response
+        # llamo metodo a probar
+        assert self.actualizador.obtener_version_disponible() == 'a'
+        # verifico que todo este bien
+        validadores = mock_guardar.call_args[0][0]
+        assert validadores[url]['etag'] == '"x"'
+
+        # preparo datos
+        mock_validadores.return_value = validadores
+        mock_response.status_code = 304
+        # llamo metodo a probar
+        assert self.actualizador.obtener_version_disponible() == 'a'
+        # verifico que todo este bien
+        cabeceras = mock_get.call_args[1]['headers']
+        assert cabeceras['If-None-Match'] == '"x"'
+
+    @patch.object(Actualizador, 'obtener_validadores')
+    @patch('requests.Session.get')
+    def test_consultar_version_espejos(self, mock_get, mock_validadores):
+        '''
+        Prueba consultar varios espejos y usar la primera respuesta sin
+        esperar a los espejos lentos.
+        '''
+        # preparo datos
+        mock_validadores.return_value = {}
+        versiones = {'http://a': ('v2', 0.5), 'http://b': ('v2', 0),
+                     'http://c': ('v1', 0.5)}
+
+        def get(url, **kwargs):
+            base = url.rsplit('/', 1)[0]
+            if base == 'http://d':
+                raise IOError()
+            (version, demora) = versiones[base]
+            time.sleep(demora)
+            respuesta = Mock()
+            respuesta.status_code = 200
+            respuesta.headers = {}
+            respuesta.content = b'{}'
+            respuesta.json = Mock(return_value={'version': version})
+            return respuesta
+        mock_get.side_effect = get
+        espejos = 'http://a, http://b/, http://c, http://d'
+        with patch.dict(config.NETCOP, {'espejos': espejos}):
+            # llamo metodo a probar
+            inicio = time.time()
+            version = self.actualizador.obtener_version_disponible()
+            # verifico que todo este bien
+            assert time.time() - inicio < 0.5
+            assert version == 'v2'
+            assert self.actualizador.descargas == ['http://b/descarga']
+            # los espejos lentos terminan en segundo plano
+            self.actualizador.consulta.join()
+            assert self.actualizador.descargas == ['http://b/descarga',
+                                                   'http://a/descarga']
+            latencias = self.actualizador.obtener_latencias()
+            assert set(latencias) == set(['http://a/version',
+                                          'http://b/version',
+                                          'http://c/version',
+                                          'http://d/version'])
+
+    @patch('requests.Session.get')
     def test_consultar_version_disponible_error(self, mock_get):
         '''
         Prueba el tratamiento de error al obtener la ultima version disponible
@@ -562,7 +838,7 @@ class ActualizadorTests(unittest.TestCase):
         with self.assertRaises(Exception):
             self.actualizador.obtener_version_disponible()
 
-    @patch('requests.get')
+    @patch('requests.Session.get')
     def test_descargar_actualizacion(self, mock_get):
         '''
         Prueba la descarga de la ultima version desde el servidor. Debe
@@ -582,22 +858,119 @@ class ActualizadorTests(unittest.TestCase):
             },
         ]
 
+        cuerpo = json.dumps({'version': 'a', 'clases': clases}).encode()
         mock_response = Mock()
         mock_response.status_code = 200
-        mock_response.json = Mock(return_value={'clases': clases})
+        mock_response.headers = {'Content-Length': str(len(cuerpo))}
+        mock_response.iter_content = Mock(
+            return_value=[cuerpo[i:i + 7] for i in range(0, len(cuerpo), 7)]
+        )
         mock_get.return_value = mock_response
+        self.actualizador.version_disponible = 'b'
         # llamo metodo a probar
-        descarga = self.actualizador.descargar_actualizacion()
+        descarga = list(self.actualizador.descargar_actualizacion())
         # verifico que todo este bien
         for clase in clases:
             assert clase in descarga
+        # la segunda vez se usa la descarga guardada
+        descarga = list(self.actualizador.descargar_actualizacion())
+        mock_get.assert_called_once()
+        for clase in clases:
+            assert clase in descarga
+
+    @patch('requests.Session.get')
+    def test_descargar_actualizacion_continuar(self, mock_get):
+        '''
+        Prueba que una descarga interrumpida continue desde donde quedo.
+        '''
+        # preparo datos
+        cuerpo = json.dumps({'clases': [{'id': 1}, {'id': 2}]}).encode()
+        self.actualizador.version_disponible = 'b'
+        ruta = self.actualizador.archivo_cache()
+        with open(ruta + '.parcial', 'wb') as f:
+            f.write(cuerpo[:10])
+        mock_response = Mock()
+        mock_response.status_code = 206
+        mock_response.headers = {
+            'Content-Range': 'bytes 10-%d/%d' % (len(cuerpo) - 1, len(cuerpo))}
+        mock_response.iter_content = Mock(return_value=[cuerpo[10:]])
+        mock_get.return_value = mock_response
+        # llamo metodo a probar
+        descarga = list(self.actualizador.descargar_actualizacion())
+        # verifico que todo este bien
+        cabeceras = mock_get.call_args[1]['headers']
+        assert cabeceras['Range'] == 'bytes=10-'
+        assert descarga == [{'id': 1}, {'id': 2}]
+        assert not os.path.exists(ruta + '.parcial')
+
+    @patch('requests.Session.get')
+    def test_descargar_actualizacion_incompleta(self, mock_get):
+        '''
+        Prueba que una descarga cortada no se guarde como completa.
+        '''
+        # preparo datos
+        cuerpo = json.dumps({'clases': [{'id': 1}, {'id': 2}]}).encode()
+        self.actualizador.version_disponible = 'b'
+        ruta = self.actualizador.archivo_cache()
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.headers = {'Content-Length': str(len(cuerpo))}
+        mock_response.iter_content = Mock(return_value=[cuerpo[:10]])
+        mock_get.return_value = mock_response
+        # llamo metodo a probar
+        with self.assertRaises(DescargaIncompleta):
+            self.actualizador.descargar_actualizacion()
+        # verifico que todo este bien
+        assert not os.path.exists(ruta)
+        assert os.path.getsize(ruta + '.parcial') == 10
+
+        # preparo datos
+        mock_response.status_code = 206
+        mock_response.headers = {
+            'Content-Range': 'bytes 10-%d/%d' % (len(cuerpo) - 1, len(cuerpo))}
+        mock_response.iter_content = Mock(return_value=[cuerpo[10:20]])
+        # llamo metodo a probar
+        with self.assertRaises(DescargaIncompleta):
+            self.actualizador.descargar_actualizacion()
+        # verifico que todo este bien
+        assert not os.path.exists(ruta)
+        assert os.path.getsize(ruta + '.parcial') == 20
+
+        # preparo datos
+        mock_response.iter_content = Mock(return_value=[cuerpo[20:]])
+        # llamo metodo a probar
+        descarga = list(self.actualizador.descargar_actualizacion())
+        # verifico que todo este bien
+        assert descarga == [{'id': 1}, {'id': 2}]
 
-    @patch('requests.get')
+    def test_actualizar_descarga_invalida(self):
+        '''
+        Prueba que una descarga guardada que no se puede leer o no es valida
+        se borre, para volver a pedirla en la proxima ejecucion.
+        '''
+        # preparo datos
+        self.actualizador.version_disponible = 'b'
+        ruta = self.actualizador.archivo_cache()
+        for cuerpo in ('{"clases": [{"id": 1}, {"id": ',
+                       '{"clases": [{"id": 1}, {"id": 1}]}'):
+            with open(ruta, 'w') as f:
+                f.write(cuerpo)
+            mock_aplicar = Mock()
+            self.actualizador.aplicar = mock_aplicar
+            # llamo metodo a probar
+            with self.assertRaises(Exception):
+                self.actualizador.actualizar()
+            # verifico que todo este bien
+            assert not os.path.exists(ruta)
+            mock_aplicar.assert_not_called()
+
+    @patch('requests.Session.get')
     def test_descargar_actualizacion_error(self, mock_get):
         '''
         Prueba el tratamiento de error al descargar la ultima version
         '''
         # preparo datos
+        self.actualizador.version_disponible = 'b'
         mock_get.side_effect = IOError()
         # llamo metodo a probar
         with self.assertRaises(IOError):
@@ -610,3 +983,282 @@ class ActualizadorTests(unittest.TestCase):
         # llamo metodo a probar
         with self.assertRaises(Exception):
             self.actualizador.descargar_actualizacion()
+
+    def test_aplicar_actualizacion_comparte_dimensiones(self):
+        '''
+        Prueba que dos clases con la misma subred y el mismo puerto
+        compartan las filas de CIDR y Puerto.
+        '''
+        # creo transaccion para descartar cambios generados en la base
+        with models.db.atomic() as transaction:
+            # preparo datos
+            for id_clase in (60606060, 60606061):
+                clase = {
+                    'id': id_clase,
+                    'nombre': 'foo',
+                    'descripcion': 'bar',
+                    'subredes_outside': ['9.9.9.0/24'],
+                    'puertos_outside': ['9999/tcp'],
+                }
+                # llamo metodo a probar
+                self.actualizador.aplicar_actualizacion(clase)
+            # verifico que todo este bien
+            assert (models.CIDR
+                    .select()
+                    .where(models.CIDR.direccion == '9.9.9.0',
+                           models.CIDR.prefijo == 24)
+                    .count()) == 1
+            assert (models.Puerto
+                    .select()
+                    .where(models.Puerto.numero == 9999,
+                           models.Puerto.protocolo == 6)
+                    .count()) == 1
+            # descarto cambios en la base de datos
+            transaction.rollback()
+
+    def test_redes_agregadas(self):
+        '''
+        Prueba que con agregar_redes habilitado se unan las subredes de cada
+        grupo por separado.
+        '''
+        nueva = {
+            'id': 60606060,
+            'subredes_outside': ['10.0.0.0/25', '10.0.0.128/25',
+                                 '10.0.0.7/32'],
+            'subredes_inside': ['10.0.0.0/32'],
+        }
+        with patch.dict(config.NETCOP, {'agregar_redes': 'si'}):
+            assert list(self.actualizador.redes(nueva)) == [
+                ('10.0.0.0', 24, models.OUTSIDE),
+                ('10.0.0.0', 32, models.INSIDE),
+            ]
+        assert self.actualizador.redes_agregadas == 2
+        assert len(list(self.actualizador.redes(nueva))) == 4
+
+    def test_aplicar_cambios(self):
+        '''
+        Prueba que aplicar registre las clases y enlaces modificados.
+        '''
+        # creo transaccion para descartar cambios generados en la base
+        with models.db.atomic() as transaction:
+            # preparo datos
+            clase = models.ClaseTrafico.create(id_clase=60606060,
+                                               nombre='foo',
+                                               descripcion='bar')
+            puerto = models.Puerto.create(numero=80, protocolo=6)
+            models.ClasePuerto.create(clase=clase, puerto=puerto,
+                                      grupo=models.OUTSIDE)
+            models.ClaseTrafico.create(id_clase=60606061, nombre='foo',
+                                       descripcion='bar')
+            sin_cambios = {'id': 60606062, 'nombre': 'foo'}
+            models.ClaseTrafico.create(
+                id_clase=60606062, nombre='foo', descripcion='',
+                digest=self.actualizador.digest(sin_cambios))
+            clases = [
+                {
+                    'id': 60606060,
+                    'nombre': 'foo',
+                    'puertos_outside': ['443/tcp'],
+                    'subredes_inside': ['10.0.0.0/8'],
+                },
+                {'id': 60606061, 'eliminada': True},
+                sin_cambios,
+                {'id': 60606063, 'nombre': 'nueva'},
+            ]
+            # llamo metodo a probar
+            self.actualizador.aplicar(clases)
+            # verifico que todo este bien
+            cambios = self.actualizador.cambios
+            assert cambios
+            assert cambios.creadas == set([60606063])
+            assert cambios.modificadas == set([60606060])
+            assert cambios.desactivadas == set([60606061])
+            assert cambios.sin_cambios == set([60606062])
+            assert cambios.redes == {60606060: {
+                'agregadas': [('10.0.0.0', 8, models.INSIDE)],
+                'eliminadas': [],
+            }}
+            assert cambios.puertos == {60606060: {
+                'agregadas': [(443, 443, 6, models.OUTSIDE)],
+                'eliminadas': [(80, 80, 6, models.OUTSIDE)],
+            }}
+            # si se vuelve a aplicar no hay cambios
+            self.actualizador.aplicar(clases[2:3])
+            assert not self.actualizador.cambios
+            # descarto cambios en la base de datos
+            transaction.rollback()
+
+    def test_revertir(self):
+        '''
+        Prueba volver a una version del historial sin consultar al servidor.
+        '''
+        cache = config.NETCOP['cache']
+        with open(os.path.join(cache, 'v1.json'), 'w') as f:
+            json.dump({'version': 'v1', 'clases': [
+                {'id': 60606060, 'nombre': 'foo',
+                 'puertos_outside': ['80/tcp']},
+                {'id': 60606061, 'nombre': 'bar'},
+            ]}, f)
+        # creo transaccion para descartar cambios generados en la base
+        with models.db.atomic() as transaction:
+            self.actualizador.version_disponible = 'v1'
+            self.actualizador.actualizar()
+            # la version v2 es incremental
+            with open(os.path.join(cache, 'v2-v1.json'), 'w') as f:
+                json.dump({'version': 'v2', 'base': 'v1',
+                           'modificadas': [{'id': 60606060, 'nombre': 'foo',
+                                            'puertos_outside': ['443/tcp']}],
+                           'agregadas': [{'id': 60606062, 'nombre': 'nueva'}],
+                           'eliminadas': [60606061]}, f)
+            self.actualizador.version_disponible = 'v2'
+            self.actualizador.actualizar()
+            entradas = self.actualizador.historial().entradas()
+            assert [e['version'] for e in entradas] == ['v2', 'v1']
+            assert entradas[0]['clases'] == 2
+            assert entradas[0]['modificadas'] == 1
+            # llamo metodo a probar
+            with patch.object(Actualizador, 'consultar_servidor') as mock:
+                cambios = Actualizador().revertir()
+                mock.assert_not_called()
+            # verifico que todo este bien
+            assert cambios.modificadas == set([60606060, 60606061])
+            assert cambios.desactivadas == set([60606062])
+            assert cambios.puertos[60606060] == {
+                'agregadas': [(80, 80, 6, models.OUTSIDE)],
+                'eliminadas': [(443, 443, 6, models.OUTSIDE)],
+            }
+            activas = set(models.ClaseTrafico
+                                .select(models.ClaseTrafico.id_clase)
+                                .where(models.ClaseTrafico.activa == True,
+                                       models.ClaseTrafico.id_clase >=
+                                       60606060)
+                                .tuples())
+            assert activas == set([(60606060,), (60606061,)])
+            assert self.actualizador.obtener_version_actual() == 'v1'
+            # la version revertida no se vuelve a instalar
+            with patch.object(Actualizador, 'obtener_version_disponible',
+                              return_value='v2'):
+                assert not self.actualizador.hay_actualizacion()
+            with self.assertRaises(ValueError):
+                self.actualizador.revertir('v3')
+            # descarto cambios en la base de datos
+            transaction.rollback()
+
+    def test_actualizar_desde_archivo(self):
+        '''
+        Prueba aplicar una version local sin consultar al servidor.
+        '''
+        ruta = os.path.join(os.path.dirname(config.NETCOP['cache']),
+                            'local.json')
+        with open(ruta, 'w') as f:
+            json.dump({'version': 'v1', 'clases': [
+                {'id': 60606060, 'nombre': 'foo',
+                 'subredes_outside': ['10.0.0.0/8']}]}, f)
+        self.actualizador.fuente = FuenteLocal(self.actualizador, ruta)
+        # creo transaccion para descartar cambios generados en la base
+        with models.db.atomic() as transaction:
+            # llamo metodo a probar
+            with patch.object(Actualizador, 'consultar_servidor') as mock:
+                assert self.actualizador.hay_actualizacion()
+                cambios = self.actualizador.actualizar()
+                mock.assert_not_called()
+            # verifico que todo este bien
+            assert cambios.creadas == set([60606060])
+            assert self.actualizador.obtener_version_actual() == 'v1'
+            assert self.actualizador.historial().buscar('v1')
+            assert not self.actualizador.hay_actualizacion()
+            # descarto cambios en la base de datos
+            transaction.rollback()
+
+    def test_actualizar_destinos(self):
+        '''
+        Prueba aplicar una version descargada una sola vez en varias bases
+        de datos.
+        '''
+        local_version = config.NETCOP['local_version']
+        destinos = {
+            'b': dict(config.DATABASE, database='netcop_b',
+                      local_version=local_version + '.b'),
+            'c': dict(config.DATABASE, database='netcop_c',
+                      local_version=local_version + '.c'),
+        }
+        with open(local_version + '.c', 'w') as f:
+            f.write('v2')
+        aplicadas = dict()
+
+        def aplicar(actualizador, clases):
+            base = models.db.hilo.parametros['database']
+            aplicadas[base] = clases
+            if base == 'netcop_b':
+                raise ValueError('sin espacio')
+            actualizador.cambios.creadas.add(1)
+        self.actualizador.version_disponible = 'v2'
+        mock_clases = Mock(return_value=iter([{'id': 1}]))
+        self.actualizador.fuente = Mock(clases=mock_clases)
+        with patch.dict(config.DESTINOS, destinos), \
+                patch.object(Actualizador, 'aplicar', aplicar), \
+                patch.object(Actualizador, 'guardar_indice'):
+            # llamo metodo a probar
+            with self.assertRaises(DestinosFallidos):
+                self.actualizador.actualizar()
+        # verifico que todo este bien
+        mock_clases.assert_called_once_with(delta=True)
+        # el destino c ya tenia la version
+        assert aplicadas == {config.DATABASE['database']: [{'id': 1}],
+                             'netcop_b': [{'id': 1}]}
+        assert self.actualizador.cambios.creadas == set([1])
+        assert self.actualizador.obtener_version_actual() == 'v2'
+        assert Actualizador(destinos['b']).obtener_version_actual() is None
+        reporte = self.actualizador.reporte.como_diccionario()
+        assert reporte['destinos']['database']['estado'] == 'ok'
+        assert reporte['destinos']['b']['estado'] == 'error'
+        assert reporte['destinos']['b']['error'] == 'sin espacio'
+        assert 'c' not in reporte['destinos']
+
+    def test_actualizar_version_invalida(self):
+        '''
+        Prueba que una version mal formada se rechace antes de modificar la
+        base de datos.
+        '''
+        # preparo datos
+        self.actualizador.version_actual = 'a'
+        self.actualizador.version_disponible = 'b'
+        self.actualizador.descargar_actualizacion = Mock(return_value=[
+            {'id': 1, 'subredes_outside': ['10.0.0.0/8/8']},
+            {'id': 2, 'puertos_inside': ['http/tcp']},
+        ])
+        mock_aplicar = Mock()
+        self.actualizador.aplicar_actualizacion = mock_aplicar
+        # llamo metodo a probar
+        with self.assertRaises(VersionInvalida) as contexto:
+            self.actualizador.actualizar()
+        # verifico que todo este bien
+        assert len(contexto.exception.errores) == 2
+        mock_aplicar.assert_not_called()
+        assert self.actualizador.version_actual == 'a'
+
+    def test_aplicar_actualizacion_digest(self):
+        '''
+        Prueba que una clase cuyo digest coincide con el instalado no se
+        modifique.
+        '''
+        # creo transaccion para descartar cambios generados en la base
+        with models.db.atomic() as transaction:
+            # preparo datos
+            clase = {
+                'id': 60606060,
+                'nombre': 'foo',
+                'descripcion': 'bar',
+                'subredes_outside': ['2.2.2.0/24', '1.1.1.1/32'],
+            }
+            assert self.actualizador.aplicar_actualizacion(clase)
+            self.actualizador.digests = None
+            # llamo metodo a probar
+            clase['subredes_outside'].reverse()
+            resultado = self.actualizador.aplicar_actualizacion(clase)
+            # verifico que todo este bien
+            assert resultado is None
+            clase['nombre'] = 'otro'
+            assert self.actualizador.aplicar_actualizacion(clase)
+            # descarto cambios en la base de datos
+            transaction.rollback()
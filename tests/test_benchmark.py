@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+'''
+Pruebas del benchmark de actualizaciones.
+'''
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from netcop.actualizador import config, models, validacion
+from benchmarks import actualizar as benchmark
+
+
+class BenchmarkTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directorio)
+
+    def test_generar_version_valida(self):
+        '''
+        Prueba que las versiones generadas pasen la validacion. Con tantas
+        subredes y puertos por clase sortearlos sin descartar repetidos los
+        repite.
+        '''
+        # preparo datos
+        ruta = os.path.join(self.directorio, 'descarga')
+        # llamo metodo a probar
+        benchmark.generar_version(ruta, 2, 4000, 4000, 0.5, 1, 'netcop')
+        # verifico que todo este bien
+        with open(ruta) as f:
+            clases = json.load(f)['clases']
+        assert sum(len(clase['subredes_outside']) +
+                   len(clase['subredes_inside']) for clase in clases) == 4000
+        validacion.validar(clases)
+
+    def test_medir_error(self):
+        '''
+        Prueba que si falla la aplicacion se informe el error en lugar de
+        esperar para siempre el resultado.
+        '''
+        # preparo datos
+        args = argparse.Namespace(clases=2, redes=2, puertos=2,
+                                  solapamiento=0.5, semilla='netcop',
+                                  base='netcop_bench_inexistente',
+                                  carga='orm')
+        parametros = dict((clave, config.DATABASE[clave])
+                          for clave in ('host', 'user', 'password'))
+        servidor = benchmark.Servidor(self.directorio)
+        self.addCleanup(servidor.cerrar)
+        # el proceso hijo no debe heredar la conexion abierta
+        models.db.close()
+        # llamo metodo a probar
+        with self.assertRaises(RuntimeError) as contexto:
+            benchmark.medir(args, parametros, self.directorio, servidor, 1)
+        # verifico que todo este bien
+        assert 'netcop_bench_inexistente' in str(contexto.exception)
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+'''
+Pruebas del modulo carga.
+
+Se prueba la carga masiva de actualizaciones mediante COPY.
+'''
+import unittest
+from netcop.actualizador import carga, models
+from netcop.actualizador.actualizador import Actualizador
+
+
+class CargaMasivaTests(unittest.TestCase):
+
+    def setUp(self):
+        models.db.create_tables(
+            [models.ClaseTrafico, models.CIDR, models.Puerto, models.ClaseCIDR,
+             models.ClasePuerto],
+            safe=True)
+        self.carga = carga.CargaMasiva(Actualizador())
+
+    def test_escapar(self):
+        '''
+        Prueba convertir valores al formato de texto de COPY.
+        '''
+        assert carga.escapar(None) == '\\N'
+        assert carga.escapar(True) == 't'
+        assert carga.escapar(3) == '3'
+        assert carga.escapar('a\tb\\c\n') == 'a\\tb\\\\c\\n'
+
+    def test_aplicar(self):
+        '''
+        Prueba aplicar clases nuevas, modificadas, eliminadas y
+        personalizadas.
+        '''
+        # creo transaccion para descartar cambios generados en la base
+        with models.db.atomic() as transaction:
+            # preparo datos
+            existente = models.ClaseTrafico.create(id_clase=60606060,
+                                                   nombre='foo',
+                                                   descripcion='bar')
+            cidr = models.CIDR.create(direccion='1.1.1.1', prefijo=32)
+            models.ClaseCIDR.create(clase=existente, cidr=cidr,
+                                    grupo=models.OUTSIDE)
+            personalizada = models.ClaseTrafico.create(id_clase=60606061,
+                                                       nombre='foo',
+                                                       descripcion='bar',
+                                                       tipo=1)
+            models.ClaseTrafico.create(id_clase=60606062, nombre='foo',
+                                       descripcion='bar')
+            clases = [
+                {
+                    'id': 60606060,
+                    'nombre': 'otro\tnombre',
+                    'descripcion': 'bar',
+                    'subredes_outside': ['2.2.2.0/24'],
+                    'subredes_inside': ['2.2.2.0/24'],
+                    'puertos_inside': ['53/udp', '53', '6881-6999/tcp'],
+                },
+                {
+                    'id': 60606061,
+                    'nombre': 'pepe',
+                    'subredes_outside': ['3.3.3.3/32'],
+                },
+                {'id': 60606062, 'eliminada': True},
+                {'id': 60606063, 'nombre': 'nueva'},
+            ]
+            # llamo metodo a probar
+            self.carga.aplicar(clases)
+            # verifico que todo este bien
+            saved = models.ClaseTrafico.get(
+                models.ClaseTrafico.id_clase == 60606060)
+            assert saved.nombre == 'otro\tnombre'
+            assert saved.digest == Actualizador().digest(clases[0])
+            redes = [(r.cidr.direccion, r.cidr.prefijo, r.grupo)
+                     for r in saved.redes]
+            assert redes == [('2.2.2.0', 24, models.OUTSIDE)]
+            puertos = sorted((p.puerto.numero, p.puerto.numero_fin,
+                              p.puerto.protocolo, p.grupo)
+                             for p in saved.puertos)
+            assert puertos == [(53, 53, 0, models.INSIDE),
+                               (53, 53, 17, models.INSIDE),
+                               (6881, 6999, 6, models.INSIDE)]
+            saved = models.ClaseTrafico.get(
+                models.ClaseTrafico.id_clase == personalizada.id_clase)
+            assert saved.nombre == personalizada.nombre
+            assert saved.tipo == personalizada.tipo
+            assert not saved.redes.exists()
+            saved = models.ClaseTrafico.get(
+                models.ClaseTrafico.id_clase == 60606062)
+            assert not saved.activa
+            saved = models.ClaseTrafico.get(
+                models.ClaseTrafico.id_clase == 60606063)
+            assert saved.nombre == 'nueva'
+            assert saved.tipo == models.ClaseTrafico.SISTEMA
+            cambios = self.carga.actualizador.cambios
+            cambios.resolver()
+            assert cambios.creadas == set([60606063])
+            assert cambios.modificadas == set([60606060])
+            assert cambios.desactivadas == set([60606062])
+            assert cambios.redes == {60606060: {
+                'agregadas': [('2.2.2.0', 24, models.OUTSIDE)],
+                'eliminadas': [('1.1.1.1', 32, models.OUTSIDE)],
+            }}
+            assert cambios.puertos[60606060]['agregadas'] == [
+                (53, 53, 0, models.INSIDE), (53, 53, 17, models.INSIDE),
+                (6881, 6999, 6, models.INSIDE)]
+            # descarto cambios en la base de datos
+            transaction.rollback()
+
+    def test_clase_repetida(self):
+        '''
+        Prueba que una clase repetida se informe antes de cargarla.
+        '''
+        clases = [{'id': 60606060}, {'id': 60606061},
+                  {'id': 60606060, 'eliminada': True}]
+        with self.assertRaises(ValueError) as contexto:
+            self.carga.volcar(clases)
+        assert '60606060' in str(contexto.exception)
+
+    def test_estadisticas(self):
+        '''
+        Prueba que las tablas temporales se analicen despues de cargarlas.
+        '''
+        # creo transaccion para descartar cambios generados en la base
+        with models.db.atomic() as transaction:
+            archivos = self.carga.volcar([{
+                'id': 60606060,
+                'subredes_outside': ['1.1.1.1/32', '2.2.2.2/32'],
+            }])
+            cursor = models.db.get_cursor()
+            self.carga.copiar(cursor, archivos)
+            cursor.execute("SELECT relname, reltuples FROM pg_class "
+                           "WHERE relkind = 'r' AND relname LIKE 'tmp\\_%%'")
+            assert dict(cursor.fetchall()) == {
+                'tmp_clase': 1, 'tmp_cidr': 2, 'tmp_puerto': 0}
+            # descarto cambios en la base de datos
+            transaction.rollback()
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+'''
+Pruebas del modulo clasificador.
+
+Se prueba clasificar flujos en lote y que el resultado coincida con las
+consultas individuales del indice.
+'''
+import random
+import unittest
+from netcop.actualizador import clasificador, models
+
+
+@unittest.skipIf(clasificador.numpy is None, "NumPy no esta instalado")
+class ClasificadorTests(unittest.TestCase):
+
+    def setUp(self):
+        models.db.create_tables(
+            [models.ClaseTrafico, models.CIDR, models.Puerto, models.ClaseCIDR,
+             models.ClasePuerto],
+            safe=True)
+        # creo transaccion para descartar cambios generados en la base
+        with models.db.atomic() as transaction:
+            redes = {
+                60606060: [('10.0.0.0', 8, models.OUTSIDE)],
+                60606061: [('10.1.0.0', 16, models.OUTSIDE),
+                           ('2001:db8::', 32, models.OUTSIDE)],
+                60606063: [('10.1.2.0', 24, models.INSIDE)],
+            }
+            puertos = {
+                60606060: [(80, 80, 6, models.OUTSIDE)],
+                60606062: [(6881, 6999, 0, models.OUTSIDE)],
+                60606063: [(53, 53, 17, models.INSIDE)],
+            }
+            for id_clase in (60606060, 60606061, 60606062, 60606063):
+                clase = models.ClaseTrafico.create(
+                    id_clase=id_clase, nombre='foo', descripcion='bar')
+                for (direccion, prefijo, grupo) in redes.get(id_clase, []):
+                    cidr = models.CIDR.create(direccion=direccion,
+                                              prefijo=prefijo)
+                    models.ClaseCIDR.create(clase=clase, cidr=cidr,
+                                            grupo=grupo)
+                for (numero, fin, protocolo, grupo) in \
+                        puertos.get(id_clase, []):
+                    puerto = models.Puerto.create(
+                        numero=numero, numero_fin=fin, protocolo=protocolo)
+                    models.ClasePuerto.create(clase=clase, puerto=puerto,
+                                              grupo=grupo)
+            self.clasificador = clasificador.Clasificador.desde_base()
+            # descarto cambios en la base de datos
+            transaction.rollback()
+
+    def test_clasificar(self):
+        '''
+        Prueba clasificar flujos individuales.
+        '''
+        assert self.clasificador.clasificar('10.1.2.3', 80, 6) == \
+            [60606060, 60606061]
+        assert self.clasificador.clasificar('10.2.0.1', 80, 17) == []
+        assert self.clasificador.clasificar('192.168.0.1', 6900, 6) == \
+            [60606062]
+        assert self.clasificador.clasificar('2001:db8::1', 22, 6) == \
+            [60606061]
+        assert self.clasificador.clasificar('10.1.2.3', 53, 17,
+                                            models.INSIDE) == [60606063]
+        assert self.clasificador.clasificar('10.1.2.3', 53, 6,
+                                            models.INSIDE) == []
+
+    def test_clasificar_lote(self):
+        '''
+        Prueba que clasificar un lote coincida con consultar el indice flujo
+        por flujo.
+        '''
+        azar = random.Random(1)
+        direcciones = ['10.%d.%d.%d' % (azar.choice([0, 1, 2]),
+                                        azar.randint(0, 3),
+                                        azar.randint(0, 255))
+                       for _ in range(500)] + ['2001:db8::1', '2001:db9::1']
+        puertos = [azar.choice([22, 53, 80, 6881, 6999, 7000])
+                   for _ in direcciones]
+        protocolos = [azar.choice([6, 17]) for _ in direcciones]
+        lector = self.clasificador.lector
+        for grupo in (models.OUTSIDE, models.INSIDE):
+            (inicios, clases) = self.clasificador.clasificar_lote(
+                direcciones, puertos, protocolos, grupo)
+            assert len(inicios) == len(direcciones) + 1
+            for k, flujo in enumerate(zip(direcciones, puertos, protocolos)):
+                esperadas = lector.clasificar(*(flujo + (grupo,)))
+                assert clases[inicios[k]:inicios[k + 1]].tolist() == \
+                    esperadas
+
+    def test_clasificar_enteros(self):
+        '''
+        Prueba clasificar direcciones IPv4 expresadas como enteros.
+        '''
+        direcciones = clasificador.numpy.array([0x0a010203, 0xc0a80001],
+                                               clasificador.numpy.uint32)
+        (inicios, clases) = self.clasificador.clasificar_lote(
+            direcciones, [80, 80], [6, 6])
+        assert inicios.tolist() == [0, 2, 2]
+        assert clases.tolist() == [60606060, 60606061]
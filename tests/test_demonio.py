@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+'''
+Pruebas del modulo demonio.
+
+Se prueban la espera entre ciclos y la detencion del demonio.
+'''
+import unittest
+from mock import Mock, patch
+from netcop.actualizador.demonio import Demonio
+
+
+class DemonioTests(unittest.TestCase):
+
+    def test_espera(self):
+        '''
+        Prueba que la espera se duplique con cada fallo hasta el maximo.
+        '''
+        # preparo datos
+        demonio = Demonio(Mock(), intervalo=60, variacion=0,
+                          espera_maxima=300)
+        # verifico que todo este bien
+        assert demonio.espera(0) == 60
+        assert demonio.espera(1) == 120
+        assert demonio.espera(2) == 240
+        assert demonio.espera(10) == 300
+
+    def test_espera_variacion(self):
+        '''
+        Prueba que la variacion aleatoria se sume al intervalo.
+        '''
+        demonio = Demonio(Mock(), intervalo=60, variacion=10)
+        for _ in range(100):
+            assert 60 <= demonio.espera(0) <= 70
+
+    @patch('signal.signal')
+    def test_ejecutar(self, mock_signal):
+        '''
+        Prueba que el demonio siga ante fallos y termine al detenerse.
+        '''
+        # preparo datos
+        llamadas = []
+
+        def ciclo():
+            llamadas.append(1)
+            if len(llamadas) == 1:
+                raise IOError()
+            demonio.detener()
+        demonio = Demonio(ciclo, intervalo=0)
+        # llamo metodo a probar
+        demonio.ejecutar()
+        # verifico que todo este bien
+        assert len(llamadas) == 2
+        assert mock_signal.call_count == 2
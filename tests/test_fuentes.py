@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+'''
+Pruebas del modulo fuentes.
+
+Se prueba la lectura de versiones desde archivos y directorios locales.
+'''
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from netcop.actualizador import fuentes
+from netcop.actualizador.actualizador import Actualizador, DeltaInvalida
+
+
+class FuentesTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directorio)
+        self.actualizador = Actualizador()
+
+    def escribir(self, nombre, documento):
+        ruta = os.path.join(self.directorio, nombre)
+        abrir = gzip.open if nombre.endswith('.gz') else open
+        with abrir(ruta, 'wb') as f:
+            f.write(json.dumps(documento).encode('utf-8'))
+        return ruta
+
+    def test_leer_archivo(self):
+        '''
+        Prueba leer archivos mapeados en memoria y comprimidos.
+        '''
+        datos = b'x' * (fuentes.TROZO + 10)
+        ruta = os.path.join(self.directorio, 'datos.json')
+        with open(ruta, 'wb') as f:
+            f.write(datos)
+        trozos = list(fuentes.leer_archivo(ruta))
+        assert len(trozos) == 2
+        assert b''.join(trozos) == datos
+        with gzip.open(ruta + '.gz', 'wb') as f:
+            f.write(datos)
+        assert b''.join(fuentes.leer_archivo(ruta + '.gz')) == datos
+        open(ruta, 'wb').close()
+        assert list(fuentes.leer_archivo(ruta)) == []
+
+    def test_fusionar(self):
+        '''
+        Prueba mezclar partes ordenadas por id.
+        '''
+        partes = [('a', [{'id': 1}, {'id': 3, 'parte': 'a'}, {'id': 5}]),
+                  ('b', [{'id': 2}, {'id': 3, 'parte': 'b'}])]
+        assert list(fuentes.fusionar(partes)) == [
+            {'id': 1}, {'id': 2}, {'id': 3, 'parte': 'b'}, {'id': 5}]
+        with self.assertRaises(ValueError):
+            list(fuentes.fusionar([('a', [{'id': 2}, {'id': 1}]),
+                                   ('b', [])]))
+
+    def test_archivo(self):
+        '''
+        Prueba una version guardada en un unico archivo.
+        '''
+        ruta = self.escribir('firmas.json', {
+            'version': 'v1', 'clases': [{'id': 2}, {'id': 1}]})
+        fuente = fuentes.FuenteLocal(self.actualizador, ruta)
+        assert fuente.version() == 'v1'
+        assert not fuente.incremental()
+        assert list(fuente.clases(delta=True)) == [{'id': 2}, {'id': 1}]
+        (leer, delta) = self.actualizador.descarga
+        assert list(leer()) == [{'id': 2}, {'id': 1}]
+        assert not delta
+
+    def test_directorio(self):
+        '''
+        Prueba una version dividida en varios archivos.
+        '''
+        self.escribir('1.json', {'version': 'v1',
+                                 'clases': [{'id': 1}, {'id': 4}]})
+        self.escribir('2.json.gz', {'version': 'v1',
+                                    'clases': [{'id': 2}, {'id': 3}]})
+        self.escribir('notas.txt', {})
+        fuente = fuentes.FuenteLocal(self.actualizador, self.directorio)
+        assert fuente.version() == 'v1'
+        assert [c['id'] for c in fuente.clases()] == [1, 2, 3, 4]
+        # la version se puede indicar aparte
+        self.escribir('version', {'version': 'v2'})
+        assert fuente.version() == 'v2'
+
+    def test_incremental(self):
+        '''
+        Prueba detectar una actualizacion incremental.
+        '''
+        ruta = self.escribir('delta.json', {
+            'version': 'v2', 'base': 'v1', 'agregadas': [{'id': 1}]})
+        fuente = fuentes.FuenteLocal(self.actualizador, ruta)
+        assert fuente.incremental()
+        self.actualizador.version_actual = 'v1'
+        assert list(fuente.clases()) == [{'id': 1}]
+
+    def test_directorio_incremental(self):
+        '''
+        Prueba aplicar actualizaciones incrementales divididas en varios
+        archivos sobre la version completa del directorio.
+        '''
+        completa = self.escribir('1.json', {
+            'version': 'v1', 'clases': [{'id': 1}, {'id': 3}, {'id': 5}]})
+        self.escribir('2.json', {
+            'version': 'v2', 'base': 'v1',
+            'agregadas': [{'id': 6}],
+            'modificadas': [{'id': 3, 'parte': 2}],
+            'eliminadas': [1]})
+        self.escribir('3.json.gz', {
+            'version': 'v2', 'base': 'v1',
+            'agregadas': [{'id': 2}],
+            'modificadas': [{'id': 3, 'parte': 3}]})
+        fuente = fuentes.FuenteLocal(self.actualizador, self.directorio)
+        assert fuente.version() == 'v2'
+        assert not fuente.incremental()
+        esperadas = [{'id': 1, 'eliminada': True}, {'id': 3, 'parte': 3},
+                     {'id': 5}, {'id': 2}, {'id': 6}]
+        assert list(fuente.clases()) == esperadas
+        assert list(self.actualizador.descarga[0]()) == esperadas
+        # sin la version completa parten de la version instalada
+        os.remove(completa)
+        assert fuente.incremental()
+        self.actualizador.version_actual = 'v1'
+        assert [c['id'] for c in fuente.clases()] == [1, 2, 3, 6]
+        self.actualizador.version_actual = 'v0'
+        with self.assertRaises(DeltaInvalida):
+            list(fuente.clases())
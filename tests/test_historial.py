@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+'''
+Pruebas del modulo historial.
+'''
+import os
+import shutil
+import tempfile
+import unittest
+from netcop.actualizador import historial, lector
+
+
+class HistorialTests(unittest.TestCase):
+
+    def setUp(self):
+        directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directorio)
+        self.historial = historial.Historial(
+            os.path.join(directorio, 'historial'), 2)
+
+    def clases(self, entrada):
+        return [valor for clave, valor in
+                lector.iterar(self.historial.leer(entrada))
+                if clave == 'clases']
+
+    def test_guardar(self):
+        '''
+        Prueba guardar versiones conservando solo las ultimas.
+        '''
+        clases = [{'id': 1, 'subredes_outside': ['10.0.0.0/8'],
+                   'puertos_inside': ['80/tcp', '443/tcp']},
+                  {'id': 2}]
+        entrada = self.historial.guardar('v1\n', clases, {'segundos': 1.5})
+        assert entrada['version'] == 'v1'
+        assert (entrada['clases'], entrada['redes'],
+                entrada['puertos']) == (2, 1, 2)
+        assert entrada['segundos'] == 1.5
+        assert self.clases(entrada) == clases
+        self.historial.guardar('v2', [], {})
+        self.historial.guardar('v3', [{'id': 3}], {})
+        versiones = [e['version'] for e in self.historial.entradas()]
+        assert versiones == ['v3', 'v2']
+        assert not os.path.exists(self.historial.ruta(entrada['archivo']))
+        assert self.historial.buscar('v')['version'] == 'v3'
+        assert self.historial.buscar('v4') is None
+        assert self.historial.anterior('v3')['version'] == 'v2'
+        assert self.historial.anterior(None)['version'] == 'v3'
+
+    def test_descartar(self):
+        '''
+        Prueba marcar versiones como descartadas.
+        '''
+        assert not self.historial.descartada('v1')
+        for version in ('v1', 'v2', 'v3'):
+            self.historial.descartar(version + '\n')
+        assert self.historial.descartada('v3')
+        assert self.historial.descartada('v2\n')
+        assert not self.historial.descartada('v1')
+
+    def test_combinar(self):
+        '''
+        Prueba combinar una version con una actualizacion incremental.
+        '''
+        base = [{'id': 1}, {'id': 2}, {'id': 3}]
+        cambios = [{'id': 4, 'nombre': 'nueva'},
+                   {'id': 2, 'nombre': 'modificada'},
+                   {'id': 3, 'eliminada': True}]
+        assert list(historial.combinar(base, cambios)) == [
+            {'id': 1}, {'id': 2, 'nombre': 'modificada'},
+            {'id': 4, 'nombre': 'nueva'}]
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+'''
+Pruebas del modulo indice.
+
+Se prueba compilar las clases activas en el indice binario y consultarlo.
+'''
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from netcop.actualizador import indice, models
+
+
+class IndiceTests(unittest.TestCase):
+
+    def setUp(self):
+        models.db.create_tables(
+            [models.ClaseTrafico, models.CIDR, models.Puerto, models.ClaseCIDR,
+             models.ClasePuerto],
+            safe=True)
+        directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directorio)
+        self.ruta = os.path.join(directorio, 'version.indice')
+
+    def crear_clase(self, id_clase, redes=(), puertos=(), activa=True):
+        '''
+        Crea una clase con subredes (direccion, prefijo, grupo) y puertos
+        (numero, numero_fin, protocolo, grupo).
+        '''
+        clase = models.ClaseTrafico.create(id_clase=id_clase, nombre='foo',
+                                           descripcion='bar', activa=activa)
+        for (direccion, prefijo, grupo) in redes:
+            cidr = models.CIDR.create(direccion=direccion, prefijo=prefijo)
+            models.ClaseCIDR.create(clase=clase, cidr=cidr, grupo=grupo)
+        for (numero, numero_fin, protocolo, grupo) in puertos:
+            puerto = models.Puerto.create(numero=numero,
+                                          numero_fin=numero_fin,
+                                          protocolo=protocolo)
+            models.ClasePuerto.create(clase=clase, puerto=puerto,
+                                      grupo=grupo)
+
+    def test_segmentar(self):
+        '''
+        Prueba convertir intervalos solapados en intervalos disjuntos.
+        '''
+        segmentos = indice.segmentar([(0, 9, 1), (5, 14, 2), (10, 19, 1)],
+                                     255)
+        assert segmentos == [(0, [1]), (5, [1, 2]), (15, [1]), (20, [])]
+        assert indice.segmentar([(0, 255, 1)], 255) == [(0, [1])]
+
+    def test_compilar(self):
+        '''
+        Prueba compilar y consultar las clases activas.
+        '''
+        # creo transaccion para descartar cambios generados en la base
+        with models.db.atomic() as transaction:
+            # preparo datos
+            self.crear_clase(60606060,
+                             redes=[('10.0.0.0', 8, models.OUTSIDE)],
+                             puertos=[(80, 80, 6, models.OUTSIDE)])
+            self.crear_clase(60606061,
+                             redes=[('10.1.0.0', 16, models.OUTSIDE),
+                                    ('2001:db8::', 32, models.OUTSIDE)])
+            self.crear_clase(60606062,
+                             puertos=[(6881, 6999, 0, models.INSIDE)])
+            self.crear_clase(60606063,
+                             redes=[('192.168.0.0', 16, models.OUTSIDE)],
+                             activa=False)
+            # llamo metodo a probar
+            indice.escribir(self.ruta, indice.compilar(u'abc'))
+            # descarto cambios en la base de datos
+            transaction.rollback()
+        # verifico que todo este bien
+        assert not os.path.exists(self.ruta + '.tmp')
+        with indice.Indice(self.ruta) as leido:
+            assert leido.version == u'abc'
+            assert leido.clases == (60606060, 60606061, 60606062)
+            assert leido.clasificar('10.1.2.3', 80, 6) == \
+                [60606060, 60606061]
+            assert leido.clasificar('10.1.2.3', 443, 6) == [60606061]
+            assert leido.clasificar('10.2.0.1', 443, 6) == []
+            assert leido.clasificar('2001:db8::1', 53, 17) == [60606061]
+            assert leido.clasificar('10.2.0.1', 6900, 17,
+                                    models.INSIDE) == [60606062]
+            assert leido.clasificar('10.2.0.1', 6900, 17) == []
+            assert leido.clases_red('9.255.255.255', models.OUTSIDE) == \
+                set()
+            assert leido.clasificar('192.168.1.1', 80, 6) == []
+
+    def test_formato_desconocido(self):
+        '''
+        Prueba que se rechace un archivo que no es un indice.
+        '''
+        with open(self.ruta, 'wb') as f:
+            f.write(b'\0' * 64)
+        with self.assertRaises(ValueError):
+            indice.Indice(self.ruta)
+
+    def test_lector_sin_orm(self):
+        '''
+        Prueba que leer el indice no cargue el ORM ni la configuracion.
+        '''
+        salida = subprocess.check_output([
+            sys.executable, '-c',
+            'import sys\n'
+            'from netcop.actualizador import indice\n'
+            'print(sorted(m for m in sys.modules if m == "peewee" or '
+            'm.endswith((".models", ".config"))))'])
+        assert salida.strip() == b'[]'
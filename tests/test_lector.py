@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+'''
+Pruebas del modulo lector.
+
+Se prueba la lectura incremental de documentos JSON.
+'''
+import json
+import unittest
+from netcop.actualizador import lector
+
+
+def trocear(documento, largo):
+    '''
+    Divide un documento en trozos de bytes de `largo` bytes.
+    '''
+    datos = json.dumps(documento).encode('utf-8')
+    return [datos[i:i + largo] for i in range(0, len(datos), largo)]
+
+
+class LectorTests(unittest.TestCase):
+
+    def test_iterar(self):
+        '''
+        Prueba que se generen los elementos de los arreglos pedidos y el
+        resto de las claves, sin importar el tamaño de los trozos.
+        '''
+        # preparo datos
+        documento = {
+            'version': 'abc',
+            'serie': 12345,
+            'clases': [
+                {'id': 1, 'nombre': u'ñandú',
+                 'subredes_outside': ['1.1.1.1/32']},
+                {'id': 2, 'nombre': 'bar', 'activa': False},
+            ],
+        }
+        for largo in (1, 2, 3, 7, 1024):
+            # llamo metodo a probar
+            resultado = list(lector.iterar(trocear(documento, largo)))
+            # verifico que todo este bien
+            clases = [v for (k, v) in resultado if k == 'clases']
+            assert clases == documento['clases']
+            assert ('version', 'abc') in resultado
+            assert ('serie', 12345) in resultado
+
+    def test_iterar_vacio(self):
+        '''
+        Prueba objetos y arreglos vacios.
+        '''
+        assert list(lector.iterar([b'{}'])) == []
+        assert list(lector.iterar([b' { "clases" : [ ] } '])) == []
+
+    def test_iterar_incompleto(self):
+        '''
+        Prueba que un documento cortado lance ValueError.
+        '''
+        with self.assertRaises(ValueError):
+            list(lector.iterar([b'{"clases": [{"id": 1}, {"id"']))
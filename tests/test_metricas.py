@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+'''
+Pruebas del modulo metricas.
+
+Se prueba el registro de fases y clases de una ejecucion.
+'''
+import unittest
+from mock import patch
+from netcop.actualizador import metricas
+
+
+class ReporteTests(unittest.TestCase):
+
+    def setUp(self):
+        self.consultas = 0
+        self.reporte = metricas.Reporte(lambda: self.consultas)
+
+    @patch('time.time')
+    def test_fase(self, mock_time):
+        '''
+        Prueba que se acumulen el tiempo y las consultas de cada fase.
+        '''
+        # preparo datos
+        mock_time.side_effect = [10, 12, 20, 21]
+        # llamo metodo a probar
+        for _ in range(2):
+            with self.reporte.fase('descarga'):
+                self.consultas += 3
+        # verifico que todo este bien
+        fase = self.reporte.fases['descarga']
+        assert fase['segundos'] == 3
+        assert fase['consultas'] == 6
+
+    def test_iterar(self):
+        '''
+        Prueba que se midan las iteraciones sin alterar los elementos.
+        '''
+        # llamo metodo a probar
+        elementos = list(self.reporte.iterar('lectura', [1, 2, 3]))
+        # verifico que todo este bien
+        assert elementos == [1, 2, 3]
+        assert 'lectura' in self.reporte.fases
+
+    def test_clases_lentas(self):
+        '''
+        Prueba que el reporte guarde solo las clases mas lentas.
+        '''
+        # llamo metodo a probar
+        for id_clase in range(metricas.LENTAS * 2):
+            self.reporte.clase(id_clase, id_clase)
+        # verifico que todo este bien
+        datos = self.reporte.como_diccionario()
+        assert datos['clases']['cantidad'] == metricas.LENTAS * 2
+        lentas = [c['id'] for c in datos['clases']['lentas']]
+        assert lentas == list(range(metricas.LENTAS * 2 - 1,
+                                    metricas.LENTAS - 1, -1))
+        assert 'clases=%d' % (metricas.LENTAS * 2) in self.reporte.resumen()
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+'''
+Pruebas del modulo migraciones.
+
+Se prueba la conversion de las subredes existentes al tipo inet.
+'''
+import unittest
+from netcop.actualizador import migraciones, models
+
+
+class MigracionesTests(unittest.TestCase):
+
+    def setUp(self):
+        models.db.create_tables(
+            [models.ClaseTrafico, models.CIDR, models.Puerto, models.ClaseCIDR,
+             models.ClasePuerto],
+            safe=True)
+
+    def test_normalizar_cidr(self):
+        '''
+        Prueba unificar subredes duplicadas conservando sus enlaces.
+        '''
+        # creo transaccion para descartar cambios generados en la base
+        with models.db.atomic() as transaction:
+            # simulo el esquema anterior, con la direccion como texto
+            models.db.execute_sql('DROP INDEX IF EXISTS cidr_red')
+            models.db.execute_sql('DROP INDEX cidr_direccion_prefijo')
+            models.db.execute_sql(
+                'ALTER TABLE cidr ALTER COLUMN direccion TYPE varchar(32)')
+            clases = [models.ClaseTrafico.create(id_clase=id_clase,
+                                                 nombre='foo',
+                                                 descripcion='bar')
+                      for id_clase in (60606060, 60606061)]
+            filas = [('10.0.0.0', 8), ('010.000.0.0', 8), ('10.1.1.1', 8),
+                     ('foo', 8)]
+            cidr = [models.CIDR.create(direccion=d, prefijo=p)
+                    for (d, p) in filas]
+            models.ClaseCIDR.create(clase=clases[0], cidr=cidr[1],
+                                    grupo=models.INSIDE)
+            models.ClaseCIDR.create(clase=clases[0], cidr=cidr[2],
+                                    grupo=models.OUTSIDE)
+            models.ClaseCIDR.create(clase=clases[1], cidr=cidr[3],
+                                    grupo=models.OUTSIDE)
+            # ejecuto
+            migraciones.migrar()
+            # verifico
+            assert migraciones.tipo_columna('cidr', 'direccion') == 'inet'
+            assert set(['cidr_direccion_prefijo', 'cidr_red']) <= \
+                migraciones.indices('cidr')
+            assert [(c.id_cidr, c.direccion, c.prefijo)
+                    for c in models.CIDR.select()] == \
+                [(cidr[0].id_cidr, '10.0.0.0', 8)]
+            enlaces = [(e.clase_id, e.cidr_id, e.grupo)
+                       for e in models.ClaseCIDR.select()]
+            assert enlaces == [(60606060, cidr[0].id_cidr, models.INSIDE)]
+            assert [c.id_cidr for c in
+                    models.CIDR.contienen('10.20.30.40')] == [cidr[0].id_cidr]
+            assert list(models.CIDR.contienen('11.0.0.1')) == []
+            # descarto cambios en la base de datos
+            transaction.rollback()
+
+    def test_agregar_rangos(self):
+        '''
+        Prueba que los puertos existentes pasen a ser rangos de un puerto.
+        '''
+        # creo transaccion para descartar cambios generados en la base
+        with models.db.atomic() as transaction:
+            # simulo el esquema anterior, sin el fin del rango
+            models.db.execute_sql('ALTER TABLE puerto DROP COLUMN numero_fin')
+            models.db.execute_sql(
+                'INSERT INTO puerto (numero, protocolo) VALUES (80, 6)')
+            # ejecuto
+            migraciones.migrar()
+            # verifico
+            puerto = models.Puerto.get(models.Puerto.numero == 80)
+            assert puerto.numero_fin == 80
+            # descarto cambios en la base de datos
+            transaction.rollback()
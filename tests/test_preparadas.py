@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+'''
+Pruebas del modulo preparadas.
+'''
+import unittest
+from netcop.actualizador import models, preparadas
+
+
+class SentenciasTests(unittest.TestCase):
+
+    def setUp(self):
+        models.db.create_tables(
+            [models.ClaseTrafico, models.CIDR, models.Puerto, models.ClaseCIDR,
+             models.ClasePuerto],
+            safe=True)
+
+    def test_guardar_clase(self):
+        '''
+        Prueba crear y modificar una clase de sistema sin tocar las
+        personalizadas.
+        '''
+        sentencias = preparadas.Sentencias()
+        # creo transaccion para descartar cambios generados en la base
+        with models.db.atomic() as transaction:
+            models.ClaseTrafico.create(id_clase=60606061, nombre='foo',
+                                       descripcion='', tipo=1)
+            resultados = [
+                sentencias.ejecutar('netcop_guardar_clase', id_clase, nombre,
+                                    '', True, 'abc').fetchall()
+                for (id_clase, nombre) in ((60606060, 'nueva'),
+                                           (60606060, 'otra'),
+                                           (60606061, 'personalizada'))]
+            assert resultados == [[('creada',)], [('modificada',)], []]
+            nombres = dict(models.ClaseTrafico
+                                 .select(models.ClaseTrafico.id_clase,
+                                         models.ClaseTrafico.nombre)
+                                 .tuples())
+            assert nombres[60606060] == 'otra'
+            assert nombres[60606061] == 'foo'
+            # descarto cambios en la base de datos
+            transaction.rollback()
+
+    def test_diferir(self):
+        '''
+        Prueba que las escrituras diferidas se envien juntas y en orden.
+        '''
+        sentencias = preparadas.Sentencias(diferir=True)
+        # creo transaccion para descartar cambios generados en la base
+        with models.db.atomic() as transaction:
+            clase = models.ClaseTrafico.create(id_clase=60606060,
+                                               nombre='foo', descripcion='')
+            cidrs = [models.CIDR.create(direccion=direccion, prefijo=32)
+                     for direccion in ('1.1.1.1', '2.2.2.2')]
+            models.ClaseCIDR.create(clase=clase, cidr=cidrs[0],
+                                    grupo=models.OUTSIDE)
+            # el enlace cambia de grupo: se borra y se vuelve a insertar
+            sentencias.acumular('netcop_enlazar_redes', clase.id_clase,
+                                [c.id_cidr for c in cidrs],
+                                [models.INSIDE, models.INSIDE])
+            sentencias.acumular('netcop_borrar_redes', clase.id_clase,
+                                [cidrs[0].id_cidr])
+            sentencias.terminar_clase()
+            assert models.ClaseCIDR.select().count() == 1
+            for nombre in preparadas.ESCRITURAS:
+                sentencias.cursor(nombre)
+            consultas = models.db.consultas
+            sentencias.enviar()
+            assert models.db.consultas - consultas == 2
+            grupos = set(models.ClaseCIDR.select(models.ClaseCIDR.grupo)
+                                         .tuples())
+            assert grupos == set([(models.INSIDE,)])
+            assert models.ClaseCIDR.select().count() == 2
+            # descarto cambios en la base de datos
+            transaction.rollback()
+
+    def test_reconexion(self):
+        '''
+        Prueba que las sentencias se vuelvan a preparar en una conexion
+        nueva.
+        '''
+        sentencias = preparadas.Sentencias()
+        sentencias.ejecutar('netcop_enlaces', 60606060)
+        models.db.close()
+        models.db.connect()
+        assert sentencias.ejecutar('netcop_enlaces', 60606060).fetchall() == []
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+'''
+Pruebas del modulo redes.
+
+Se prueba la normalizacion de subredes.
+'''
+import unittest
+from mock import patch
+from netcop.actualizador import redes
+
+
+class RedesTests(unittest.TestCase):
+
+    def test_interpretar(self):
+        '''
+        Prueba que distintas escrituras de una subred se normalicen igual.
+        '''
+        for (item, normalizada) in (('10.0.0.0/8', '10.0.0.0/8'),
+                                    ('010.000.0.0/8', '10.0.0.0/8'),
+                                    ('2001:DB8:0::/32', '2001:db8::/32')):
+            assert str(redes.interpretar(item)) == normalizada
+
+    def test_interpretar_invalida(self):
+        '''
+        Prueba que se rechacen las subredes invalidas.
+        '''
+        for item in ('10.0.0.0', '10.0.0.0/33', '10.0.0.256/32', 'foo/8'):
+            with self.assertRaises(ValueError):
+                redes.interpretar(item)
+
+    @patch('syslog.syslog')
+    def test_bits_de_host(self, mock_syslog):
+        '''
+        Prueba que poner en cero los bits de host se registre, o se rechace
+        si la interpretacion es estricta.
+        '''
+        assert str(redes.interpretar('10.1.2.3/8')) == '10.0.0.0/8'
+        mock_syslog.assert_called_once()
+        mock_syslog.reset_mock()
+        assert str(redes.interpretar('010.000.0.0/8', estricta=True)) == \
+            '10.0.0.0/8'
+        mock_syslog.assert_not_called()
+        for item in ('10.1.2.3/8', '2001:db8::1/32'):
+            with self.assertRaises(ValueError):
+                redes.interpretar(item, estricta=True)
+
+    def test_agregar(self):
+        '''
+        Prueba unir subredes contenidas, solapadas y adyacentes.
+        '''
+        subredes = [redes.interpretar(item) for item in
+                    ('10.0.0.0/24', '10.0.0.5/32', '10.0.1.0/24',
+                     '192.168.0.1/32', '2001:db8::/33', '2001:db8:8000::/33')]
+        assert [str(red) for red in redes.agregar(subredes)] == \
+            ['10.0.0.0/23', '192.168.0.1/32', '2001:db8::/32']
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+'''
+Pruebas del modulo sombra.
+
+Se prueba aplicar una actualizacion en tablas sombra y publicarla.
+'''
+import unittest
+from mock import patch
+from netcop.actualizador import models, sombra
+from netcop.actualizador.actualizador import Actualizador
+
+
+class CargaSombraTests(unittest.TestCase):
+
+    def setUp(self):
+        models.db.create_tables(
+            [models.ClaseTrafico, models.CIDR, models.Puerto, models.ClaseCIDR,
+             models.ClasePuerto],
+            safe=True)
+        self.carga = sombra.CargaSombra(Actualizador())
+
+    def restricciones(self, tabla):
+        '''
+        Devuelve los nombres de las restricciones e indices de una tabla.
+        '''
+        cursor = models.db.execute_sql(
+            '''SELECT conname FROM pg_constraint
+               WHERE conrelid = %s::regclass
+               UNION
+               SELECT indexrelid::regclass::text FROM pg_index
+               WHERE indrelid = %s::regclass''', (tabla, tabla))
+        return set(fila[0] for fila in cursor.fetchall())
+
+    def test_aplicar(self):
+        '''
+        Prueba aplicar clases nuevas, modificadas, eliminadas y
+        personalizadas y conservar los enlaces de las demas.
+        '''
+        # creo transaccion para descartar cambios generados en la base
+        with models.db.atomic() as transaction:
+            # preparo datos
+            existente = models.ClaseTrafico.create(id_clase=60606060,
+                                                   nombre='foo',
+                                                   descripcion='bar')
+            cidr = models.CIDR.create(direccion='1.1.1.1', prefijo=32)
+            models.ClaseCIDR.create(clase=existente, cidr=cidr,
+                                    grupo=models.OUTSIDE)
+            personalizada = models.ClaseTrafico.create(id_clase=60606061,
+                                                       nombre='foo',
+                                                       descripcion='bar',
+                                                       tipo=1)
+            models.ClaseCIDR.create(clase=personalizada, cidr=cidr,
+                                    grupo=models.INSIDE)
+            eliminada = models.ClaseTrafico.create(id_clase=60606062,
+                                                   nombre='foo',
+                                                   descripcion='bar')
+            puerto = models.Puerto.create(numero=22, protocolo=6)
+            models.ClasePuerto.create(clase=eliminada, puerto=puerto,
+                                      grupo=models.OUTSIDE)
+            antes = (self.restricciones('clase_cidr'),
+                     self.restricciones('clase_puerto'))
+            clases = [
+                {
+                    'id': 60606060,
+                    'nombre': 'otro',
+                    'subredes_outside': ['2.2.2.0/24'],
+                    'puertos_inside': ['53/udp', '6881-6999/tcp'],
+                },
+                {
+                    'id': 60606061,
+                    'nombre': 'pepe',
+                    'subredes_outside': ['3.3.3.3/32'],
+                },
+                {'id': 60606062, 'eliminada': True},
+                {'id': 60606063, 'nombre': 'nueva',
+                 'subredes_inside': ['10.0.0.0/8']},
+            ]
+            publicar = self.carga.publicar
+
+            def verificar(cursor, parametros):
+                # los enlaces se traducen antes de bloquear las tablas
+                assert not self.carga.actualizador.cambios.enlaces
+                assert self.carga.actualizador.cambios.redes
+                publicar(cursor, parametros)
+            self.carga.publicar = verificar
+            # llamo metodo a probar
+            self.carga.aplicar(clases)
+            # verifico que todo este bien
+            saved = models.ClaseTrafico.get(
+                models.ClaseTrafico.id_clase == 60606060)
+            assert saved.nombre == 'otro'
+            assert [(r.cidr.direccion, r.cidr.prefijo, r.grupo)
+                    for r in saved.redes] == \
+                [('2.2.2.0', 24, models.OUTSIDE)]
+            assert sorted((p.puerto.numero, p.puerto.numero_fin,
+                           p.puerto.protocolo) for p in saved.puertos) == \
+                [(53, 53, 17), (6881, 6999, 6)]
+            saved = models.ClaseTrafico.get(
+                models.ClaseTrafico.id_clase == 60606061)
+            assert saved.nombre == 'foo'
+            assert [(r.cidr.direccion, r.grupo) for r in saved.redes] == \
+                [('1.1.1.1', models.INSIDE)]
+            saved = models.ClaseTrafico.get(
+                models.ClaseTrafico.id_clase == 60606062)
+            assert not saved.activa
+            assert saved.puertos.count() == 1
+            saved = models.ClaseTrafico.get(
+                models.ClaseTrafico.id_clase == 60606063)
+            assert saved.tipo == models.ClaseTrafico.SISTEMA
+            assert saved.redes.count() == 1
+            # las tablas publicadas conservan sus restricciones e indices
+            assert (self.restricciones('clase_cidr'),
+                    self.restricciones('clase_puerto')) == antes
+            # las tablas publicadas tienen estadisticas
+            for tabla in ('clase_cidr', 'clase_puerto'):
+                (columnas,) = models.db.execute_sql(
+                    'SELECT count(*) FROM pg_stats WHERE tablename = %s',
+                    (tabla,)).fetchone()
+                assert columnas
+            cambios = self.carga.actualizador.cambios
+            assert cambios.creadas == set([60606063])
+            assert cambios.modificadas == set([60606060])
+            assert cambios.desactivadas == set([60606062])
+            assert cambios.redes[60606060] == {
+                'agregadas': [('2.2.2.0', 24, models.OUTSIDE)],
+                'eliminadas': [('1.1.1.1', 32, models.OUTSIDE)],
+            }
+            # descarto cambios en la base de datos
+            transaction.rollback()
+
+    @patch('syslog.syslog')
+    def test_aplicar_con_dependientes(self, mock_syslog):
+        '''
+        Prueba que si una vista depende de las tablas de enlaces la
+        actualizacion se aplique en el lugar sin borrar la vista.
+        '''
+        # creo transaccion para descartar cambios generados en la base
+        with models.db.atomic() as transaction:
+            # preparo datos
+            models.db.execute_sql(
+                'CREATE VIEW vista_clase_cidr AS SELECT * FROM clase_cidr')
+            clases = [{'id': 60606063, 'nombre': 'nueva',
+                       'subredes_inside': ['10.0.0.0/8']}]
+            publicar = self.carga.publicar
+            self.carga.publicar = None
+            # llamo metodo a probar
+            self.carga.aplicar(clases)
+            self.carga.publicar = publicar
+            # verifico que todo este bien
+            assert 'vista_clase_cidr' in mock_syslog.call_args[0][1]
+            saved = models.ClaseTrafico.get(
+                models.ClaseTrafico.id_clase == 60606063)
+            assert saved.redes.count() == 1
+            (enlaces,) = models.db.execute_sql(
+                'SELECT count(*) FROM vista_clase_cidr '
+                'WHERE id_clase = 60606063').fetchone()
+            assert enlaces == 1
+            assert self.carga.actualizador.cambios.creadas == \
+                set([60606063])
+            # descarto cambios en la base de datos
+            transaction.rollback()
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+'''
+Pruebas del modulo validacion.
+'''
+import unittest
+from mock import patch
+from netcop.actualizador import validacion
+
+
+class ValidacionTests(unittest.TestCase):
+
+    def test_puerto(self):
+        '''
+        Prueba interpretar puertos y rangos.
+        '''
+        assert validacion.puerto('80') == (80, 80, '')
+        assert validacion.puerto('0-65535/UDP') == (0, 65535, 'udp')
+        for item in ('80/tcp/x', '1-2-3', 'http', '-1', '70000/tcp',
+                     '90-80', '53/icmp', ''):
+            with self.assertRaises(ValueError):
+                validacion.puerto(item)
+
+    def test_validar_clase(self):
+        '''
+        Prueba que se informen todos los errores de una clase.
+        '''
+        assert validacion.validar_clase({'id': 1, 'eliminada': True}) == []
+        assert validacion.validar_clase({
+            'id': 1, 'nombre': 'foo',
+            'subredes_outside': ['10.0.0.0/8', '1.1.1.1/32'],
+            'subredes_inside': ['10.0.0.0/8'],
+            'puertos_outside': ['80/tcp', '1000-2000'],
+        }) == []
+        errores = validacion.validar_clase({
+            'id': 1, 'nombre': 'x' * 33,
+            'subredes_outside': ['10.0.0.0/8', '010.0.0.1/8', '10.0.0.0',
+                                 '300.0.0.0/8', '10.0.0.0/33', 5],
+            'puertos_inside': '80',
+            'puertos_outside': ['80/tcp', '80/TCP', '80/sctp'],
+        })
+        assert len(errores) == 9
+        assert "clase 1: subredes_outside '010.0.0.1/8': 10.0.0.1/8 tiene " \
+            "bits de host en uno" in errores
+        assert all(error.startswith('clase 1: ') for error in errores)
+        assert validacion.validar_clase({'nombre': 'foo'}) == [
+            'clase con id invalido: None']
+        assert validacion.validar_clase([1]) == ['clase invalida: [1]']
+
+    def test_validar(self):
+        '''
+        Prueba validar una version completa.
+        '''
+        validacion.validar([{'id': 1}, {'id': 2, 'eliminada': True}])
+        with self.assertRaises(validacion.VersionInvalida) as contexto:
+            validacion.validar([{'id': 1}, {'id': 1, 'eliminada': True},
+                                {'id': 'x'}])
+        assert contexto.exception.errores == [
+            "clase con id invalido: 'x'", 'clase 1 repetida']
+
+    @patch.object(validacion, 'LOTE', 3)
+    def test_validar_pool(self):
+        '''
+        Prueba validar en varios procesos una version de varios lotes.
+        '''
+        clases = [{'id': i, 'puertos_outside': ['%d/tcp' % (i * 10000)]}
+                  for i in range(10)]
+        with self.assertRaises(validacion.VersionInvalida) as contexto:
+            validacion.validar(iter(clases + [{'id': 3}]), procesos=2)
+        assert contexto.exception.errores == [
+            "clase 7: puertos_outside '70000/tcp': puerto fuera de rango",
+            "clase 8: puertos_outside '80000/tcp': puerto fuera de rango",
+            "clase 9: puertos_outside '90000/tcp': puerto fuera de rango",
+            'clase 3 repetida']